@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local command and telemetry server for the arm.
+
+One process owns the port; lab tools connect over a Unix domain socket (or
+loopback TCP) and share the arm. The server runs a bus tick at a fixed rate
+and coalesces whatever the clients sent since the last tick into it:
+
+    all goal requests       -> merged per joint, one sync write of goals
+    all generic writes      -> one sync write per (address, length)
+    all reads + telemetry   -> one sync read of current, velocity, position
+
+so ten clients cost the same bus time as one. The blocking bus calls run in
+a single worker thread, the clients are served by asyncio.
+
+Framing, both directions: '<HBB' body length, type, request id, then the
+body. Requests with id 0 get no reply; pipelining several frames in one
+send is how a client batches (they land in the same tick).
+
+    GOALS      u8 joint mask, i32 x 4                  reply: empty, once written
+    WRITE      u16 address, u8 length, i32 x 4         reply: empty, once written
+    READ       u8 field mask (1 current, 2 velocity, 4 position)
+                                                       reply: STATE of those fields
+    SUBSCRIBE  u16 decimation (every n-th tick)        then TELEMETRY frames, id 0
+    UNSUBSCRIBE
+
+STATE / TELEMETRY bodies: i64 timestamp (us), then i16 x 4 currents,
+i32 x 4 velocities, i32 x 4 positions, the fields in the mask (TELEMETRY
+has all three, 48 bytes). Subscribers that don't keep up lose frames
+instead of slowing the bus.
+
+Usage:
+    python ArmServer.py serve [rate]         owns the arm, socket SOCKET_PATH
+    python ArmServer.py read                 one READ through the server
+    python ArmServer.py watch [decimation]   prints the telemetry stream
+
+"""
+
+import asyncio
+import os
+import socket
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from WireModel import control_rate
+
+
+SOCKET_PATH = '/tmp/dxl_arm.sock'
+
+FRAME = struct.Struct('<HBB')
+GOALS = 1
+WRITE = 2
+READ = 3
+SUBSCRIBE = 4
+UNSUBSCRIBE = 5
+STATE = 0x40
+TELEMETRY = 0x41
+ERROR = 0x7f
+
+GOALS_BODY = struct.Struct('<B4i')
+WRITE_BODY = struct.Struct('<HB4i')
+READ_BODY = struct.Struct('<B')
+SUBSCRIBE_BODY = struct.Struct('<H')
+
+CURRENT = 1
+VELOCITY = 2
+POSITION = 4
+ALL_FIELDS = CURRENT | VELOCITY | POSITION
+
+ADDR_GOAL_POSITION = 116
+LEN_GOAL_POSITION = 4
+
+
+def state_struct(mask):
+    return struct.Struct('<q' + ('4h' if mask & CURRENT else '') + ('4i' if mask & VELOCITY else '')
+                         + ('4i' if mask & POSITION else ''))
+
+
+STATE_STRUCTS = [state_struct(mask) for mask in range(ALL_FIELDS + 1)]
+
+
+def pack_state(state, mask):
+    # a Read_Sync_State row -> STATE body with the fields in mask
+    values = [state[0]]
+    if mask & CURRENT:
+        values += state[1:5]
+    if mask & VELOCITY:
+        values += state[5:9]
+    if mask & POSITION:
+        values += state[9:13]
+    return STATE_STRUCTS[mask].pack(*values)
+
+
+def frame(kind, request_id, body = b''):
+    return FRAME.pack(len(body), kind, request_id) + body
+
+
+class _Client:
+    def __init__(self, writer):
+        self.writer = writer
+        self.decimation = 0
+        self.dropped = 0
+
+
+class ArmServer:
+    def __init__(self, reader,
+                 # bus ticks per second. None: what the baud rate keeps up with for a
+                 # tick of one goal write and one state read; a rate above that is refused
+                 rate = None,
+                 # telemetry frames a slow subscriber may have queued before frames are dropped
+                 max_queued = 64):
+        self.reader = reader
+        self.rate = control_rate(reader.baud_rate, rate)
+        self.period = 1. / self.rate
+        self.max_queued = max_queued * (FRAME.size + STATE_STRUCTS[ALL_FIELDS].size)
+        # the only thread that touches the bus
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.clients = set()
+        self.goals = None
+        self.goals_changed = False
+        self.writes = {}
+        self.waiting = []
+        self.ticks = 0
+        self.missed = 0
+
+    def _Transact(self, goals, writes):
+        # runs in the bus thread: the writes, then the read that serves every request
+        for (addr, length), values in writes.items():
+            self.reader.Write_Sync(addr, length, values)
+        if goals is not None:
+            self.reader.Write_Sync(ADDR_GOAL_POSITION, LEN_GOAL_POSITION, goals)
+        return self.reader.Read_Sync_State()
+
+    def _Request(self, client, kind, request_id, body):
+        if kind == GOALS:
+            mask, *goals = GOALS_BODY.unpack(body)
+            for j in range(4):
+                if mask & (1 << j):
+                    self.goals[j] = goals[j]
+            self.goals_changed = True
+        elif kind == WRITE:
+            addr, length, *values = WRITE_BODY.unpack(body)
+            if length not in (1, 2, 4):
+                raise ValueError("invalid write length %d" % length)
+            self.writes[(addr, length)] = values
+        elif kind == READ:
+            mask, = READ_BODY.unpack(body)
+            self.waiting.append((client, request_id, mask & ALL_FIELDS))
+            return
+        elif kind == SUBSCRIBE:
+            client.decimation = max(SUBSCRIBE_BODY.unpack(body)[0], 1)
+        elif kind == UNSUBSCRIBE:
+            client.decimation = 0
+        else:
+            raise ValueError("unknown request type %d" % kind)
+        if request_id:
+            # acknowledged after the tick that carries it
+            self.waiting.append((client, request_id, None))
+
+    async def _Serve(self, reader, writer):
+        client = _Client(writer)
+        self.clients.add(client)
+        try:
+            while True:
+                header = await reader.readexactly(FRAME.size)
+                length, kind, request_id = FRAME.unpack(header)
+                body = await reader.readexactly(length)
+                try:
+                    self._Request(client, kind, request_id, body)
+                except (ValueError, struct.error) as e:
+                    writer.write(frame(ERROR, request_id, str(e).encode()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+
+    async def _Bus(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        while True:
+            goals = list(self.goals) if self.goals_changed else None
+            self.goals_changed = False
+            writes, self.writes = self.writes, {}
+            waiting, self.waiting = self.waiting, []
+            state = await loop.run_in_executor(self.executor, self._Transact, goals, writes)
+            self.ticks += 1
+            for client, request_id, mask in waiting:
+                body = b'' if mask is None else pack_state(state, mask)
+                client.writer.write(frame(STATE, request_id, body))
+            telemetry = None
+            for client in self.clients:
+                if client.decimation and self.ticks % client.decimation == 0:
+                    if client.writer.transport.get_write_buffer_size() > self.max_queued:
+                        client.dropped += 1
+                        continue
+                    if telemetry is None:
+                        telemetry = frame(TELEMETRY, 0, pack_state(state, ALL_FIELDS))
+                    client.writer.write(telemetry)
+            deadline += self.period
+            delay = deadline - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.missed += 1
+                if delay < -self.period:
+                    deadline = loop.time()
+
+    async def Run(self, path = SOCKET_PATH, port = None):
+        # Unix socket at path, or loopback TCP if port is given. Clients are
+        # only accepted once the present pose is known: GOALS merge into it
+        loop = asyncio.get_running_loop()
+        state = await loop.run_in_executor(self.executor, self.reader.Read_Sync_State)
+        self.goals = list(state[9:13])
+        if port is not None:
+            server = await asyncio.start_server(self._Serve, '127.0.0.1', port)
+        else:
+            if os.path.exists(path):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(self._Serve, path)
+        async with server:
+            await self._Bus()
+
+
+class ArmClient:
+    # Blocking client for scripts. Async code can speak the framing directly.
+    def __init__(self, path = SOCKET_PATH, port = None):
+        if port is not None:
+            self.sock = socket.create_connection(('127.0.0.1', port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        self.next_id = 1
+        self.pending = b''
+
+    def _Id(self):
+        request_id = self.next_id
+        self.next_id = self.next_id % 255 + 1
+        return request_id
+
+    def _Recv(self, n):
+        while len(self.pending) < n:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise ConnectionError("server closed the connection")
+            self.pending += chunk
+        data, self.pending = self.pending[:n], self.pending[n:]
+        return data
+
+    def Receive(self):
+        # next frame: (type, request id, body)
+        length, kind, request_id = FRAME.unpack(self._Recv(FRAME.size))
+        return kind, request_id, self._Recv(length)
+
+    def _Wait(self, request_id):
+        # telemetry that arrives in between is dropped
+        while True:
+            kind, rid, body = self.Receive()
+            if kind == ERROR and rid == request_id:
+                raise ValueError(body.decode())
+            if rid == request_id and kind == STATE:
+                return body
+
+    def Send(self, frames):
+        # several frames in one send: they are served in the same tick
+        self.sock.sendall(b''.join(frames))
+
+    def Goals_Frame(self, goals, mask = 0xf, request_id = 0):
+        return frame(GOALS, request_id, GOALS_BODY.pack(mask, *[int(g) for g in goals]))
+
+    def Write_Frame(self, addr, length, values, request_id = 0):
+        return frame(WRITE, request_id, WRITE_BODY.pack(addr, length, *[int(v) for v in values]))
+
+    def Set_Goals(self, goals, mask = 0xf, wait = False):
+        request_id = self._Id() if wait else 0
+        self.Send([self.Goals_Frame(goals, mask, request_id)])
+        if wait:
+            self._Wait(request_id)
+
+    def Read(self, mask = ALL_FIELDS, goals = None):
+        # optionally set goals in the same tick. Returns the unpacked STATE
+        request_id = self._Id()
+        frames = [] if goals is None else [self.Goals_Frame(goals)]
+        self.Send(frames + [frame(READ, request_id, READ_BODY.pack(mask))])
+        return STATE_STRUCTS[mask].unpack(self._Wait(request_id))
+
+    def Subscribe(self, decimation = 1):
+        self.Send([frame(SUBSCRIBE, 0, SUBSCRIBE_BODY.pack(decimation))])
+
+    def Telemetry(self):
+        # yields (13,) arrays like Read_Sync_State rows
+        while True:
+            kind, request_id, body = self.Receive()
+            if kind == TELEMETRY:
+                yield np.array(STATE_STRUCTS[ALL_FIELDS].unpack(body))
+
+    def Close(self):
+        self.sock.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['serve']:
+        from CurrentReader import DynamixelReader
+        rate = float(args[1]) if len(args) > 1 else None
+        reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                                 baud_rate = 115200,
+                                 m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                                 proto_ver = 2,
+                                 read_addr = 126, read_len = 2)
+        server = ArmServer(reader, rate)
+        print("Serving on %s at %.0f Hz" % (SOCKET_PATH, server.rate))
+        try:
+            asyncio.run(server.Run())
+        except KeyboardInterrupt:
+            pass
+        print("%d ticks, %d missed" % (server.ticks, server.missed))
+        del reader
+    elif args[:1] == ['read']:
+        client = ArmClient()
+        print(client.Read())
+        client.Close()
+    elif args[:1] == ['watch']:
+        client = ArmClient()
+        client.Subscribe(int(args[1]) if len(args) > 1 else 20)
+        try:
+            for row in client.Telemetry():
+                print(row.astype(int))
+        except KeyboardInterrupt:
+            pass
+        client.Close()
+    else:
+        print(__doc__)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Asyncio Dynamixel client.
+
+The serial port is opened non-blocking (termios, POSIX) and watched by the
+event loop, status packets are parsed with the pure Python Protocol 2.0
+codec, and every bus call is a coroutine:
+
+    await dxl.ping(id)
+    await dxl.read(id, addr, length) / dxl.write(id, addr, length, value)
+    await dxl.sync_read(ids, addr, length) / dxl.sync_write(ids, addr, length, values)
+    await dxl.bulk_read([(id, addr, length), ...])
+
+The bus is half duplex, so transactions go through a single-owner queue (a
+lock): one instruction out, its status packets back, then the next. Nothing
+busy waits; a task waiting for the bus or for a reply just sleeps in the
+loop, so teleop, telemetry and scripted motions can share one event loop.
+
+Every transaction has a timeout. If it times out or the awaiting task is
+cancelled, the late replies may still be on their way; the next transaction
+first waits them out and clears the parser, so they can't be taken for its
+own.
+
+A status packet with its error field set (an instruction the servo refused,
+or bit 7, the hardware error alert, which stays on until a reboot) raises
+DynamixelError once the transaction is complete. It carries the error byte
+of each id that reported one and the replies, whose data is still valid.
+
+Usage: python AsyncDynamixel.py DEVICE [baud]
+streams the present state at 100 Hz while sweeping motor 103 by a few
+ticks, both in one event loop, for 5 seconds.
+
+"""
+
+import asyncio
+import os
+import sys
+
+import Protocol2
+
+
+class DynamixelError(Exception):
+    def __init__(self, errors, replies):
+        # errors: {id: status error byte}, replies: {id: params} of the transaction
+        Exception.__init__(self, '; '.join('id %d: %s' % (i, Protocol2.error_text(e))
+                                           for i, e in sorted(errors.items())))
+        self.errors = errors
+        self.replies = replies
+
+    def Hardware_Alerts(self):
+        # ids whose servo is in hardware error and needs a reboot
+        return sorted(i for i, e in self.errors.items() if e & Protocol2.HARDWARE_ALERT)
+
+
+class SerialTransport:
+    def __init__(self, device, baud, on_data):
+        import termios
+        speed = getattr(termios, 'B%d' % baud, None)
+        if speed is None:
+            raise ValueError("baud rate %d not supported by termios here" % baud)
+        self.fd = os.open(device, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        attrs = termios.tcgetattr(self.fd)
+        # raw 8N1, reads return whatever is there
+        attrs[0] = 0
+        attrs[1] = 0
+        attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+        attrs[3] = 0
+        attrs[4] = speed
+        attrs[5] = speed
+        attrs[6][termios.VMIN] = 0
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        termios.tcflush(self.fd, termios.TCIOFLUSH)
+        self.on_data = on_data
+        self.loop = asyncio.get_running_loop()
+        self.loop.add_reader(self.fd, self._Readable)
+
+    def _Readable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        if data:
+            self.on_data(data)
+
+    async def Write(self, data):
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self.fd, view)
+                view = view[n:]
+            except BlockingIOError:
+                ready = self.loop.create_future()
+                self.loop.add_writer(self.fd, ready.set_result, None)
+                try:
+                    await ready
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    def Close(self):
+        self.loop.remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class AsyncDynamixel:
+    def __init__(self, transport = None,
+                 baud = 1000000,
+                 # reply timeout on top of the wire time, seconds
+                 timeout = 0.02,
+                 # quiet time after an abandoned transaction, seconds
+                 guard = 0.01):
+        # transport: anything with `async Write(bytes)` that hands received
+        # bytes to self.On_Data. Open() makes a SerialTransport.
+        self.transport = transport
+        self.byte_time = 10. / baud
+        self.timeout = timeout
+        self.guard = guard
+        self.parser = Protocol2.StatusParser()
+        self.lock = asyncio.Lock()
+        self.expect = None
+        self.dirty = False
+        self.errors = {}
+        self.stray = 0
+        self.timeouts = 0
+
+    @classmethod
+    async def Open(cls, device, baud = 1000000, **kw):
+        dxl = cls(None, baud, **kw)
+        dxl.transport = SerialTransport(device, baud, dxl.On_Data)
+        return dxl
+
+    def Close(self):
+        self.transport.Close()
+
+    def On_Data(self, data):
+        for dxl_id, error, params in self.parser.Feed(data):
+            expect = self.expect
+            if expect is None or dxl_id not in expect[0] or dxl_id in expect[1]:
+                self.stray += 1
+                continue
+            if error:
+                self.errors[dxl_id] = error
+                expect[3][dxl_id] = error
+            expect[1][dxl_id] = params
+            if len(expect[1]) == len(expect[0]) and not expect[2].done():
+                expect[2].set_result(expect[1])
+
+    async def _Transact(self, packet, ids = (), reply_len = 0):
+        # sends packet, waits for one status packet from each of ids.
+        # Returns {id: params}, raises DynamixelError if any had an error
+        async with self.lock:
+            if self.dirty:
+                await asyncio.sleep(self.guard)
+                self.parser.Reset()
+                self.dirty = False
+            if not ids:
+                await self.transport.Write(packet)
+                return {}
+            done = asyncio.get_running_loop().create_future()
+            errors = {}
+            self.expect = (set(ids), {}, done, errors)
+            complete = False
+            try:
+                await self.transport.Write(packet)
+                wire = (len(packet) + len(ids) * (11 + reply_len)) * self.byte_time
+                replies = await asyncio.wait_for(done, self.timeout + wire)
+                complete = True
+                if errors:
+                    raise DynamixelError(errors, replies)
+                return replies
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                missing = sorted(set(ids) - set(self.expect[1]))
+                raise TimeoutError("no status from id %s" % ', '.join('%d' % i for i in missing))
+            finally:
+                if not complete:
+                    # timed out or cancelled: replies may still arrive
+                    self.dirty = True
+                self.expect = None
+
+    async def ping(self, dxl_id):
+        # (model number, firmware version), None if nothing answers. A servo
+        # in hardware error still answers
+        try:
+            params = (await self._Transact(Protocol2.ping(dxl_id), [dxl_id], 3))[dxl_id]
+        except TimeoutError:
+            return None
+        except DynamixelError as e:
+            params = e.replies[dxl_id]
+        return Protocol2.decode(params[0:2]), params[2]
+
+    async def read(self, dxl_id, addr, length, signed = False):
+        params = (await self._Transact(Protocol2.read(dxl_id, addr, length), [dxl_id], length))[dxl_id]
+        return Protocol2.decode(params, signed)
+
+    async def write(self, dxl_id, addr, length, value):
+        await self._Transact(Protocol2.write(dxl_id, addr, Protocol2.encode(value, length)), [dxl_id])
+
+    async def reboot(self, dxl_id):
+        await self._Transact(Protocol2.reboot(dxl_id), [dxl_id])
+
+    async def sync_read_bytes(self, ids, addr, length):
+        replies = await self._Transact(Protocol2.sync_read(addr, length, ids), ids, length)
+        return [replies[i] for i in ids]
+
+    async def sync_read(self, ids, addr, length, signed = False):
+        return [Protocol2.decode(p, signed) for p in await self.sync_read_bytes(ids, addr, length)]
+
+    async def sync_write(self, ids, addr, length, values):
+        data = {i: Protocol2.encode(v, length) for i, v in zip(ids, values)}
+        await self._Transact(Protocol2.sync_write(addr, length, data))
+
+    async def bulk_read(self, requests, signed = False):
+        # requests: [(id, addr, length)], one value each
+        ids = [r[0] for r in requests]
+        replies = await self._Transact(Protocol2.bulk_read(requests), ids, max(r[2] for r in requests))
+        return [Protocol2.decode(replies[i], signed) for i in ids]
+
+    async def read_state(self, ids):
+        # like DynamixelReader.Read_Sync_State, minus the timestamp:
+        # currents, velocities, positions of all ids in one sync read
+        raw = await self.sync_read_bytes(ids, 126, 10)
+        return ([Protocol2.decode(p[0:2], True) for p in raw] + [Protocol2.decode(p[2:6], True) for p in raw]
+                + [Protocol2.decode(p[6:10], True) for p in raw])
+
+
+async def _demo(device, baud):
+    import math
+    import time
+    ids = [100, 101, 102, 103]
+    dxl = await AsyncDynamixel.Open(device, baud)
+    for i in ids:
+        print(i, await dxl.ping(i))
+    start = await dxl.sync_read(ids, 132, 4, signed=True)
+    stop = time.perf_counter() + 5.
+
+    async def telemetry():
+        n = 0
+        t = time.perf_counter()
+        while time.perf_counter() < stop:
+            try:
+                state = await dxl.read_state(ids)
+            except DynamixelError as e:
+                print(e)
+                await asyncio.sleep(0.5)
+                continue
+            n += 1
+            if time.perf_counter() - t >= 1.:
+                print("%d states/s, last %s" % (n, state))
+                n = 0
+                t = time.perf_counter()
+            await asyncio.sleep(0.01)
+
+    async def motion():
+        while time.perf_counter() < stop:
+            goals = list(start)
+            goals[3] += int(30 * math.sin(2 * math.pi * 0.5 * time.perf_counter()))
+            await dxl.sync_write(ids, 116, 4, goals)
+            await asyncio.sleep(0.02)
+        await dxl.sync_write(ids, 116, 4, start)
+
+    await asyncio.gather(telemetry(), motion())
+    print("timeouts %d, stray packets %d, errors %s" % (dxl.timeouts, dxl.stray, dxl.errors))
+    dxl.Close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    asyncio.run(_demo(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 115200))
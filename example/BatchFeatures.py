@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Offline feature extraction over recorded current sessions.
+
+Loads recordings in the CurrentReader csv format (Timestamp, Current1..4),
+puts them on a uniform grid, runs the same bandpass the real-time scripts use
+over whole arrays (the four currents plus their norm), and computes windowed
+features per channel: RMS, band energy, zero crossings and spectral centroid.
+
+Sessions are processed in a process pool, and the results are cached on disk
+keyed by the file contents and the pipeline parameters, so re-running an
+analysis only pays for the files or parameters that changed.
+
+Usage: python BatchFeatures.py [--workers N] out1_taps.csv out2_holds.csv ...
+
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter, lfilter_zi
+
+from StreamFilter import butter_bandpass
+from Resampler import resample_block, NYQUIST_MARGIN
+
+
+DEFAULT_PARAMS = {
+    # uniform grid rate, None uses the rate measured in each file
+    'fs': None,
+    'low': 5.,
+    'hi': 100.,
+    'order': 4,
+    # window and hop, in samples
+    'window': 64,
+    'hop': 16,
+    # bands for the band energy feature, in Hz
+    'bands': [[5., 20.], [20., 50.], [50., 100.]],
+    # Hann window before the FFT. Off matches the sliding DFT used on line
+    'taper': True,
+}
+
+FEATURE_NAMES = ['rms', 'band_energy', 'zero_crossings', 'centroid']
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feature_cache')
+
+
+def load_session(path):
+    # Returns timestamps (microseconds) and a (samples, 4) current array
+    d = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+    return d[:, 0], d[:, 1:5]
+
+
+def bandpass_block(x, fs, low, hi, order):
+    # Bandpass every column of x, starting the filter in steady state like StreamingBandpass.
+    # The upper cutoff is lowered below Nyquist if the rate is too low for it
+    b, a = butter_bandpass(low, min(hi, NYQUIST_MARGIN * fs), fs, order=order)
+    zi = lfilter_zi(b, a)[:, None] * x[0]
+    y, _ = lfilter(b, a, x, axis=0, zi=zi)
+    return y
+
+
+def spectral_features(spec, freqs, bands):
+    # spec: power spectrum, bins on the last axis. Returns band energy (..., bands) and centroid
+    total = spec.sum(axis=-1)
+    centroid = (spec @ freqs) / np.where(total > 0, total, 1.)
+    # band energy: one matrix product with a 0/1 band mask
+    mask = np.array([(freqs >= lo) & (freqs < hi) for lo, hi in bands], dtype=float).T
+    return spec @ mask, centroid
+
+
+def window_features(y, fs, window, hop, bands, taper=True):
+    # y: (samples, channels). Returns a dict of (windows, channels[, bands]) arrays
+    w = sliding_window_view(y, window, axis=0)[::hop]           # (windows, channels, window)
+    return features_of_windows(w, fs, bands, taper)
+
+
+def features_of_windows(w, fs, bands, taper=True):
+    # w: (..., window) array of samples
+    window = w.shape[-1]
+    rms = np.sqrt(np.mean(w * w, axis=-1))
+    s = np.signbit(w)
+    zero_crossings = np.count_nonzero(s[..., 1:] != s[..., :-1], axis=-1)
+    if taper:
+        w = w * np.hanning(window)
+    spec = np.abs(np.fft.rfft(w, axis=-1)) ** 2
+    band_energy, centroid = spectral_features(spec, np.fft.rfftfreq(window, 1. / fs), bands)
+    return {'rms': rms, 'band_energy': band_energy,
+            'zero_crossings': zero_crossings, 'centroid': centroid}
+
+
+def extract_features(t, x, params=None):
+    # None if the session is shorter than one window
+    p = dict(DEFAULT_PARAMS)
+    p.update(params or {})
+    if len(t) < 2:
+        return None
+    tg, xg = resample_block(t, x, p['fs'])
+    if tg.size < max(p['window'], 2):
+        return None
+    fs = 1e6 / (tg[1] - tg[0])
+    # the norm the real-time scripts detect on, as a fifth channel
+    xg = np.column_stack([xg, np.sqrt(np.sum(xg * xg, axis=1))])
+    y = bandpass_block(xg, fs, p['low'], p['hi'], p['order'])
+    f = window_features(y, fs, p['window'], p['hop'], p['bands'], p['taper'])
+    # time of the end of every window, so the features are causal
+    f['t'] = tg[p['window'] - 1::p['hop']][:f['rms'].shape[0]]
+    f['fs'] = np.array(fs)
+    return f
+
+
+def cache_key(path, params):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    p = dict(DEFAULT_PARAMS)
+    p.update(params or {})
+    h.update(json.dumps(p, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _run(args):
+    path, params, cache_file = args
+    t, x = load_session(path)
+    f = extract_features(t, x, params)
+    if f is None:
+        print("%s: %d samples, shorter than one window, skipped" % (os.path.basename(path), t.size))
+        return None
+    if cache_file is not None:
+        # write then rename so a crashed worker never leaves half a file behind
+        tmp = cache_file + '.%d.tmp.npz' % os.getpid()
+        np.savez(tmp, **f)
+        os.replace(tmp, cache_file)
+    return f
+
+
+def extract_sessions(paths, params=None, workers=None, cache_dir=CACHE_DIR):
+    # Returns {path: features} for all paths but the too short ones, computing
+    # the uncached ones in parallel
+    results = {}
+    todo = []
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    for path in paths:
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = os.path.join(cache_dir, cache_key(path, params) + '.npz')
+            if os.path.exists(cache_file):
+                with np.load(cache_file) as d:
+                    results[path] = dict(d)
+                continue
+        todo.append((path, params, cache_file))
+    if len(todo) == 1 or workers == 1:
+        for job in todo:
+            f = _run(job)
+            if f is not None:
+                results[job[0]] = f
+    elif todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for job, f in zip(todo, pool.map(_run, todo)):
+                if f is not None:
+                    results[job[0]] = f
+    return results
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    workers = None
+    if len(args) >= 2 and args[0] == '--workers':
+        workers = int(args[1])
+        args = args[2:]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+    results = extract_sessions(args, workers=workers)
+    print("File, windows, fs, mean RMS (motors 1-4, norm)")
+    for path in args:
+        if path not in results:
+            continue
+        f = results[path]
+        print("%s, %d, %.1f, %s" % (os.path.basename(path), f['rms'].shape[0], f['fs'],
+                                    np.array2string(f['rms'].mean(axis=0), precision=2)))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cyclic bus scheduler.
+
+The RS-485 chain is half duplex: every transaction occupies the whole bus,
+so control writes, current sampling, health polling and one-off reads have
+to share a fixed frame. BusScheduler owns the port and runs frames at a
+fixed rate; each frame
+
+    1. runs every control task due (goal sync writes, state sync reads),
+    2. fills the rest of the frame budget with background tasks (low rate
+       polls), the most overdue first,
+    3. then with queued one-off requests,
+
+and leaves the remainder idle. Tasks are budgeted by estimated wire time;
+the estimate starts from the WireModel prediction and is then tracked from
+measured durations. Control tasks are admitted only if they fit the budget
+together, so the control rate stays deterministic; background work that
+doesn't fit waits for a later frame and is counted as deferred. While it
+waits its estimate decays back towards the prediction, so one slow run
+doesn't shut it out, and a task deferred max_deferred frames in a row runs
+in the next frame nothing else ran in. A one-off that doesn't fit doesn't
+hold up the ones queued behind it.
+
+Usage: python BusScheduler.py [rate]
+runs state reads + goal writes as control, hardware error and temperature
+polls as background, and prints the frame statistics every second. Without
+a rate it runs as fast as the wire model says the control cycle fits the
+budget (at most 200 Hz).
+
+"""
+
+import sys
+import time
+from collections import deque
+
+from RateLoop import RateLoop
+from WireModel import WireModel, ARM_CYCLE
+
+
+class BusTask:
+    def __init__(self, name, fn, cost, period = 1, callback = None):
+        # fn() does one transaction; callback(result) gets what it returns
+        self.name = name
+        self.fn = fn
+        self.cost = cost
+        # the prediction the tracked cost decays back to while the task waits
+        self.estimate = cost
+        self.period = period
+        self.callback = callback
+        self.next_frame = 0
+        self.runs = 0
+        self.deferred = 0
+        # frames deferred since it last ran
+        self.waiting = 0
+        self.worst = 0.
+
+    def Run(self):
+        t = time.perf_counter()
+        result = self.fn()
+        dt = time.perf_counter() - t
+        # track the measured cost, quick to go up, slow to come down
+        self.cost = dt if dt > self.cost else 0.9 * self.cost + 0.1 * dt
+        self.worst = max(self.worst, dt)
+        self.runs += 1
+        if self.callback is not None:
+            self.callback(result)
+        return dt
+
+
+class BusScheduler:
+    def __init__(self,
+                 rate = 200.,
+                 # share of the frame the scheduler may fill
+                 budget = 0.8,
+                 # frames a task may wait before it runs in the next frame with nothing else in it
+                 max_deferred = 50,
+                 # per deferral, the cost estimate of a waiting task shrinks by this factor
+                 decay = 0.9):
+        self.loop = RateLoop(rate)
+        self.frame_time = budget / rate
+        self.max_deferred = max_deferred
+        self.decay = decay
+        self.control = []
+        self.background = []
+        self.oneoff = deque()
+        self.frame = 0
+        self.overruns = 0
+        self.used = 0.
+
+    def Add_Control(self, name, fn, cost, period = 1, callback = None):
+        task = BusTask(name, fn, cost, period, callback)
+        load = sum(t.cost / t.period for t in self.control) + cost / period
+        if load > self.frame_time:
+            raise ValueError("control task '%s' doesn't fit: %.2f ms per frame, budget %.2f ms" % (
+                name, 1e3 * load, 1e3 * self.frame_time))
+        self.control.append(task)
+        return task
+
+    def Add_Background(self, name, fn, cost, period, callback = None):
+        task = BusTask(name, fn, cost, period, callback)
+        self.background.append(task)
+        return task
+
+    def Submit(self, name, fn, cost, callback = None):
+        # one-off transaction, run in the first frame with room for it
+        self.oneoff.append(BusTask(name, fn, cost, 1, callback))
+
+    def _Admit(self, task, used):
+        # True if the task runs in this frame, else it is counted as deferred
+        if used + task.cost <= self.frame_time:
+            return True
+        if used == 0. and task.waiting >= self.max_deferred:
+            # starved: takes a frame nothing else ran in, even if it doesn't fit
+            return True
+        task.deferred += 1
+        task.waiting += 1
+        # one slow run must not shut the task out: the estimate goes back
+        # towards the prediction while it waits
+        task.cost = max(task.estimate, self.decay * task.cost)
+        return False
+
+    def _Run(self, task):
+        dt = task.Run()
+        task.waiting = 0
+        # an estimate above the frame would never fit again
+        task.cost = min(task.cost, self.frame_time)
+        return dt
+
+    def Run_Frame(self):
+        frame = self.frame
+        used = 0.
+        for task in self.control:
+            if frame >= task.next_frame:
+                used += task.Run()
+                task.next_frame = frame + task.period
+        if used > self.frame_time:
+            self.overruns += 1
+        # background: most overdue first, as long as the estimate fits
+        due = [t for t in self.background if frame >= t.next_frame]
+        due.sort(key=lambda t: t.next_frame)
+        for task in due:
+            if self._Admit(task, used):
+                used += self._Run(task)
+                task.next_frame = frame + task.period
+        # one-offs in order, those that don't fit wait without holding up the rest
+        waiting = deque()
+        while self.oneoff:
+            task = self.oneoff.popleft()
+            if self._Admit(task, used):
+                used += self._Run(task)
+            else:
+                waiting.append(task)
+        self.oneoff = waiting
+        self.used = used
+        self.frame += 1
+        return used
+
+    def Run(self, duration, report = None):
+        # report(scheduler) is called once a second
+        self.loop.Start()
+        t = 0.
+        next_report = 1.
+        while t < duration:
+            self.Run_Frame()
+            t = self.loop.Wait()
+            if report is not None and t >= next_report:
+                report(self)
+                next_report += 1.
+
+    def Report(self):
+        lines = [self.loop.Report() + ", %d frames over budget" % self.overruns]
+        for task in self.control + self.background:
+            lines.append("  %-16s %6d runs  %6d deferred  est %.2f ms  worst %.2f ms" % (
+                task.name, task.runs, task.deferred, 1e3 * task.cost, 1e3 * task.worst))
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    from CurrentReader import DynamixelReader
+    baud = 115200
+    model = WireModel(baud)
+    budget = 0.8
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else min(200., int(budget * model.Max_Rate(ARM_CYCLE)))
+    print("Frame rate %.0f Hz" % rate)
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = baud,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+    ADDR_PRO_GOAL_POSITION = 116
+    ADDR_HARDWARE_ERROR_STATUS = 70
+    ADDR_PRESENT_TEMPERATURE = 146
+    ids = [reader.m1id, reader.m2id, reader.m3id, reader.m4id]
+    state = [reader.Read_Sync_State()]
+    goals = state[0][9:13]
+    health = {}
+
+    scheduler = BusScheduler(rate, budget)
+    try:
+        scheduler.Add_Control('state', reader.Read_Sync_State, model.Time('sync_read', 4, 10),
+                              callback=lambda s: state.__setitem__(0, s))
+        scheduler.Add_Control('goals', lambda: reader.Write_Sync(ADDR_PRO_GOAL_POSITION, 4, goals),
+                              model.Time('sync_write', 4, 4))
+    except ValueError as e:
+        print(e)
+        del reader
+        sys.exit(1)
+    for motorId in ids:
+        scheduler.Add_Background('error %d' % motorId,
+                                 lambda m=motorId: reader.Read_Value(m, ADDR_HARDWARE_ERROR_STATUS, 1),
+                                 model.Time('read', 1, 1), int(rate),
+                                 lambda v, m=motorId: health.__setitem__(('error', m), v))
+        scheduler.Add_Background('temperature %d' % motorId,
+                                 lambda m=motorId: reader.Read_Value(m, ADDR_PRESENT_TEMPERATURE, 1),
+                                 model.Time('read', 1, 1), int(rate),
+                                 lambda v, m=motorId: health.__setitem__(('temperature', m), v))
+
+    def report(s):
+        print(s.Report())
+        print("  state %s health %s" % (state[0], health))
+
+    try:
+        scheduler.Run(10., report)
+    except KeyboardInterrupt:
+        pass
+    del reader
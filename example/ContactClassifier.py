@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Online tap / hold / slide classification of confirmed contacts.
+
+IncrementalFeatures keeps the same window features BatchFeatures computes
+(RMS, band energy, zero crossings, spectral centroid, no taper) up to date
+in O(1) work per sample: running sums for RMS and zero crossings and a
+sliding DFT for the spectrum. ContactClassifier feeds them to a small
+softmax model and gives a label with a confidence a fixed number of samples
+after the detector sees the contact start, and keeps the contact to label
+latency.
+
+The model is trained offline on the recordings in protocol2_0:
+
+    python ContactClassifier.py train [--out contact_model.npz] [file:label ...]
+    python ContactClassifier.py replay contact_model.npz file.csv
+
+Without files, train uses out1_taps, out2_holds, out3_slides and
+out4_markerslides. replay runs a recording through the real-time pipeline
+(bandpass, detector, classifier) and prints labels and latencies.
+
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from StreamFilter import StreamingBandpass
+from NoiseFloor import NoiseFloorTracker
+from ContactDetector import ContactDetector
+from Resampler import NYQUIST_MARGIN, resample_block, estimate_rate
+from SpectralAnalyzer import SlidingDFT
+from BatchFeatures import DEFAULT_PARAMS, load_session, bandpass_block, spectral_features, features_of_windows
+
+
+RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'DynamixelSDK-master', 'python', 'protocol2_0')
+DEFAULT_SESSIONS = {'out1_taps.csv': 'tap', 'out2_holds.csv': 'hold',
+                    'out3_slides.csv': 'slide', 'out4_markerslides.csv': 'slide'}
+
+
+class IncrementalFeatures:
+    def __init__(self, n_channels=5, window=64, fs=240., bands=DEFAULT_PARAMS['bands']):
+        self.n_channels = n_channels
+        self.window = window
+        self.fs = fs
+        self.bands = bands
+        self.freqs = np.fft.rfftfreq(window, 1. / fs)
+        self.ring = np.zeros((window, n_channels))
+        self.pos = 0
+        self.sumsq = np.zeros(n_channels)
+        self.crossings = np.zeros(n_channels)
+        self.dft = SlidingDFT(n_channels, window)
+
+    def Update(self, y):
+        ring = self.ring
+        pos = self.pos
+        N = self.window
+        old = ring[pos]
+        # zero crossings: one new pair comes in, the oldest pair goes out
+        self.crossings += np.signbit(y) != np.signbit(ring[pos - 1])
+        self.crossings -= np.signbit(old) != np.signbit(ring[(pos + 1) % N])
+        self.sumsq += y * y - old * old
+        self.dft.Update(y, old)
+        ring[pos] = y
+        self.pos = (pos + 1) % N
+        if self.dft.count >= self.dft.resync:
+            self.dft.Resync(self.Ordered())
+            ordered = self.Ordered()
+            self.sumsq[:] = np.sum(ordered * ordered, axis=0)
+
+    def Ordered(self):
+        return np.roll(self.ring, -self.pos, axis=0)
+
+    def Features(self):
+        spec = np.abs(self.dft.X.T) ** 2
+        band_energy, centroid = spectral_features(spec, self.freqs, self.bands)
+        return {'rms': np.sqrt(np.maximum(self.sumsq, 0.) / self.window),
+                'band_energy': band_energy,
+                'zero_crossings': self.crossings.copy(),
+                'centroid': centroid}
+
+
+def feature_vector(f):
+    # Flattens a feature dict to one vector per window (works on batches too)
+    rms = f['rms']
+    be = f['band_energy']
+    return np.concatenate([np.log1p(rms),
+                           np.log1p(be).reshape(be.shape[:-2] + (be.shape[-2] * be.shape[-1],)),
+                           f['zero_crossings'],
+                           f['centroid']], axis=-1)
+
+
+class SoftmaxModel:
+    def __init__(self, W, b, mean, std, labels, params):
+        self.W = W
+        self.b = b
+        self.mean = mean
+        self.std = std
+        self.labels = list(labels)
+        self.params = params
+
+    @classmethod
+    def Fit(cls, X, y, labels, params, iters = 2000, rate = 0.5, l2 = 1e-3):
+        mean = X.mean(axis=0)
+        std = X.std(axis=0) + 1e-9
+        Z = (X - mean) / std
+        n, d = Z.shape
+        k = len(labels)
+        Y = np.zeros((n, k))
+        Y[np.arange(n), y] = 1.
+        W = np.zeros((d, k))
+        b = np.zeros(k)
+        for i in range(iters):
+            P = _softmax(Z @ W + b)
+            G = (P - Y) / n
+            W -= rate * (Z.T @ G + l2 * W)
+            b -= rate * G.sum(axis=0)
+        return cls(W, b, mean, std, labels, params)
+
+    def Predict_Proba(self, X):
+        return _softmax(((X - self.mean) / self.std) @ self.W + self.b)
+
+    def Save(self, path):
+        np.savez(path, W=self.W, b=self.b, mean=self.mean, std=self.std,
+                 labels=np.array(self.labels), params=np.array(json.dumps(self.params)))
+
+    @classmethod
+    def Load(cls, path):
+        with np.load(path) as d:
+            return cls(d['W'], d['b'], d['mean'], d['std'], [str(l) for l in d['labels']],
+                       json.loads(str(d['params'])))
+
+
+def _softmax(z):
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+class ContactClassifier:
+    def __init__(self, model,
+                 # samples after the contact starts before a label is given
+                 delay = 32):
+        p = model.params
+        self.model = model
+        self.delay = delay
+        self.features = IncrementalFeatures(5, p['window'], p['fs'], p['bands'])
+        self.n = 0
+        self.onset = None
+        self.onset_time = 0.
+        # (latency in samples, latency in seconds) of every label given
+        self.latencies = []
+
+    def Update(self, y, onset=False):
+        # y: filtered currents 1-4 and filtered norm. onset: the detector just
+        # saw a contact start. Returns (label, confidence) once per contact.
+        self.features.Update(y)
+        self.n += 1
+        if onset and self.onset is None:
+            self.onset = self.n
+            self.onset_time = time.perf_counter()
+        if self.onset is None or self.n - self.onset < self.delay:
+            return None
+        p = self.model.Predict_Proba(feature_vector(self.features.Features()))
+        k = int(np.argmax(p))
+        self.latencies.append((self.n - self.onset, time.perf_counter() - self.onset_time))
+        self.onset = None
+        return self.model.labels[k], float(p[k])
+
+    def Latency_Report(self):
+        if not self.latencies:
+            return "No contacts classified"
+        lat = np.array(self.latencies)
+        return "%d contacts, latency %.0f samples (%.1f ms at %.0f Hz), wall clock mean %.1f ms max %.1f ms" % (
+            len(lat), lat[:, 0].mean(), 1e3 * lat[:, 0].mean() / self.features.fs, self.features.fs,
+            1e3 * lat[:, 1].mean(), 1e3 * lat[:, 1].max())
+
+
+def grid_session(path, params):
+    # Uniform grid of the currents and their norm, before filtering
+    t, x = load_session(path)
+    tg, xg = resample_block(t, x, params['fs'])
+    return tg, np.column_stack([xg, np.sqrt(np.sum(xg * xg, axis=1))])
+
+
+def filtered_session(path, params):
+    # Uniform grid, filtered currents and filtered norm, as the real-time path sees them
+    tg, xg = grid_session(path, params)
+    return tg, xg, bandpass_block(xg, params['fs'], params['low'], params['hi'], params['order'])
+
+
+def contact_onsets(y):
+    # Sample indices where the detector sees a contact start
+    detector = ContactDetector.With_Tracker(NoiseFloorTracker(4))
+    onsets = []
+    idle = True
+    for i in range(y.shape[0]):
+        detector.Update(y[i, :4])
+        if detector.pending and idle:
+            onsets.append(i)
+        idle = not (detector.pending or detector.in_contact)
+    return np.array(onsets, dtype=int)
+
+
+def train(sessions, delay = 32, params = None):
+    # sessions: {path: label}. Returns a SoftmaxModel
+    p = dict(DEFAULT_PARAMS)
+    p.update(params or {})
+    p['taper'] = False
+    if p['fs'] is None:
+        # one model, one rate: the median of the rates the sessions were recorded at
+        p['fs'] = float(np.median([estimate_rate(load_session(path)[0]) for path in sessions]))
+    labels = sorted(set(sessions.values()))
+    X = []
+    Y = []
+    for path, label in sessions.items():
+        tg, xg, y = filtered_session(path, p)
+        # the online classifier answers `delay` samples after the onset sample
+        ends = contact_onsets(y) + delay
+        ends = ends[(ends >= p['window'] - 1) & (ends < y.shape[0])]
+        # (contacts, channels, window) gathered in one go
+        w = y[ends[:, None] + np.arange(1 - p['window'], 1)].transpose(0, 2, 1)
+        X.append(feature_vector(features_of_windows(w, p['fs'], p['bands'], taper=False)))
+        Y.append(np.full(ends.size, labels.index(label)))
+        print("%s: %d contacts labeled '%s'" % (os.path.basename(path), ends.size, label))
+    X = np.concatenate(X)
+    Y = np.concatenate(Y)
+    model = SoftmaxModel.Fit(X, Y, labels, p)
+    acc = np.mean(np.argmax(model.Predict_Proba(X), axis=1) == Y)
+    print("Training accuracy: %.2f" % acc)
+    return model
+
+
+def replay(model, path, delay = 32):
+    p = model.params
+    # filtered sample by sample below, as on the arm
+    tg, xg = grid_session(path, p)
+    # same clamp as bandpass_block, so replay filters what training saw
+    bandpass = StreamingBandpass(5, p['low'], min(p['hi'], NYQUIST_MARGIN * p['fs']), p['fs'], p['order'])
+    detector = ContactDetector.With_Tracker(NoiseFloorTracker(4))
+    classifier = ContactClassifier(model, delay)
+    idle = True
+    t0 = time.perf_counter()
+    for i in range(xg.shape[0]):
+        y = bandpass.Update(xg[i])
+        detector.Update(y[:4])
+        result = classifier.Update(y, onset=idle and detector.pending)
+        idle = not (detector.pending or detector.in_contact)
+        if result is not None:
+            print("%09d, %s, %.2f" % (tg[i], result[0], result[1]))
+    print("%.1f us per sample" % (1e6 * (time.perf_counter() - t0) / xg.shape[0]))
+    print(classifier.Latency_Report())
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['train']:
+        args = args[1:]
+        out = 'contact_model.npz'
+        if args[:1] == ['--out']:
+            out = args[1]
+            args = args[2:]
+        if args:
+            sessions = dict(a.rsplit(':', 1) for a in args)
+        else:
+            sessions = {os.path.join(RECORDINGS, f): l for f, l in DEFAULT_SESSIONS.items()}
+        train(sessions).Save(out)
+        print("Saved " + out)
+    elif args[:1] == ['replay'] and len(args) == 3:
+        replay(SoftmaxModel.Load(args[1]), args[2])
+    else:
+        print(__doc__)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Contact detection on the bandpassed multi-channel current stream.
+
+Each joint has its own enter/exit threshold (derived from the noise floor
+measured while the arm is quiet). A contact starts as soon as one joint goes
+above its enter threshold, stays alive while any joint is above its exit
+threshold, and is only reported once it has lasted `confirm` samples.
+All the state is a couple of counters, nothing is reallocated per sample.
+
+With a NoiseFloorTracker attached the thresholds are in units of the running
+sigma of each joint instead of raw current, and the tracker is frozen while
+an event is pending or confirmed. Until the tracker is Ready nothing is
+detected, the samples only go into the baseline.
+
+"""
+
+import numpy as np
+
+
+class ContactDetector:
+    def __init__(self,
+                 # per joint thresholds on the filtered current
+                 enter_thresh = 1.,
+                 exit_thresh = None,
+                 # consecutive samples needed to confirm a contact
+                 confirm = 10,
+                 # motor ids, reported with the contact
+                 motor_ids = (100, 101, 102, 103),
+                 # optional NoiseFloorTracker, thresholds are then in sigma
+                 tracker = None):
+        self.motor_ids = list(motor_ids)
+        self.tracker = tracker
+        n = len(self.motor_ids)
+        self.enter_thresh = np.broadcast_to(np.asarray(enter_thresh, dtype=float), (n,)).copy()
+        if exit_thresh is None:
+            exit_thresh = 0.5 * self.enter_thresh
+        self.exit_thresh = np.broadcast_to(np.asarray(exit_thresh, dtype=float), (n,)).copy()
+        self.confirm = confirm
+        self.ratio = np.zeros(n)
+        self.z = np.zeros(n)
+        self.above = np.zeros(n, dtype=bool)
+        self.Reset()
+
+    @classmethod
+    def From_Noise_Floor(cls, quiet, enter_sigma = 6., exit_sigma = 3., **kwargs):
+        # quiet: (samples, joints) of filtered current with the arm not touching anything
+        sigma = np.std(np.asarray(quiet, dtype=float), axis=0)
+        # a joint that reads perfectly flat still needs a threshold above one tick
+        sigma = np.maximum(sigma, 0.5)
+        return cls(enter_thresh = enter_sigma * sigma, exit_thresh = exit_sigma * sigma, **kwargs)
+
+    @classmethod
+    def With_Tracker(cls, tracker, enter_sigma = 6., exit_sigma = 3., **kwargs):
+        return cls(enter_thresh = enter_sigma, exit_thresh = exit_sigma, tracker = tracker, **kwargs)
+
+    def Reset(self):
+        if self.tracker is not None:
+            self.tracker.Unfreeze()
+        self.pending = False        # above enter threshold, not confirmed yet
+        self.in_contact = False     # confirmed contact
+        self.new_contact = False    # True only on the sample the contact got confirmed
+        self.count = 0
+        self.joint = -1
+        self.peak = 0.
+
+    def Update(self, y):
+        # y: one filtered sample per joint. Returns True while in contact.
+        tracker = self.tracker
+        x = y
+        if tracker is not None:
+            if not tracker.Ready():
+                # warming up: a transient now would freeze an unlearned baseline
+                tracker.Update(x)
+                self.new_contact = False
+                return False
+            y = tracker.Normalize(x, out=self.z)
+        ratio = self.ratio
+        np.abs(y, out=ratio)
+        self.new_contact = False
+        if not self.pending and not self.in_contact:
+            ratio /= self.enter_thresh
+            k = int(np.argmax(ratio))
+            if ratio[k] > 1.:
+                self.pending = True
+                self.count = 0
+                self.joint = k
+                self.peak = ratio[k]
+                if tracker is not None:
+                    tracker.Freeze()
+                return self._Count()
+            if tracker is not None:
+                # only quiet samples feed the baseline
+                tracker.Update(x)
+            return False
+
+        # hysteresis: keep going as long as any joint is above its exit threshold
+        above = np.greater(ratio, self.exit_thresh, out=self.above)
+        if not above.any():
+            self.Reset()
+            return False
+        ratio /= self.enter_thresh
+        k = int(np.argmax(ratio))
+        if ratio[k] > self.peak:
+            self.peak = ratio[k]
+            self.joint = k
+        if self.pending:
+            return self._Count()
+        return self.in_contact
+
+    def _Count(self):
+        self.count += 1
+        if self.count >= self.confirm:
+            self.pending = False
+            self.in_contact = True
+            self.new_contact = True
+        return self.in_contact
+
+    def Contact_Motor(self):
+        # motor id of the joint that saw the contact, None if there is none
+        if self.joint < 0:
+            return None
+        return self.motor_ids[self.joint]
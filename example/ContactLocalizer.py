@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Contact point and force estimation from joint currents.
+
+A force F pushing on the arm at point p shows up in the joint torques as
+tau = J_p(q)^T F. The localizer keeps the last few raw current samples of
+all four joints, turns the change since before the contact into torques,
+and for a set of candidate points along both links solves for F by least
+squares over the whole window, all candidates at once. The candidate with
+the smallest residual is the contact point, F its force.
+
+Add_Sample is O(1); Localize is a handful of small batched solves, well
+within one control cycle.
+
+"""
+
+import numpy as np
+
+
+class ContactLocalizer:
+    def __init__(self, model,
+                 # samples kept: baseline before the contact plus the contact itself
+                 window = 40,
+                 # joint torque per current tick, Nm (X series: 2.69 mA per tick times the torque constant)
+                 torque_per_tick = 2.69e-3 * 1.5,
+                 # candidate points per link, as fractions of the link length
+                 points_per_link = 21):
+        self.model = model
+        self.window = window
+        self.torque_per_tick = np.broadcast_to(np.asarray(torque_per_tick, dtype=float), (4,)).copy()
+        # the base of the first link can't feel anything, start a bit along it
+        self.fractions = np.linspace(0.05, 1., points_per_link)
+        self.ring = np.zeros((window, 4))
+        self.pos = 0
+        self.n = 0
+
+    def Add_Sample(self, currents):
+        self.ring[self.pos] = currents
+        self.pos = (self.pos + 1) % self.window
+        self.n += 1
+
+    def Localize(self, q, n_contact = 10):
+        # q: present joint angles. n_contact: newest samples that belong to the
+        # contact, the older ones in the window are the baseline.
+        # Returns a dict with the contact point, force, direction, link and residual.
+        n = min(self.n, self.window)
+        if n <= n_contact:
+            return None
+        ordered = np.roll(self.ring, -self.pos, axis=0)[self.window - n:]
+        baseline = ordered[:n - n_contact].mean(axis=0)
+        tau = ((ordered[n - n_contact:] - baseline) * self.torque_per_tick).T     # (4, n_contact)
+
+        q = np.asarray(q, dtype=float)
+        points = self.model.Link_Points(q[None], self.fractions)[0]                # (2, M, 3)
+        M = self.fractions.size
+        origins, axes, tip = self.model.Frames(q[None])
+        # Jacobian of every candidate point: (2M, 3, 4)
+        p = points.reshape(-1, 3)
+        J = np.cross(axes[0][None], p[:, None, :] - origins[0][None]).transpose(0, 2, 1)
+        J[:M, :, 2:] = 0.
+        JT = J.transpose(0, 2, 1)                                                   # (2M, 4, 3)
+        # least squares force per candidate and sample, then the residual over the window
+        F = np.linalg.pinv(JT) @ tau                                                # (2M, 3, n_contact)
+        r = np.linalg.norm(JT @ F - tau, axis=(1, 2))
+        k = int(np.argmin(r))
+        force = F[k].mean(axis=1)
+        magnitude = np.linalg.norm(force)
+        return {'point': p[k],
+                'force': force,
+                'direction': force / magnitude if magnitude > 0 else force,
+                'link': k // M,
+                'fraction': self.fractions[k % M],
+                'residual': r[k]}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Control table of the X series servos (protocol 2.0), by field name.
+
+Every field is (name, address, length, signed, area). EEPROM fields only
+take writes with torque off and survive a power cycle; RAM fields reset on
+reboot. The indirect address block maps INDIRECT_SLOTS bytes of any field
+into the contiguous indirect data block, so scattered fields can be read in
+one transaction (the indirect addresses are written with torque off too).
+
+    from ControlTable import field
+    f = field('present_position')     # f.addr 132, f.length 4, f.signed True
+
+Usage: python ControlTable.py
+prints the table.
+
+"""
+
+from collections import namedtuple
+
+
+Field = namedtuple('Field', 'name addr length signed area')
+
+FIELDS = [
+    Field('model_number', 0, 2, False, 'eeprom'),
+    Field('firmware_version', 6, 1, False, 'eeprom'),
+    Field('id', 7, 1, False, 'eeprom'),
+    Field('baud_rate', 8, 1, False, 'eeprom'),
+    Field('return_delay_time', 9, 1, False, 'eeprom'),
+    Field('drive_mode', 10, 1, False, 'eeprom'),
+    Field('operating_mode', 11, 1, False, 'eeprom'),
+    Field('homing_offset', 20, 4, True, 'eeprom'),
+    Field('moving_threshold', 24, 4, False, 'eeprom'),
+    Field('temperature_limit', 31, 1, False, 'eeprom'),
+    Field('max_voltage_limit', 32, 2, False, 'eeprom'),
+    Field('min_voltage_limit', 34, 2, False, 'eeprom'),
+    Field('pwm_limit', 36, 2, False, 'eeprom'),
+    Field('current_limit', 38, 2, False, 'eeprom'),
+    Field('velocity_limit', 44, 4, False, 'eeprom'),
+    Field('max_position_limit', 48, 4, False, 'eeprom'),
+    Field('min_position_limit', 52, 4, False, 'eeprom'),
+    Field('shutdown', 63, 1, False, 'eeprom'),
+    Field('torque_enable', 64, 1, False, 'ram'),
+    Field('led', 65, 1, False, 'ram'),
+    Field('status_return_level', 68, 1, False, 'ram'),
+    Field('registered_instruction', 69, 1, False, 'ram'),
+    Field('hardware_error_status', 70, 1, False, 'ram'),
+    Field('velocity_i_gain', 76, 2, False, 'ram'),
+    Field('velocity_p_gain', 78, 2, False, 'ram'),
+    Field('position_d_gain', 80, 2, False, 'ram'),
+    Field('position_i_gain', 82, 2, False, 'ram'),
+    Field('position_p_gain', 84, 2, False, 'ram'),
+    Field('bus_watchdog', 98, 1, True, 'ram'),
+    Field('goal_pwm', 100, 2, True, 'ram'),
+    Field('goal_current', 102, 2, True, 'ram'),
+    Field('goal_velocity', 104, 4, True, 'ram'),
+    Field('profile_acceleration', 108, 4, False, 'ram'),
+    Field('profile_velocity', 112, 4, False, 'ram'),
+    Field('goal_position', 116, 4, True, 'ram'),
+    Field('realtime_tick', 120, 2, False, 'ram'),
+    Field('moving', 122, 1, False, 'ram'),
+    Field('moving_status', 123, 1, False, 'ram'),
+    Field('present_pwm', 124, 2, True, 'ram'),
+    Field('present_current', 126, 2, True, 'ram'),
+    Field('present_velocity', 128, 4, True, 'ram'),
+    Field('present_position', 132, 4, True, 'ram'),
+    Field('velocity_trajectory', 136, 4, True, 'ram'),
+    Field('position_trajectory', 140, 4, True, 'ram'),
+    Field('present_input_voltage', 144, 2, False, 'ram'),
+    Field('present_temperature', 146, 1, False, 'ram'),
+]
+
+CONTROL_TABLE = {f.name: f for f in FIELDS}
+
+# indirect address n (2 bytes each) maps indirect data n (1 byte each)
+ADDR_INDIRECT_ADDRESS = 168
+ADDR_INDIRECT_DATA = 224
+INDIRECT_SLOTS = 28
+
+
+def field(name):
+    f = CONTROL_TABLE.get(name)
+    if f is None:
+        raise ValueError("unknown control table field '%s'" % name)
+    return f
+
+
+def span(fields):
+    # (address, length) of the smallest block that covers all fields
+    start = min(f.addr for f in fields)
+    return start, max(f.addr + f.length for f in fields) - start
+
+
+if __name__ == '__main__':
+    print("%-24s %5s %4s %7s %7s" % ("field", "addr", "len", "signed", "area"))
+    for f in FIELDS:
+        print("%-24s %5d %4d %7s %7s" % (f.name, f.addr, f.length, 'yes' if f.signed else '', f.area))
@@ -14,6 +14,7 @@
 #
 
 import os, ctypes, struct
+import atexit, signal, weakref
 
 if os.name == 'nt':
     import msvcrt
@@ -31,19 +32,49 @@ else:
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
         return ch
 
-# todo Ante: Set this
-os.sys.path.append('../DynamixelSDK-master/python/dynamixel_functions_py')             # Path setting
-os.sys.path.append('.')             # Path setting
-cwd=os.getcwd()
-os.chdir('../DynamixelSDK-master/python/dynamixel_functions_py')
-import dynamixel_functions as dynamixel                     # Uses Dynamixel SDK library
-os.chdir(cwd)
+import dxl_sdk as dynamixel                                # Uses Dynamixel SDK library (C, or the pure Python fallback)
 import datetime
 
 
 COMM_SUCCESS                = 0                             # Communication Success result value
 COMM_TX_FAIL                = -1001                         # Communication Tx Failed
 
+ADDR_PRESENT_CURRENT        = 126                           # Present current, velocity and position are contiguous,
+LEN_PRESENT_CURRENT         = 2                             # Read_Sync_State gets all three in one sync read
+ADDR_PRESENT_VELOCITY       = 128
+LEN_PRESENT_VELOCITY        = 4
+ADDR_PRESENT_POSITION       = 132                           # Present position, read back by Read_Sync_Positions
+LEN_PRESENT_POSITION        = 4
+LEN_PRESENT_STATE           = 10
+ADDR_OPERATING_MODE         = 11                            # 0 current, 1 velocity, 3 position, 5 current based position
+LEN_OPERATING_MODE          = 1
+ADDR_TORQUE_ENABLE          = 64
+LEN_TORQUE_ENABLE           = 1
+
+# Readers not closed yet: closed at exit, or on SIGTERM/SIGHUP, so the arm is left with torque off
+_open_readers = weakref.WeakSet()
+
+def _close_all():
+    for reader in list(_open_readers):
+        reader.Close()
+
+def _on_signal(signum, frame):
+    _close_all()
+    # then die of the signal as if it hadn't been caught
+    signal.signal(signum, signal.SIG_DFL)
+    os.kill(os.getpid(), signum)
+
+def _install_handlers():
+    for signum in (signal.SIGTERM, getattr(signal, 'SIGHUP', None)):
+        if signum is None or signal.getsignal(signum) != signal.SIG_DFL:
+            continue
+        try:
+            signal.signal(signum, _on_signal)
+        except ValueError:
+            # not the main thread; atexit still covers a normal exit
+            pass
+
+atexit.register(_close_all)
 
 
 class DynamixelReader:
@@ -63,6 +94,9 @@ class DynamixelReader:
                  read_addr = 126,
                  #SyncRead Len
                  read_len = 2):
+        # Use as `with DynamixelReader(...) as reader:` or call Close(); both
+        # turn torque off in one sync write and free the SDK handles, once
+        self.closed = True
         self.baud_rate = baud_rate
         self.device_name = device_name
         self.m1id = m1id
@@ -77,18 +111,55 @@ class DynamixelReader:
         # Set the port path
         # Get methods and members of PortHandlerLinux or PortHandlerWindows
         self.port_num = dynamixel.portHandler(device_name)
-        dynamixel.setPacketTimeoutMSec(1)
+        dynamixel.setPacketTimeoutMSec(self.port_num, 1)
         # Initialize PacketHandler Structs
         dynamixel.packetHandler()
         # Initialize Groupsyncread Structs for Current
         self.groupread_num = dynamixel.groupSyncRead(self.port_num, proto_ver, read_addr,read_len) #0, 148
+        # Initialize Groupsyncread Structs for Present Position
+        self.groupposition_num = dynamixel.groupSyncRead(self.port_num, proto_ver, ADDR_PRESENT_POSITION, LEN_PRESENT_POSITION)
+        # Initialize Groupsyncread Structs for Current, Velocity and Position together
+        self.groupstate_num = dynamixel.groupSyncRead(self.port_num, proto_ver, ADDR_PRESENT_CURRENT, LEN_PRESENT_STATE)
+        # Groupsyncwrite Structs, created on first use per (address, length)
+        self.groupwrite = {}
         dt = datetime.datetime.now()
         self.timestamp0 = dt.minute * 60000000 + dt.second * 1000000 + dt.microsecond
+        self.closed = False
+        _open_readers.add(self)
+        _install_handlers()
         self.Init_Port_And_Motors()
         self.Init_Param_Storage()
 
     def __del__(self):
-        self.Disable_Torque_Close_Port()
+        self.Close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+        return False
+
+    def Close(self):
+        # Torque off on all motors in one sync write (no status packets to
+        # wait for), then release the group handles and close the port.
+        # Safe to call more than once
+        if self.closed:
+            return
+        self.closed = True
+        _open_readers.discard(self)
+        self.Write_Sync(ADDR_TORQUE_ENABLE, LEN_TORQUE_ENABLE, [0] * 4)
+        # The SDK only reuses a group slot once its params are cleared, so
+        # without this every reader opened in a loop grows its tables
+        for group_num in (self.groupread_num, self.groupposition_num, self.groupstate_num):
+            dynamixel.groupSyncReadClearParam(group_num)
+        for group_num in self.groupwrite.values():
+            dynamixel.groupSyncWriteClearParam(group_num)
+        self.groupwrite = {}
+        dynamixel.closePort(self.port_num)
+
+    # contextlib.closing and file-like callers
+    close = Close
 
     def Init_Port_And_Motors(self):
         # Open port
@@ -177,6 +248,37 @@ class DynamixelReader:
             print("[ID:%03d] groupSyncRead addparam failed" % (self.m4id))
             quit()
 
+        # Add parameter storage for the present position and state of all motors
+        for group_num in (self.groupposition_num, self.groupstate_num):
+            for motorId in (self.m1id, self.m2id, self.m3id, self.m4id):
+                dxl_addparam_result = ctypes.c_ubyte(dynamixel.groupSyncReadAddParam(group_num, motorId)).value
+                if dxl_addparam_result != 1:
+                    print("[ID:%03d] groupSyncRead addparam failed" % (motorId))
+                    quit()
+
+    def Write_Sync(self, set_addr, set_len, values):
+        # Writes values[i] to motor i (m1id..m4id) in one sync write packet
+        groupwrite_num = self.groupwrite.get((set_addr, set_len))
+        if groupwrite_num is None:
+            groupwrite_num = dynamixel.groupSyncWrite(self.port_num, self.proto_ver, set_addr, set_len)
+            self.groupwrite[(set_addr, set_len)] = groupwrite_num
+        dynamixel.groupSyncWriteClearParam(groupwrite_num)
+        for motorId, value in zip((self.m1id, self.m2id, self.m3id, self.m4id), values):
+            dxl_addparam_result = ctypes.c_ubyte(dynamixel.groupSyncWriteAddParam(groupwrite_num, motorId, int(value), set_len)).value
+            if dxl_addparam_result != 1:
+                print("[ID:%03d] groupSyncWrite addparam failed" % (motorId))
+                return
+        dynamixel.groupSyncWriteTxPacket(groupwrite_num)
+        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
+        if dxl_comm_result != COMM_SUCCESS:
+            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
+
+    def Set_Operating_Mode(self, mode):
+        # The operating mode only changes with torque off: three sync writes
+        self.Write_Sync(ADDR_TORQUE_ENABLE, LEN_TORQUE_ENABLE, [0] * 4)
+        self.Write_Sync(ADDR_OPERATING_MODE, LEN_OPERATING_MODE, [mode] * 4)
+        self.Write_Sync(ADDR_TORQUE_ENABLE, LEN_TORQUE_ENABLE, [1] * 4)
+
     def Set_Value(self, motorId, set_addr, set_len, value):
         if(set_len == 4):
             dynamixel.write4ByteTxRx(self.port_num, self.proto_ver, motorId, set_addr, value)
@@ -275,53 +377,54 @@ class DynamixelReader:
         difft = timestamp - self.timestamp0
         return [difft, dxl1_current, dxl2_current, dxl3_current, dxl4_current]
 
-    def Disable_Torque_Close_Port(self):
-        ADDR_PRO_TORQUE_ENABLE = 64
-        TORQUE_DISABLE = 0
-        dxl_comm_result = COMM_TX_FAIL
-        # Enable Dynamixel#1 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m1id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#1 has been successfully freed")
-        # Enable Dynamixel#2 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m2id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#2 has been successfully freed")
-        # Enable Dynamixel#3 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m3id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
+    def Read_Sync_Positions(self):
+        # Present position of all four motors in one sync read
+        groupread_num = self.groupposition_num
+        dynamixel.groupSyncReadTxRxPacket(groupread_num)
         dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
         if dxl_comm_result != COMM_SUCCESS:
             print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#3 has been successfully freed")
-        # Enable Dynamixel#4 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m4id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
+        positions = []
+        for motorId in (self.m1id, self.m2id, self.m3id, self.m4id):
+            dxl_getdata_result = ctypes.c_ubyte(
+                dynamixel.groupSyncReadIsAvailable(groupread_num, motorId, ADDR_PRESENT_POSITION, LEN_PRESENT_POSITION)).value
+            if dxl_getdata_result != 1:
+                print("[ID:%03d] groupSyncRead getdata failed" % (motorId))
+                quit()
+            positions.append(ctypes.c_int32(
+                dynamixel.groupSyncReadGetData(groupread_num, motorId, ADDR_PRESENT_POSITION, LEN_PRESENT_POSITION)).value)
+        return positions
+
+    def Read_Sync_State(self):
+        # Current, velocity and position of all four motors in one sync read
+        groupread_num = self.groupstate_num
+        dynamixel.groupSyncReadTxRxPacket(groupread_num)
         dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
         if dxl_comm_result != COMM_SUCCESS:
             print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#4 has been successfully freed")
+        currents = []
+        velocities = []
+        positions = []
+        for motorId in (self.m1id, self.m2id, self.m3id, self.m4id):
+            dxl_getdata_result = ctypes.c_ubyte(
+                dynamixel.groupSyncReadIsAvailable(groupread_num, motorId, ADDR_PRESENT_CURRENT, LEN_PRESENT_STATE)).value
+            if dxl_getdata_result != 1:
+                print("[ID:%03d] groupSyncRead getdata failed" % (motorId))
+                quit()
+            currents.append(ctypes.c_int16(
+                dynamixel.groupSyncReadGetData(groupread_num, motorId, ADDR_PRESENT_CURRENT, LEN_PRESENT_CURRENT)).value)
+            velocities.append(ctypes.c_int32(
+                dynamixel.groupSyncReadGetData(groupread_num, motorId, ADDR_PRESENT_VELOCITY, LEN_PRESENT_VELOCITY)).value)
+            positions.append(ctypes.c_int32(
+                dynamixel.groupSyncReadGetData(groupread_num, motorId, ADDR_PRESENT_POSITION, LEN_PRESENT_POSITION)).value)
 
-        #close port
-        dynamixel.closePort(self.port_num)
+        dt = datetime.datetime.now()
+        timestamp = dt.minute * 60000000 + dt.second * 1000000 + dt.microsecond
+        difft = timestamp - self.timestamp0
+        return [difft] + currents + velocities + positions
+
+    def Disable_Torque_Close_Port(self):
+        self.Close()
 
 if __name__ == '__main__':
     reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Guarded moves: move in a direction until something is touched.
+
+GuardedMover streams goal positions along a direction in joint space (ticks)
+or Cartesian space (meters, through the IK solver) at a fixed rate, and runs
+the contact detector in the same loop: every tick is one sync read of
+current + position and one sync write of the goals. The move stops on a
+confirmed contact, on a current limit, on a Cartesian goal the IK can't
+reach, or after a distance/timeout, holds the present pose and returns the
+contact pose, the time and the samples leading up to it.
+
+The rate defaults to what WireModel predicts the bus can sustain for that
+cycle at the reader's baud rate (with a margin, at most 200 Hz): about 52 Hz
+at 115200 baud, 168 Hz at 1 Mbaud. The bandpass is designed for it.
+
+Everything that is expensive happens once per mover, not once per probe:
+the noise floor calibration, the IK warm start and the sync read/write
+handles. The filter is re-primed in steady state on the first sample of a
+probe, so the previous contact doesn't ring into it and there is no warm-up.
+Torque stays on.
+
+Usage:
+    python GuardedMove.py joint MOTOR SIGN [speed_ticks_per_s]
+    python GuardedMove.py cartesian DX DY DZ [speed_m_per_s]
+
+"""
+
+import sys
+
+import numpy as np
+
+from StreamFilter import StreamingBandpass
+from ContactDetector import ContactDetector
+from Kinematics import ArmModel
+from InverseKinematics import IKSolver
+from WireModel import control_rate
+from RateLoop import RateLoop
+
+
+ADDR_PRO_GOAL_POSITION = 116
+LEN_PRO_GOAL_POSITION = 4
+
+# columns of the probe buffer
+BUFFER_COLUMNS = ['time', 'current1', 'current2', 'current3', 'current4',
+                  'filtered1', 'filtered2', 'filtered3', 'filtered4',
+                  'position1', 'position2', 'position3', 'position4']
+
+
+class GuardedMover:
+    def __init__(self, reader,
+                 model = None,
+                 # optional LoadModel, its residual is what gets filtered
+                 load = None,
+                 # control loop rate, Hz. The filter is designed for it. None
+                 # for what the reader's baud rate allows (WireModel)
+                 rate = None,
+                 low = 5.,
+                 hi = None,
+                 enter_sigma = 6.,
+                 exit_sigma = 3.,
+                 confirm = 10,
+                 # samples kept before the contact
+                 buffer_len = 400):
+        self.reader = reader
+        self.model = model if model is not None else ArmModel()
+        self.solver = IKSolver(self.model)
+        self.load = load
+        rate = control_rate(reader.baud_rate, rate)
+        self.rate = rate
+        self.loop = RateLoop(rate)
+        if hi is None:
+            hi = 0.4 * rate
+        self.bandpass = StreamingBandpass(4, low, hi, rate, 4)
+        self.enter_sigma = enter_sigma
+        self.exit_sigma = exit_sigma
+        self.confirm = confirm
+        self.detector = None
+        self.buffer = np.zeros((buffer_len, len(BUFFER_COLUMNS)))
+        self.row = 0
+        self.rows = 0
+        self.motor_ids = (reader.m1id, reader.m2id, reader.m3id, reader.m4id)
+
+    def _Sample(self, t):
+        # one sync read, filtered. Returns present ticks, filtered residual
+        state = self.reader.Read_Sync_State()
+        ticks = state[9:13]
+        currents = state[1:5]
+        if self.load is not None:
+            currents = self.load.Subtract(ticks, currents)
+        y = self.bandpass.Update(currents)
+        row = self.buffer[self.row]
+        row[0] = t
+        row[1:5] = currents
+        row[5:9] = y
+        row[9:13] = ticks
+        self.row = (self.row + 1) % self.buffer.shape[0]
+        self.rows += 1
+        return ticks, y
+
+    def Calibrate(self, n = 400):
+        # Noise floor with the arm holding still. Once per mover, not per probe
+        self.loop.Start()
+        quiet = np.zeros((n, 4))
+        for j in range(n):
+            ticks, y = self._Sample(self.loop.Wait())
+            quiet[j] = y
+        self.detector = ContactDetector.From_Noise_Floor(quiet[n // 4:], self.enter_sigma, self.exit_sigma,
+                                                         confirm=self.confirm, motor_ids=self.motor_ids)
+
+    def Buffer(self):
+        # samples of the last probe, oldest first
+        n = min(self.rows, self.buffer.shape[0])
+        return np.roll(self.buffer, -self.row, axis=0)[self.buffer.shape[0] - n:].copy()
+
+    def Move(self, direction, speed,
+             # 'joint': direction in ticks per motor, speed in ticks/s
+             # 'cartesian': direction in meters, speed in m/s
+             space = 'joint',
+             # stop if any joint's (residual) current exceeds this, ticks
+             current_limit = None,
+             # stop after this many ticks / meters along the direction
+             max_distance = None,
+             timeout = 10.,
+             # False for retracts: only distance, limit and timeout stop the move
+             guarded = True):
+        if self.detector is None:
+            self.Calibrate()
+        if space not in ('joint', 'cartesian'):
+            raise ValueError("unknown space '%s'" % space)
+        direction = np.asarray(direction, dtype=float)
+        direction = direction / np.linalg.norm(direction)
+        reader = self.reader
+        detector = self.detector
+        detector.Reset()
+        self.bandpass.Reset()
+        self.rows = 0
+        loop = self.loop
+        loop.Start()
+        t = 0.
+        ticks, y = self._Sample(t)
+        start = np.asarray(ticks, dtype=float)
+        if space == 'cartesian':
+            q = self.model.Ticks_To_Angles(start)
+            self.solver.last = q
+            p0 = self.model.Forward(q)[0]
+        reason = 'timeout'
+        while t < timeout:
+            distance = speed * t
+            if max_distance is not None and distance >= max_distance:
+                reason = 'distance'
+                break
+            if space == 'joint':
+                goal = np.rint(start + direction * distance)
+            else:
+                q, err = self.solver.Solve(p0 + direction * distance)
+                if q is None:
+                    reason = 'unreachable'
+                    break
+                goal = self.model.Angles_To_Ticks(q)
+            reader.Write_Sync(ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, goal)
+
+            t = loop.Wait()
+            ticks, y = self._Sample(t)
+            detector.Update(y)
+            if guarded and detector.new_contact:
+                reason = 'contact'
+                break
+            if current_limit is not None and np.any(np.abs(self.buffer[self.row - 1, 1:5]) > current_limit):
+                reason = 'limit'
+                break
+        # hold where the arm is
+        reader.Write_Sync(ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, ticks)
+        ticks = np.asarray(ticks)
+        return {'reason': reason,
+                'contact': reason in ('contact', 'limit'),
+                'motor': detector.Contact_Motor() if reason == 'contact' else None,
+                'ticks': ticks,
+                'tip': self.model.Forward_Ticks(ticks)[0],
+                'time': t,
+                'buffer': self.Buffer()}
+
+
+if __name__ == '__main__':
+    from CurrentReader import DynamixelReader
+    args = sys.argv[1:]
+    if len(args) < 3 or args[0] not in ('joint', 'cartesian'):
+        print(__doc__)
+        sys.exit(1)
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = 115200,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+    mover = GuardedMover(reader)
+    print("Control rate %.0f Hz" % mover.rate)
+    if args[0] == 'joint':
+        direction = np.zeros(4)
+        direction[int(args[1]) - 1] = float(args[2])
+        speed = float(args[3]) if len(args) > 3 else 30.
+        result = mover.Move(direction, speed, 'joint', max_distance=1000)
+    else:
+        speed = float(args[4]) if len(args) > 4 else 0.01
+        result = mover.Move([float(a) for a in args[1:4]], speed, 'cartesian', max_distance=0.2)
+    print("Stopped on %s after %.2f s" % (result['reason'], result['time']))
+    print("Present position: ", result['ticks'], " tip (m): ", result['tip'])
+    if result['motor'] is not None:
+        print("Contact seen by motor %d" % result['motor'])
+    print(mover.loop.Report())
+    del reader
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Servo health telemetry (temperature, input voltage, hardware error status)
+interleaved into the fast state read.
+
+The health fields change over seconds, so they are polled round-robin, one
+(motor, field) item at a time, instead of all of them every cycle:
+
+    monitor = HealthMonitor(reader, on_alarm=alarm)
+    while ...:
+        state = monitor.Read_State()    # in place of reader.Read_Sync_State()
+
+Most cycles Read_State is the plain state sync read. Now and then it runs
+the next health item's plan instead: the read planner's cheapest way to get
+the state of all motors plus that one field (usually a bulk read where that
+motor's block is stretched over the field). Every plan is compiled and bound
+once. How often an item rides along follows from its extra wire time, so
+that on average the fast read slows down by at most max_slowdown.
+
+Given a BusScheduler, Attach instead registers a background task that reads
+one item per frame when the frame has room, which costs the control tasks
+nothing.
+
+Each reading goes into a per motor table with a short history; a read
+that failed records nothing (the SDK returns 0 then, which would look like
+an undervoltage or a cleared error). Values outside limits (or any hardware
+error bit) call on_alarm(motor, field, value, True), and on_alarm(...,
+False) once back inside.
+
+Usage: python HealthMonitor.py [seconds] [max_slowdown]
+reads the state at full speed with health interleaved, prints the rate, the
+health table every second and any alarms.
+
+"""
+
+import datetime
+import math
+import sys
+import time
+from collections import deque
+
+import dxl_sdk as dynamixel
+from ControlTable import field
+from ReadPlanner import ReadPlanner
+from WireModel import WireModel
+
+
+HEALTH_FIELDS = ('hardware_error_status', 'present_temperature', 'present_input_voltage')
+
+# (low, high) per field, None for no limit. Temperature in C, voltage in 0.1 V
+DEFAULT_LIMITS = {'hardware_error_status': (None, 0),
+                  'present_temperature': (None, 70),
+                  'present_input_voltage': (95, 160)}
+
+STATE_FIELDS = ('present_current', 'present_velocity', 'present_position')
+
+COMM_SUCCESS = 0
+
+
+class HealthMonitor:
+    def __init__(self, reader,
+                 model = None,
+                 fields = HEALTH_FIELDS,
+                 limits = None,
+                 # on_alarm(motor, field, value, active)
+                 on_alarm = None,
+                 # share of the fast read time the health reads may add, on average
+                 max_slowdown = 0.03,
+                 # readings kept per (motor, field)
+                 history = 32):
+        self.reader = reader
+        self.model = model if model is not None else WireModel(reader.baud_rate)
+        self.limits = dict(DEFAULT_LIMITS) if limits is None else limits
+        self.on_alarm = on_alarm
+        self.motors = [reader.m1id, reader.m2id, reader.m3id, reader.m4id]
+        self.items = [(m, f) for f in fields for m in self.motors]
+        self.table = dict((m, dict((f, None) for f in fields)) for m in self.motors)
+        self.history = dict((item, deque(maxlen=history)) for item in self.items)
+        self.alarms = set()
+        self.next_item = 0
+        self.countdown = 0
+        self.polls = 0
+
+        planner = ReadPlanner(self.model, indirect=False)
+        state = [(m, f) for f in STATE_FIELDS for m in self.motors]
+        self.base = planner.Plan(state)
+        self.base.Bind(reader)
+        # per item: its plan, and how many cycles to leave before the next item
+        self.plans = []
+        for item in self.items:
+            plan = planner.Plan(state + [item])
+            plan.Bind(reader)
+            extra = max(plan.cost - self.base.cost, 0.)
+            spacing = max(1, int(math.ceil(extra / (max_slowdown * self.base.cost))))
+            self.plans.append((plan, spacing))
+
+    def Revisit_Time(self, rate):
+        # seconds to go once through all items, reading the state at rate
+        return sum(spacing for plan, spacing in self.plans) / float(rate)
+
+    def _Record(self, motor, name, value):
+        t = time.time()
+        self.table[motor][name] = value
+        self.history[(motor, name)].append((t, value))
+        low, high = self.limits.get(name, (None, None))
+        bad = (low is not None and value < low) or (high is not None and value > high)
+        item = (motor, name)
+        if bad != (item in self.alarms):
+            if bad:
+                self.alarms.add(item)
+            else:
+                self.alarms.discard(item)
+            if self.on_alarm is not None:
+                self.on_alarm(motor, name, value, bad)
+
+    def Read_State(self):
+        # [difft, c1..c4, v1..v4, p1..p4] like Read_Sync_State, with a health item now and then
+        if self.countdown > 0:
+            self.countdown -= 1
+            values = self.base.Read()
+        else:
+            plan, spacing = self.plans[self.next_item]
+            motor, name = self.items[self.next_item]
+            values = plan.Read()
+            # only a value this read brought back, not one held from before
+            if (motor, name) in plan.fresh:
+                self._Record(motor, name, values[(motor, name)])
+            self.next_item = (self.next_item + 1) % len(self.items)
+            self.countdown = spacing - 1
+            self.polls += 1
+        dt = datetime.datetime.now()
+        timestamp = dt.minute * 60000000 + dt.second * 1000000 + dt.microsecond
+        row = [timestamp - self.reader.timestamp0]
+        for name in STATE_FIELDS:
+            row += [values[(m, name)] for m in self.motors]
+        return row
+
+    def Poll(self):
+        # the next item as a read of its own, for spare bus time
+        motor, name = self.items[self.next_item]
+        self.next_item = (self.next_item + 1) % len(self.items)
+        f = field(name)
+        value = self.reader.Read_Value(motor, f.addr, f.length)
+        if dynamixel.getLastTxRxResult(self.reader.port_num, self.reader.proto_ver) == COMM_SUCCESS:
+            self._Record(motor, name, value)
+        self.polls += 1
+
+    def Attach(self, scheduler, period = 1):
+        # one item every period frames, only in frames with room left
+        return scheduler.Add_Background('health', self.Poll, self.model.Time('read', 1, 2), period)
+
+    def Report(self):
+        names = list(self.table[self.motors[0]])
+        lines = ["%6s " % "motor" + " ".join("%22s" % n for n in names)]
+        for m in self.motors:
+            cells = []
+            for n in names:
+                value = self.table[m][n]
+                cells.append("%22s" % ('-' if value is None else ('%d !' if (m, n) in self.alarms else '%d') % value))
+            lines.append("%6d " % m + " ".join(cells))
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    from CurrentReader import DynamixelReader
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 10.
+    max_slowdown = float(sys.argv[2]) if len(sys.argv) > 2 else 0.03
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = 115200,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+
+    def alarm(motor, name, value, active):
+        print("[ID:%03d] %s %s: %d" % (motor, name, 'ALARM' if active else 'ok', value))
+
+    monitor = HealthMonitor(reader, on_alarm=alarm, max_slowdown=max_slowdown)
+    rate = 1. / monitor.base.cost
+    print("State read %.2f ms (%.0f Hz), every health item revisited in %.1f s" % (
+        1e3 * monitor.base.cost, rate, monitor.Revisit_Time(rate)))
+    # the plain state read for comparison
+    n = 200
+    t = time.perf_counter()
+    for j in range(n):
+        reader.Read_Sync_State()
+    plain = n / (time.perf_counter() - t)
+    n = 0
+    start = time.perf_counter()
+    next_report = 1.
+    try:
+        while time.perf_counter() - start < duration:
+            monitor.Read_State()
+            n += 1
+            if time.perf_counter() - start >= next_report:
+                print(monitor.Report())
+                next_report += 1.
+    except KeyboardInterrupt:
+        pass
+    interleaved = n / (time.perf_counter() - start)
+    print("%.1f Hz plain, %.1f Hz with health (%.1f%% slower), %d health reads" % (
+        plain, interleaved, 100. * (1. - interleaved / plain), monitor.polls))
+    del reader
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Joint impedance control from current feedback.
+
+Every control tick is one sync read of current, velocity and position and
+one sync write of the four commands, on a fixed-rate loop (200 Hz default).
+The rate is checked against what WireModel predicts the bus can carry at
+the reader's baud rate: 200 Hz needs 1 Mbaud, at 115200 baud one cycle alone
+takes ~15 ms. The virtual spring-damper is the same in both modes, per joint
+and vectorized over the four:
+
+    'current'   the servos run in current control (operating mode 0) and the
+                command is the goal current
+                    K (setpoint - position) - D velocity + load
+                where load is the LoadModel holding current at the present
+                pose (gravity compensation), if one is given.
+    'position'  the servos stay in position control and the goal position
+                yields to the external load: the current beyond the expected
+                load drives the offset of a first order spring-damper,
+                    D d(offset)/dt = external - K offset
+                so a steady push of `external` moves the joint external / K.
+
+K is in current ticks per position tick, D in current ticks per tick/s. In
+position mode the offset update is the exact discretization, stable at any
+rate; a deadband keeps current noise from making the pose drift. D = 0 is
+a pure spring (the offset is external / K at once); position mode needs
+K > 0.
+
+Usage: python Impedance.py [position|current] [stiffness] [damping] [seconds]
+holds the present pose compliantly.
+
+"""
+
+import sys
+
+import numpy as np
+
+from RateLoop import RateLoop
+from WireModel import control_rate
+
+
+ADDR_GOAL_CURRENT = 102
+LEN_GOAL_CURRENT = 2
+ADDR_GOAL_POSITION = 116
+LEN_GOAL_POSITION = 4
+
+CURRENT_CONTROL_MODE = 0
+POSITION_CONTROL_MODE = 3
+
+# present velocity unit: 0.229 rpm, in position ticks per second
+VELOCITY_TICKS_PER_S = 0.229 / 60. * 4096
+
+
+class ImpedanceController:
+    def __init__(self, reader,
+                 # spring, current ticks per position tick
+                 stiffness = 0.5,
+                 # damper, current ticks per (position tick / s)
+                 damping = 0.05,
+                 # 'position' or 'current', see above
+                 mode = 'position',
+                 # control loop rate, Hz. ValueError if the bus can't keep up
+                 rate = 200.,
+                 # goal current clip in current mode, current ticks
+                 current_limit = 300,
+                 # external current below this is ignored in position mode
+                 deadband = 10.,
+                 # optional LoadModel: gravity compensation / expected load
+                 load = None):
+        if mode not in ('position', 'current'):
+            raise ValueError("unknown mode '%s'" % mode)
+        self.reader = reader
+        self.K = np.broadcast_to(np.asarray(stiffness, dtype=float), (4,)).copy()
+        self.D = np.broadcast_to(np.asarray(damping, dtype=float), (4,)).copy()
+        if np.any(self.K < 0) or np.any(self.D < 0):
+            raise ValueError("stiffness and damping can't be negative")
+        if mode == 'position' and np.any(self.K == 0):
+            raise ValueError("position mode needs a stiffness above 0")
+        self.mode = mode
+        length = LEN_GOAL_CURRENT if mode == 'current' else LEN_GOAL_POSITION
+        rate = control_rate(reader.baud_rate, rate, [('sync_read', 4, 10), ('sync_write', 4, length)])
+        self.loop = RateLoop(rate)
+        self.dt = 1. / rate
+        self.current_limit = current_limit
+        self.deadband = deadband
+        self.load = load
+        self.setpoint = None
+        self.baseline = np.zeros(4)
+        self.offset = np.zeros(4)
+        self.command = np.zeros(4)
+        self.external = np.zeros(4)
+        # per tick decay of the offset, 0 (no lag) for a pure spring
+        self.alpha = np.zeros(4)
+        damped = self.D > 0
+        self.alpha[damped] = np.exp(-self.K[damped] * self.dt / self.D[damped])
+
+    def Start(self, setpoint = None, settle = 20):
+        # setpoint: ticks to hold, defaults to the present pose.
+        # Without a load model the expected load is the mean current over
+        # `settle` ticks of holding still.
+        state = np.zeros((settle, 13))
+        for j in range(settle):
+            state[j] = self.reader.Read_Sync_State()
+        ticks = state[-1, 9:13]
+        self.setpoint = np.asarray(ticks if setpoint is None else setpoint, dtype=float).copy()
+        self.baseline = state[:, 1:5].mean(axis=0)
+        self.offset[:] = 0.
+        if self.mode == 'current':
+            self.reader.Write_Sync(ADDR_GOAL_CURRENT, LEN_GOAL_CURRENT, [0] * 4)
+            self.reader.Set_Operating_Mode(CURRENT_CONTROL_MODE)
+        self.loop.Start()
+
+    def Set_Setpoint(self, ticks):
+        self.setpoint[:] = ticks
+
+    def Step(self):
+        # one control tick: read, spring-damper, write. Returns the command
+        state = self.reader.Read_Sync_State()
+        currents = np.asarray(state[1:5], dtype=float)
+        velocities = np.asarray(state[5:9], dtype=float) * VELOCITY_TICKS_PER_S
+        ticks = np.asarray(state[9:13], dtype=float)
+        expected = self.load.Predict_One(ticks) if self.load is not None else self.baseline
+        if self.mode == 'current':
+            u = self.K * (self.setpoint - ticks) - self.D * velocities
+            if self.load is not None:
+                u += expected
+            np.clip(u, -self.current_limit, self.current_limit, out=u)
+            np.rint(u, out=self.command)
+            self.reader.Write_Sync(ADDR_GOAL_CURRENT, LEN_GOAL_CURRENT, self.command)
+        else:
+            # the servo's current opposes what pushes on the joint
+            e = expected - currents
+            np.copysign(np.maximum(np.abs(e) - self.deadband, 0.), e, out=self.external)
+            self.offset *= self.alpha
+            self.offset += (1. - self.alpha) * self.external / self.K
+            np.rint(self.setpoint + self.offset, out=self.command)
+            self.reader.Write_Sync(ADDR_GOAL_POSITION, LEN_GOAL_POSITION, self.command)
+        return self.command
+
+    def Stop(self):
+        # hold the present pose in position control
+        ticks = self.reader.Read_Sync_State()[9:13]
+        self.reader.Write_Sync(ADDR_GOAL_POSITION, LEN_GOAL_POSITION, ticks)
+        if self.mode == 'current':
+            self.reader.Set_Operating_Mode(POSITION_CONTROL_MODE)
+        return ticks
+
+    def Run(self, duration, setpoints = None):
+        # setpoints: optional function of time (s) -> ticks, for slides
+        self.Start()
+        try:
+            t = 0.
+            while t < duration:
+                if setpoints is not None:
+                    self.Set_Setpoint(setpoints(t))
+                self.Step()
+                t = self.loop.Wait()
+        finally:
+            self.Stop()
+
+
+if __name__ == '__main__':
+    from CurrentReader import DynamixelReader
+    args = sys.argv[1:]
+    if args[:1] not in (['position'], ['current']):
+        print(__doc__)
+        sys.exit(1)
+    stiffness = float(args[1]) if len(args) > 1 else 0.5
+    damping = float(args[2]) if len(args) > 2 else 0.05
+    seconds = float(args[3]) if len(args) > 3 else 10.
+    # 200 Hz is more than a 115200 baud bus can carry
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = 1000000,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+    controller = ImpedanceController(reader, stiffness, damping, args[0])
+    print("Holding the present pose, push the arm. Ctrl-C stops.")
+    try:
+        controller.Run(seconds)
+    except KeyboardInterrupt:
+        pass
+    print(controller.loop.Report())
+    del reader
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Numerical inverse kinematics for Cartesian tip goals.
+
+Damped least squares on the ArmModel Jacobian, run on a batch of seeds at
+once. The first seed is always the current pose (warm start), so in the
+command loop, where goals move a little every tick, a solve takes one or two
+iterations. Joint limits are enforced by clipping every step. A target the
+solver can't get within `tol` of (out of reach, or outside the limits) is a
+failure: Solve returns None for it and keeps its previous warm start.
+
+Solve_Path solves a whole path in one vectorized pass and only falls back to
+sequential warm starts for points whose solution jumps away from their
+neighbour's (a different elbow branch).
+
+Usage: python InverseKinematics.py x y z
+prints goal ticks for a tip position, starting from the 't' macro pose.
+
+"""
+
+import sys
+
+import numpy as np
+
+from Kinematics import ArmModel, TABLE_POSE
+
+
+class IKSolver:
+    def __init__(self, model,
+                 # damping of the least squares step, meters
+                 damping = 0.01,
+                 # position tolerance, meters
+                 tol = 1e-4,
+                 max_iters = 50,
+                 # joint step (rad) above which neighbouring path solutions count as a jump
+                 jump = 0.5):
+        self.model = model
+        self.damping = damping
+        self.tol = tol
+        self.max_iters = max_iters
+        self.jump = jump
+        self.last = None
+        self.iterations = 0
+
+    def _Iterate(self, q, target):
+        # q: (S, 4) updated in place toward target (S, 3) or (3,).
+        # Returns final errors (S,) and the iterations used.
+        model = self.model
+        lam2 = self.damping ** 2
+        eye = np.eye(3)
+        active = np.ones(q.shape[0], dtype=bool)
+        err = np.zeros(q.shape[0])
+        target = np.broadcast_to(target, (q.shape[0], 3))
+        for it in range(self.max_iters + 1):
+            origins, axes, tip = model.Frames(q[active])
+            e = target[active] - tip
+            n = np.linalg.norm(e, axis=1)
+            err[active] = n
+            left = n > self.tol
+            if not left.any() or it == self.max_iters:
+                break
+            idx = np.flatnonzero(active)[left]
+            J = np.cross(axes[left], tip[left, None, :] - origins[left]).transpose(0, 2, 1)
+            # dq = J^T (J J^T + lambda^2 I)^-1 e, a 3x3 solve per seed
+            A = J @ J.transpose(0, 2, 1) + lam2 * eye
+            w = np.linalg.solve(A, e[left][:, :, None])
+            q[idx] += (J.transpose(0, 2, 1) @ w)[:, :, 0]
+            q[idx] = np.clip(q[idx], model.lower, model.upper)
+            active[:] = False
+            active[idx] = True
+        return err, it
+
+    def Solve(self, target, q0 = None, seeds = None):
+        # target (3,) in meters. q0: starting angles (defaults to the previous
+        # solution). seeds: extra (S, 4) starting points tried in the same batch.
+        # Returns (angles, error in meters), angles None if the error is above tol.
+        if q0 is None:
+            q0 = self.last if self.last is not None else np.zeros(4)
+        q = np.atleast_2d(np.asarray(q0, dtype=float)).copy()
+        start = q[0].copy()
+        if seeds is not None:
+            q = np.vstack([q, seeds])
+        err, self.iterations = self._Iterate(q, np.asarray(target, dtype=float))
+        # best error, and among equally good ones the closest to the start
+        ok = err <= max(self.tol, err.min())
+        moves = np.where(ok, np.linalg.norm(q - start, axis=1), np.inf)
+        k = int(np.argmin(moves))
+        if err[k] > self.tol:
+            return None, err[k]
+        self.last = q[k]
+        return q[k], err[k]
+
+    def Solve_Ticks(self, target, current_ticks):
+        # Cartesian goal to goal ticks, warm started from the present position.
+        # (None, error) if it can't be reached
+        q, err = self.Solve(target, self.model.Ticks_To_Angles(current_ticks))
+        if q is None:
+            return None, err
+        return self.model.Angles_To_Ticks(q), err
+
+    def Solve_Path(self, targets, q0):
+        # targets (P, 3). Returns (P, 4) angles and (P,) errors
+        targets = np.asarray(targets, dtype=float)
+        P = targets.shape[0]
+        q = np.tile(np.asarray(q0, dtype=float), (P, 1))
+        err, _ = self._Iterate(q, targets)
+        # re-solve points that left the branch of their predecessor
+        prev = np.asarray(q0, dtype=float)
+        for i in range(P):
+            if np.max(np.abs(q[i] - prev)) > self.jump or err[i] > self.tol:
+                qi = prev[None].copy()
+                ei, _ = self._Iterate(qi, targets[i])
+                if ei[0] <= err[i] or np.max(np.abs(q[i] - prev)) > self.jump:
+                    q[i] = qi[0]
+                    err[i] = ei[0]
+            prev = q[i]
+        if err[-1] <= self.tol:
+            self.last = q[-1]
+        return q, err
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print(__doc__)
+        sys.exit(1)
+    model = ArmModel()
+    solver = IKSolver(model)
+    ticks, err = solver.Solve_Ticks([float(v) for v in sys.argv[1:4]], TABLE_POSE)
+    if ticks is None:
+        print("Unreachable: closest tip is %.1f mm away (%d iterations)" % (1e3 * err, solver.iterations))
+        sys.exit(1)
+    print("Goal ticks: %s (error %.2f mm, %d iterations)" % (ticks, 1e3 * err, solver.iterations))
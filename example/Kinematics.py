@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Forward kinematics and Jacobians of the 4-DOF arm.
+
+Joint 1 is at the base: motor 100 turns it horizontally (about the vertical
+axis), motor 101 vertically. Joint 2 sits at the end of the first link:
+motor 102 turns it horizontally (about the first link's up axis), motor 103
+vertically. Angles are 0 when the servo reads `zero_ticks`, with the arm
+stretched out along x.
+
+Everything works on batches of joint vectors, shape (N, 4), so a whole
+logged session is converted without a Python loop. JacobianCache memoizes
+tip position and Jacobian on quantized tick values for the real-time path.
+
+Link lengths and zero offsets are the ArmModel arguments; measure them on
+the arm you use.
+
+Usage: python Kinematics.py [session.csv]
+prints the tip position of the 't' macro table pose, or the tip trajectory
+of a session logged with Position1..4 columns.
+
+"""
+
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Goal positions of the 't' macro in move_buttons2.py (end effector on the table)
+TABLE_POSE = np.array([193, 1450, 307, 2274])
+
+
+def rot_z(q):
+    # (N,) angles -> (N, 3, 3) rotations about z
+    c, s = np.cos(q), np.sin(q)
+    R = np.zeros(q.shape + (3, 3))
+    R[..., 0, 0] = c
+    R[..., 0, 1] = -s
+    R[..., 1, 0] = s
+    R[..., 1, 1] = c
+    R[..., 2, 2] = 1.
+    return R
+
+
+def rot_y(q):
+    # (N,) angles -> (N, 3, 3) rotations about y, positive angle lifts x up
+    c, s = np.cos(q), np.sin(q)
+    R = np.zeros(q.shape + (3, 3))
+    R[..., 0, 0] = c
+    R[..., 0, 2] = -s
+    R[..., 1, 1] = 1.
+    R[..., 2, 0] = s
+    R[..., 2, 2] = c
+    return R
+
+
+class ArmModel:
+    def __init__(self,
+                 # link lengths in meters: base joint to joint 2, joint 2 to tip
+                 link_lengths = (0.25, 0.25),
+                 # height of the base joint above the table, meters
+                 base_height = 0.,
+                 # servo reading at angle 0, motors 100-103
+                 zero_ticks = (2048, 2048, 2048, 2048),
+                 # +1 or -1, servo direction relative to the model
+                 directions = (1, 1, 1, 1),
+                 ticks_per_rev = 4096,
+                 # joint limits in ticks, (lower, upper) per motor. None for the
+                 # servo's position range, 0 to ticks_per_rev - 1
+                 tick_limits = None):
+        self.link_lengths = np.asarray(link_lengths, dtype=float)
+        self.base_height = base_height
+        self.zero_ticks = np.asarray(zero_ticks, dtype=float)
+        self.directions = np.asarray(directions, dtype=float)
+        self.ticks_per_rev = ticks_per_rev
+        self.scale = self.directions * 2. * np.pi / ticks_per_rev
+        if tick_limits is None:
+            tick_limits = [(0, ticks_per_rev - 1)] * 4
+        lim = self.Ticks_To_Angles(np.asarray(tick_limits, dtype=float).T)
+        self.lower = np.minimum(lim[0], lim[1])
+        self.upper = np.maximum(lim[0], lim[1])
+
+    def Ticks_To_Angles(self, ticks):
+        return (np.asarray(ticks, dtype=float) - self.zero_ticks) * self.scale
+
+    def Angles_To_Ticks(self, q):
+        return np.rint(np.asarray(q) / self.scale + self.zero_ticks).astype(int)
+
+    def Frames(self, q):
+        # q: (N, 4) angles. Returns joint origins (N, 4, 3), joint axes (N, 4, 3)
+        # and tip positions (N, 3), all in the base frame.
+        q = np.atleast_2d(np.asarray(q, dtype=float))
+        n = q.shape[0]
+        L1, L2 = self.link_lengths
+        R1 = rot_z(q[:, 0])
+        R2 = R1 @ rot_y(q[:, 1])
+        R3 = R2 @ rot_z(q[:, 2])
+        R4 = R3 @ rot_y(q[:, 3])
+        base = np.array([0., 0., self.base_height])
+        elbow = base + L1 * R2[:, :, 0]
+        tip = elbow + L2 * R4[:, :, 0]
+        origins = np.empty((n, 4, 3))
+        origins[:, 0] = base
+        origins[:, 1] = base
+        origins[:, 2] = elbow
+        origins[:, 3] = elbow
+        # z of the frame before a yaw joint, y of the frame before a pitch joint
+        axes = np.empty((n, 4, 3))
+        axes[:, 0] = (0., 0., 1.)
+        axes[:, 1] = R1[:, :, 1]
+        axes[:, 2] = R2[:, :, 2]
+        axes[:, 3] = R3[:, :, 1]
+        # positive pitch lifts the link, which is a rotation about -y
+        axes[:, 1] *= -1.
+        axes[:, 3] *= -1.
+        return origins, axes, tip
+
+    def Forward(self, q):
+        # (N, 4) angles -> (N, 3) tip positions
+        return self.Frames(q)[2]
+
+    def Forward_Ticks(self, ticks):
+        return self.Forward(self.Ticks_To_Angles(ticks))
+
+    def Jacobian(self, q, point = None, link = 1):
+        # Position Jacobian (N, 3, 4) of the tip, or of `point` (N, 3) attached
+        # to `link` (0: first link, only joints 1-2 move it; 1: second link).
+        origins, axes, tip = self.Frames(q)
+        if point is None:
+            point = tip
+        J = np.cross(axes, point[:, None, :] - origins).transpose(0, 2, 1)
+        if link == 0:
+            J[:, :, 2:] = 0.
+        return J
+
+    def Link_Points(self, q, s):
+        # Points at fractions s (M,) along both links: (N, 2, M, 3)
+        origins, axes, tip = self.Frames(q)
+        s = np.asarray(s, dtype=float)
+        starts = origins[:, [0, 2]]
+        ends = np.stack([origins[:, 2], tip], axis=1)
+        return starts[:, :, None, :] + s[None, None, :, None] * (ends - starts)[:, :, None, :]
+
+
+class JacobianCache:
+    # Tip position and Jacobian memoized on ticks rounded to `resolution`
+    def __init__(self, model, resolution = 4, maxsize = 4096):
+        self.model = model
+        self.resolution = resolution
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def Get(self, ticks):
+        r = self.resolution
+        key = tuple(int(round(t / r)) for t in ticks)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+        q = self.model.Ticks_To_Angles(np.array(key, dtype=float) * r)[None]
+        origins, axes, tip = self.model.Frames(q)
+        J = np.cross(axes, tip[:, None, :] - origins).transpose(0, 2, 1)
+        entry = (tip[0], J[0])
+        self.entries[key] = entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return entry
+
+
+def session_trajectory(model, ticks):
+    # (N, 4) logged positions -> (N, 3) tip trajectory
+    return model.Forward_Ticks(ticks)
+
+
+if __name__ == '__main__':
+    model = ArmModel()
+    if len(sys.argv) < 2:
+        print("Table pose %s -> tip %s m" % (TABLE_POSE, np.array2string(model.Forward_Ticks(TABLE_POSE)[0], precision=3)))
+        sys.exit(0)
+    with open(sys.argv[1]) as f:
+        header = [h.strip() for h in f.readline().split(',')]
+    cols = [header.index('Position%d' % i) for i in range(1, 5)]
+    ticks = np.loadtxt(sys.argv[1], delimiter=',', skiprows=1, usecols=cols, ndmin=2)
+    tip = session_trajectory(model, ticks)
+    print("x, y, z")
+    for p in tip:
+        print("%f,%f,%f" % tuple(p))
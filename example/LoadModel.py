@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pose dependent load current model.
+
+The current a joint draws while the arm holds still is mostly gravity, a
+trig polynomial of the vertical joint angles (and of the elbow's horizontal
+angle, which swings the second link's weight around). The model regresses
+each joint's current on the products of {1, sin, cos} of joints 2, 3 and 4,
+27 features, solved for all joints at once with NumPy least squares from
+recorded position + current sessions.
+
+At run time Subtract removes the predicted load from a current sample using
+the precomputed coefficients and preallocated buffers, so what goes into the
+bandpass and the detector is the contact residual.
+
+Usage:
+    python LoadModel.py record session.csv [range_ticks] [steps] [hold]
+        steps motors 101 and 103 over a grid around the present pose and logs
+        Timestamp, Current1..4, Position1..4
+    python LoadModel.py fit load_model.npz session.csv ...
+
+"""
+
+import math
+import sys
+
+import numpy as np
+
+from Kinematics import ArmModel
+
+
+N_FEATURES = 27
+
+
+def load_features(q):
+    # (N, 4) joint angles -> (N, 27) features
+    q = np.atleast_2d(np.asarray(q, dtype=float))
+    n = q.shape[0]
+    f = [np.stack([np.ones(n), np.sin(q[:, j]), np.cos(q[:, j])], axis=1) for j in (1, 3, 2)]
+    return (f[0][:, :, None, None] * f[1][:, None, :, None] * f[2][:, None, None, :]).reshape(n, N_FEATURES)
+
+
+class LoadModel:
+    def __init__(self, coeffs, model = None):
+        # coeffs: (27, 4), one column per joint
+        self.coeffs = np.asarray(coeffs, dtype=float)
+        self.model = model if model is not None else ArmModel()
+        # run-time buffers
+        self.f1 = np.ones(3)
+        self.f2 = np.ones(3)
+        self.f3 = np.ones(3)
+        self.f12 = np.zeros((3, 3))
+        self.f = np.zeros((3, 3, 3))
+        self.flat = self.f.reshape(N_FEATURES)
+        self.load = np.zeros(self.coeffs.shape[1])
+        self.residual = np.zeros(self.coeffs.shape[1])
+
+    @classmethod
+    def Fit(cls, q, currents, model = None, ridge = 1e-6):
+        # q: (N, 4) angles, currents: (N, 4). Least squares for all joints in one solve
+        F = load_features(q)
+        A = F.T @ F + ridge * len(F) * np.eye(N_FEATURES)
+        coeffs = np.linalg.solve(A, F.T @ np.asarray(currents, dtype=float))
+        return cls(coeffs, model)
+
+    def Predict(self, q):
+        # (N, 4) angles -> (N, 4) expected currents
+        return load_features(q) @ self.coeffs
+
+    def Predict_One(self, ticks):
+        # expected current at one pose, no allocation (the result is reused)
+        model = self.model
+        zero = model.zero_ticks
+        scale = model.scale
+        for f, j in ((self.f1, 1), (self.f2, 3), (self.f3, 2)):
+            a = (ticks[j] - zero[j]) * scale[j]
+            f[1] = math.sin(a)
+            f[2] = math.cos(a)
+        np.multiply.outer(self.f1, self.f2, out=self.f12)
+        np.multiply.outer(self.f12, self.f3, out=self.f)
+        np.dot(self.flat, self.coeffs, out=self.load)
+        return self.load
+
+    def Subtract(self, ticks, currents):
+        # current minus the predicted load at the present pose (the result is reused)
+        np.subtract(currents, self.Predict_One(ticks), out=self.residual)
+        return self.residual
+
+    def Save(self, path):
+        np.savez(path, coeffs=self.coeffs)
+
+    @classmethod
+    def Load(cls, path, model = None):
+        with np.load(path) as d:
+            return cls(d['coeffs'], model)
+
+
+def load_sessions(paths):
+    # Stacks Position1..4 and Current1..4 columns of the given csv files
+    ticks = []
+    currents = []
+    for path in paths:
+        with open(path) as f:
+            header = [h.strip() for h in f.readline().split(',')]
+        pcols = [header.index('Position%d' % i) for i in range(1, 5)]
+        ccols = [header.index('Current%d' % i) for i in range(1, 5)]
+        d = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+        ticks.append(d[:, pcols])
+        currents.append(d[:, ccols])
+    return np.concatenate(ticks), np.concatenate(currents)
+
+
+def record(fname, range_ticks = 300, steps = 5, hold = 100):
+    from CurrentReader import DynamixelReader, ADDR_PRESENT_POSITION, LEN_PRESENT_POSITION
+    ADDR_PRO_GOAL_POSITION = 116
+    LEN_PRO_GOAL_POSITION = 4
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = 115200,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+    start = reader.Read_Sync_Positions()
+    fout = open(fname, "w")
+    print("Timestamp, Current1, Current2, Current3, Current4, Position1, Position2, Position3, Position4", file=fout)
+    offsets = np.linspace(-range_ticks, range_ticks, steps).astype(int)
+    for d2 in offsets:
+        for d4 in offsets:
+            reader.Set_Value(reader.m2id, ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, start[1] + int(d2))
+            reader.Set_Value(reader.m4id, ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, start[3] + int(d4))
+            # log the second half of every hold, once the arm settled
+            for j in range(hold):
+                [timestamp, c1, c2, c3, c4, v1, v2, v3, v4, p1, p2, p3, p4] = reader.Read_Sync_State()
+                if j >= hold // 2:
+                    print("%09d,%05d,%05d,%05d,%05d,%d,%d,%d,%d" % (timestamp, c1, c2, c3, c4, p1, p2, p3, p4), file=fout)
+    for motorId, p in zip((reader.m1id, reader.m2id, reader.m3id, reader.m4id), start):
+        reader.Set_Value(motorId, ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, p)
+    fout.close()
+    del reader
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['record'] and len(args) >= 2:
+        record(args[1], *[int(a) for a in args[2:]])
+    elif args[:1] == ['fit'] and len(args) >= 3:
+        arm = ArmModel()
+        ticks, currents = load_sessions(args[2:])
+        model = LoadModel.Fit(arm.Ticks_To_Angles(ticks), currents, arm)
+        residual = currents - model.Predict(arm.Ticks_To_Angles(ticks))
+        print("%d samples" % len(ticks))
+        print("Current std per joint before: %s" % np.array2string(currents.std(axis=0), precision=2))
+        print("Residual std per joint after: %s" % np.array2string(residual.std(axis=0), precision=2))
+        model.Save(args[1])
+        print("Saved " + args[1])
+    else:
+        print(__doc__)
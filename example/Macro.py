@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Motion macros: record, store and replay timestamped joint goals.
+
+A macro file is a 16 byte header followed by one packed little endian
+record per sample:
+
+    header  b'DXMC', version (u16), joints (u16), flags (u16), pad (u16),
+            samples (u32)
+    sample  time in microseconds (u32), goal ticks (i32 x joints)
+            [flags & TELEMETRY: present current (i16 x joints),
+                                present position (i32 x joints)]
+
+flags & HOLD marks keyframes (hold each goal until the next one, what the
+old Set_Value + sleep gestures did); without it the samples are a dense
+stream and playback interpolates linearly between them.
+
+Playback computes the whole setpoint array up front (time scaling and loops
+included) and streams it on the fixed-rate loop, one sync write per tick.
+The setpoint of a tick is picked by the elapsed time, not counted, so a slow
+bus call skips setpoints instead of stretching the gesture.
+
+Usage:
+    python Macro.py builtin [dir]          writes the h/t/m gestures of move_buttons2.py
+    python Macro.py record file.dxm        velocity teleop (VelocityTeleop keys), z stops
+    python Macro.py play file.dxm [scale] [loops]
+    python Macro.py info file.dxm
+
+"""
+
+import struct
+import sys
+
+import numpy as np
+
+from RateLoop import RateLoop
+
+
+MAGIC = b'DXMC'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHI')
+TELEMETRY = 1
+HOLD = 2
+
+ADDR_GOAL_POSITION = 116
+LEN_GOAL_POSITION = 4
+
+
+def sample_dtype(joints, telemetry):
+    fields = [('t', '<u4'), ('goal', '<i4', (joints,))]
+    if telemetry:
+        fields += [('current', '<i2', (joints,)), ('position', '<i4', (joints,))]
+    return np.dtype(fields)
+
+
+class Macro:
+    def __init__(self, times, goals, currents = None, positions = None, hold = False):
+        # times (N,) seconds, goals (N, joints) ticks. N may be 0 (nothing recorded)
+        self.times = np.asarray(times, dtype=float)
+        goals = np.asarray(goals, dtype=np.int64)
+        self.goals = goals if goals.ndim == 2 else goals.reshape(len(self.times), -1)
+        self.currents = None if currents is None else np.asarray(currents)
+        self.positions = None if positions is None else np.asarray(positions)
+        self.hold = hold
+
+    @classmethod
+    def From_Keyframes(cls, start, steps):
+        # start: goals of all joints. steps: (delay before, {joint index: goal}),
+        # the goals of the joints not named carry over
+        goals = [np.array(start)]
+        times = [0.]
+        for delay, change in steps:
+            g = goals[-1].copy()
+            for j, v in change.items():
+                g[j] = v
+            times.append(times[-1] + delay)
+            goals.append(g)
+        return cls(times, goals, hold=True)
+
+    def Duration(self):
+        return self.times[-1] if len(self.times) else 0.
+
+    def Setpoints(self, rate, scale = 1., loops = 1):
+        # (M, joints) goal ticks, one row per tick at `rate`. scale > 1 plays slower.
+        # An empty macro has no setpoints
+        if len(self.times) == 0:
+            return np.zeros((0, self.goals.shape[1]), dtype=np.int64)
+        times = self.times * scale
+        duration = times[-1]
+        # keyframes end on their last goal; give it a tick so it is sent
+        n = int(np.floor(duration * rate)) + 1
+        t = np.arange(n) / rate
+        if self.hold:
+            idx = np.searchsorted(times, t, side='right') - 1
+            one = self.goals[idx]
+        else:
+            one = np.stack([np.interp(t, times, self.goals[:, j]) for j in range(self.goals.shape[1])], axis=1)
+        return np.rint(np.tile(one, (loops, 1))).astype(np.int64)
+
+    def Save(self, path):
+        telemetry = self.currents is not None and self.positions is not None
+        joints = self.goals.shape[1]
+        data = np.zeros(len(self.times), dtype=sample_dtype(joints, telemetry))
+        data['t'] = np.rint(self.times * 1e6)
+        data['goal'] = self.goals
+        if telemetry:
+            data['current'] = self.currents
+            data['position'] = self.positions
+        flags = (TELEMETRY if telemetry else 0) | (HOLD if self.hold else 0)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, joints, flags, 0, len(data)))
+            f.write(data.tobytes())
+
+    @classmethod
+    def Load(cls, path):
+        with open(path, 'rb') as f:
+            magic, version, joints, flags, pad, n = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("%s is not a version %d macro file" % (path, VERSION))
+            data = np.frombuffer(f.read(), dtype=sample_dtype(joints, flags & TELEMETRY), count=n)
+        return cls(data['t'] / 1e6, data['goal'],
+                   data['current'] if flags & TELEMETRY else None,
+                   data['position'] if flags & TELEMETRY else None,
+                   bool(flags & HOLD))
+
+
+class MacroRecorder:
+    def __init__(self, capacity = 60000):
+        # preallocated, enough for 10 minutes at 100 Hz
+        self.times = np.zeros(capacity)
+        self.goals = np.zeros((capacity, 4), dtype=np.int64)
+        self.currents = np.zeros((capacity, 4), dtype=np.int64)
+        self.positions = np.zeros((capacity, 4), dtype=np.int64)
+        self.n = 0
+
+    def Add(self, t, state):
+        # state: a Read_Sync_State row. The present position is the goal to replay
+        if self.n == len(self.times):
+            return
+        self.times[self.n] = t
+        self.currents[self.n] = state[1:5]
+        self.positions[self.n] = state[9:13]
+        self.goals[self.n] = state[9:13]
+        self.n += 1
+
+    def Macro(self):
+        n = self.n
+        return Macro(self.times[:n] - self.times[0] if n else self.times[:0], self.goals[:n],
+                     self.currents[:n], self.positions[:n])
+
+
+def play(reader, macro, rate = 100., scale = 1., loops = 1):
+    # Streams the macro in position control, nothing for an empty one.
+    # Returns the RateLoop for its report
+    setpoints = macro.Setpoints(rate, scale, loops)
+    loop = RateLoop(rate)
+    loop.Start()
+    k = 0
+    last = len(setpoints) - 1
+    while k < last:
+        reader.Write_Sync(ADDR_GOAL_POSITION, LEN_GOAL_POSITION, setpoints[k])
+        k = int(loop.Wait() * rate + 0.5)
+    # a late tick can step past the end: the final pose is always sent
+    if last >= 0:
+        reader.Write_Sync(ADDR_GOAL_POSITION, LEN_GOAL_POSITION, setpoints[last])
+    return loop
+
+
+# The gestures hard-coded in move_buttons2.py, as keyframes
+def builtin_macros():
+    hello = [(1., {3: 780}), (1., {2: -732})]
+    for x in range(5):
+        hello += [(0.5, {2: 1148}), (0.5, {2: -732} if x < 4 else {})]
+    tap = [(1., {1: 1400}), (1., {1: 1450}), (0.5, {1: 1400}), (1., {1: 1450}), (0.5, {})]
+    whip = [(0.1, {2: 1960}), (0.1, {3: 2600}), (0.1, {0: 4400}), (0.1, {1: 1410}),
+            (0.1, {2: 1360}), (0.1, {0: 4430}), (0.1, {1: 1420}), (0.1, {2: 1364}),
+            (0.1, {3: 1940})]
+    return {'hello': Macro.From_Keyframes([3901, 950, 288, 2100], hello),
+            'tap': Macro.From_Keyframes([193, 1450, 307, 2274], tap),
+            'whip': Macro.From_Keyframes([3500, 1710, 2100, 2050], whip)}
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['builtin']:
+        folder = args[1] if len(args) > 1 else '.'
+        for name, macro in builtin_macros().items():
+            macro.Save('%s/%s.dxm' % (folder, name))
+            print("Saved %s/%s.dxm, %.1f s" % (folder, name, macro.Duration()))
+    elif args[:1] == ['info'] and len(args) == 2:
+        macro = Macro.Load(args[1])
+        print("%d samples, %.2f s, %s, telemetry: %s" % (len(macro.times), macro.Duration(),
+              'keyframes' if macro.hold else 'stream', macro.currents is not None))
+    elif args[:1] in (['record'], ['play']) and len(args) >= 2:
+        from CurrentReader import DynamixelReader
+        reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                                 baud_rate = 115200,
+                                 m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                                 proto_ver = 2,
+                                 read_addr = 126, read_len = 2)
+        if args[0] == 'record':
+            import keyboard
+            from VelocityTeleop import VelocityTeleop
+            recorder = MacroRecorder()
+            teleop = VelocityTeleop(reader, keyboard.is_pressed)
+            print("q/a w/s e/d r/f move motors 1-4, z stops recording")
+            teleop.Run(recorder)
+            if recorder.n == 0:
+                print("Nothing recorded, %s not written" % args[1])
+            else:
+                recorder.Macro().Save(args[1])
+                print("Saved %d samples to %s" % (recorder.n, args[1]))
+        else:
+            scale = float(args[2]) if len(args) > 2 else 1.
+            loops = int(args[3]) if len(args) > 3 else 1
+            loop = play(reader, Macro.Load(args[1]), scale=scale, loops=loops)
+            print(loop.Report())
+        del reader
+    else:
+        print(__doc__)
@@ -12,21 +12,12 @@ Prints position of obstacle
 
 from CurrentReader import *
 import numpy as np
-from scipy.signal import butter, lfilter, freqz
-
-
-
-def butter_bandpass(lowcut, highcut, fs, order=5):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
-
-
-def run_filter(data, b, a):
-    y = lfilter(b, a, data)
-    return y
+from Resampler import UniformBandpass
+from WireModel import WireModel
+from ContactDetector import ContactDetector
+from ContactLocalizer import ContactLocalizer
+from Kinematics import ArmModel
+from LoadModel import LoadModel
 
 def get_motor():
     
@@ -98,79 +89,81 @@ if __name__ == '__main__':
         del reader
         sys.exit(0)
     
-    N_QUERIES = 10000000
-    
     #Reading current position at start
     current_position = reader.Read_Value(motor, ADDR_PRO_PRESENT_POSITION, LEN_PRO_PRESENT_POSITION)
-    
-    # Array of readings initialized to 0
-    x = np.zeros((N_QUERIES,))
-    y = np.zeros((N_QUERIES,))
-    
-    # Array for event detection
-    e = np.zeros(10)
-    
-    # Number of consecutive events detected
-    num_event = 0
-    
+
     timestamp = 0
-    fs = 240.
+    # The loop reads as fast as the bus allows: start from the wire model's
+    # rate for the state read, the measured rate takes over after warm-up.
+    # Samples go onto a uniform grid at that rate, so the cutoffs hold at
+    # whatever rate Read_Sync_State actually runs.
+    fs = WireModel(reader.baud_rate).Max_Rate([('sync_read', 4, 10)])
     low = 5.
     hi = 100.
-    b,a = butter_bandpass(low,hi,fs, order=4)
-    M=b.size
-    N=a.size
-    j = 0;
-    
-    
+    bandpass = UniformBandpass(n_channels=4, low=low, hi=hi, fs=fs, order=4)
+    model = ArmModel()
+    # Expected load current per pose, fitted with 'python LoadModel.py fit'.
+    # When present only the residual goes to the filter, so thresholds can be lower
+    LOAD_MODEL = "load_model.npz"
+    load = LoadModel.Load(LOAD_MODEL, model) if os.path.exists(LOAD_MODEL) else None
+
+    # Measure the noise floor of every joint while the arm holds still
+    N_CALIBRATION = 240
+    quiet = []
+    for j in range(N_CALIBRATION):
+        # current and position in one sync read
+        state = reader.Read_Sync_State()
+        currents = load.Subtract(state[9:13], state[1:5]) if load is not None else state[1:5]
+        quiet.extend(bandpass.Update(state[0], currents).copy())
+    print("Measured sample rate: %.1f Hz" % bandpass.Rate())
+    # Drop the first samples, the filter is still settling there
+    quiet = np.array(quiet)
+    detector = ContactDetector.From_Noise_Floor(quiet[len(quiet) // 4:], enter_sigma=6., exit_sigma=3.,
+                                                confirm=10,
+                                                motor_ids=(reader.m1id, reader.m2id, reader.m3id, reader.m4id))
+    print("Enter thresholds: ", detector.enter_thresh)
+    localizer = ContactLocalizer(model, window=40)
+
+    j = 0
+    y = np.zeros(4)
     while 1:
 
         oldtimestamp = timestamp
 
-        # read all current
-        [timestamp, dxl1_current, dxl2_current, dxl3_current, dxl4_current] = reader.Read_Sync_Once()
-
-        # compute norm
-        x[j] = np.sqrt(dxl1_current**2 + dxl2_current**2 + dxl3_current**2 + dxl4_current**2)
-        
-        #filter
-        if (j < 20):
-            if (j>= 10):
-                # filter everything using lfilter
-                y[0:j+1]= lfilter(b, a, x[0:j+1])
-        else:
-            y[j] = 1./a[0] *( b.dot(x[j:j-M:-1]) - a[1:N].dot(y[j-1:j-N:-1]))
-
-        
-        # Event detection. Stop if event is detected. Keep moving arm if no event is detected     
-        if (np.abs(y[j]) > 1. and np.abs(y[j-1]) > 1.):
-            print( " EVENT ")
-            
-            # To make sure that event is constant and not just a fluctuation
-            if e[9] == 1:
-                print( " Object detected" )
-                if (direction == 'l' or direction == 'u'):
-                    print(current_position - int(j/10))
-                else:
-                    print(current_position + int(j/10))
+        # read all current and position
+        state = reader.Read_Sync_State()
+        timestamp = state[0]
+        ticks = state[9:13]
+        currents = load.Subtract(ticks, state[1:5]) if load is not None else state[1:5]
+
+        #filter, 0 or more grid samples per read
+        localizer.Add_Sample(currents)
+        for yg in bandpass.Update(timestamp, currents):
+            y = yg
+            # Event detection. Stop once a contact is confirmed. Keep moving arm while there is no event
+            detector.Update(yg)
+            if detector.new_contact:
                 break
-            else:
-                e[num_event] = 1
-                num_event += 1
-
+        if detector.new_contact:
+            print( " Object detected by motor %d" % detector.Contact_Motor())
+            # Pose as the servos report it, not the last goal we sent
+            print("Present position: ", ticks)
+            contact = localizer.Localize(model.Ticks_To_Angles(ticks), n_contact=detector.confirm)
+            if contact is not None:
+                print("Contact point (m): ", contact['point'], " on link %d" % (contact['link'] + 1))
+                print("Force direction: ", contact['direction'], " magnitude (N): %f" % np.linalg.norm(contact['force']))
+            break
+        elif detector.pending:
+            print( " EVENT ")
         else:
-            # Reset array for event detection
-            e = np.zeros(10)
-            num_event = 0
-            
             skip = 10
             if j % skip == 0:
                 if (direction == 'l' or direction == 'u'):
                     reader.Set_Value(motor, ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, current_position - int(j/10))
                 else:
                     reader.Set_Value(motor, ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, current_position + int(j/10))
-        
+
         difft = timestamp - oldtimestamp
-        print("%09d,%f" % (timestamp, y[j] ))
+        print("%09d,%f,%f,%f,%f" % (timestamp, y[0], y[1], y[2], y[3]))
         j+=1
     del reader
@@ -28,13 +28,7 @@ else:
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
         return ch
 
-# todo Ante: Set this
-os.sys.path.append('../DynamixelSDK-master/python/dynamixel_functions_py')             # Path setting
-os.sys.path.append('.')             # Path setting
-cwd=os.getcwd()
-os.chdir('../DynamixelSDK-master/python/dynamixel_functions_py')
-import dynamixel_functions as dynamixel                     # Uses Dynamixel SDK library
-os.chdir(cwd)
+import dxl_sdk as dynamixel                                # Uses Dynamixel SDK library (C, or the pure Python fallback)
 import datetime
 
 
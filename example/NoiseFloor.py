@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Running baseline and noise floor of every joint.
+
+Keeps an exponentially weighted mean and variance per channel, so memory is
+constant however long the arm runs. While the estimator is frozen (the
+detector freezes it during an event) samples are ignored, so a contact does
+not inflate the baseline it is measured against. Until it has seen `warmup`
+samples (one span by default) the estimate isn't Ready and the detector only
+feeds it.
+
+"""
+
+import numpy as np
+
+
+class NoiseFloorTracker:
+    def __init__(self, n_channels=4,
+                 # time constant of the averages, in samples
+                 span=480,
+                 # smallest sigma reported (currents are integer ticks)
+                 min_sigma=0.5,
+                 # samples before the estimate is used, None for one span
+                 warmup=None):
+        self.n_channels = n_channels
+        self.warmup = span if warmup is None else warmup
+        self.alpha = 2. / (span + 1.)
+        self.min_sigma = min_sigma
+        self.mean = np.zeros(n_channels)
+        self.var = np.zeros(n_channels)
+        self.sigma = np.full(n_channels, min_sigma)
+        self.delta = np.zeros(n_channels)
+        self.frozen = False
+        self.n = 0
+
+    def Reset(self):
+        self.mean[:] = 0.
+        self.var[:] = 0.
+        self.sigma[:] = self.min_sigma
+        self.frozen = False
+        self.n = 0
+
+    def Ready(self):
+        return self.n >= self.warmup
+
+    def Freeze(self):
+        self.frozen = True
+
+    def Unfreeze(self):
+        self.frozen = False
+
+    def Update(self, x):
+        if self.frozen:
+            return
+        self.n += 1
+        # plain running average until there are enough samples, so the
+        # estimate is usable right after start up
+        alpha = max(self.alpha, 1. / self.n)
+        delta = self.delta
+        np.subtract(x, self.mean, out=delta)
+        # West's incremental update for the weighted mean and variance
+        self.mean += alpha * delta
+        self.var *= (1. - alpha)
+        self.var += alpha * (1. - alpha) * delta * delta
+        np.sqrt(self.var, out=self.sigma)
+        np.maximum(self.sigma, self.min_sigma, out=self.sigma)
+
+    def Normalize(self, x, out=None):
+        # deviation from the baseline in units of sigma
+        out = np.subtract(x, self.mean, out=out)
+        out /= self.sigma
+        return out
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pure Python Dynamixel Protocol 2.0 packet codec.
+
+Builds instruction packets (header FF FF FD 00, id, length, instruction,
+parameters, CRC-16) with byte stuffing, and parses status packets out of a
+byte stream incrementally: StatusParser.Feed takes whatever the port
+delivered and returns the complete, CRC checked packets, resyncing on the
+header after garbage or a bad CRC.
+
+No I/O here; AsyncDynamixel.py puts it on a serial port.
+
+"""
+
+import struct
+
+
+HEADER = b'\xff\xff\xfd\x00'
+BROADCAST_ID = 0xfe
+
+PING = 0x01
+READ = 0x02
+WRITE = 0x03
+REBOOT = 0x08
+STATUS = 0x55
+SYNC_READ = 0x82
+SYNC_WRITE = 0x83
+BULK_READ = 0x92
+BULK_WRITE = 0x93
+
+# status packet error field, bit 7 is the hardware error alert
+ERRORS = {1: 'result fail', 2: 'instruction error', 3: 'crc error', 4: 'data range error',
+          5: 'data length error', 6: 'data limit error', 7: 'access error'}
+HARDWARE_ALERT = 0x80
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 8
+        for j in range(8):
+            crc = ((crc << 1) ^ 0x8005) if crc & 0x8000 else (crc << 1)
+        table.append(crc & 0xffff)
+    return table
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc16(data, crc = 0):
+    for b in data:
+        crc = ((crc << 8) ^ CRC_TABLE[((crc >> 8) ^ b) & 0xff]) & 0xffff
+    return crc
+
+
+def stuff(data):
+    # an FD after FF FF FD in the body, so the body can't look like a header
+    return data.replace(b'\xff\xff\xfd', b'\xff\xff\xfd\xfd')
+
+
+def unstuff(data):
+    return data.replace(b'\xff\xff\xfd\xfd', b'\xff\xff\xfd')
+
+
+def instruction(dxl_id, inst, params = b''):
+    body = stuff(bytes([inst]) + bytes(params))
+    packet = HEADER + struct.pack('<BH', dxl_id, len(body) + 2) + body
+    return packet + struct.pack('<H', crc16(packet))
+
+
+def ping(dxl_id):
+    return instruction(dxl_id, PING)
+
+
+def read(dxl_id, addr, length):
+    return instruction(dxl_id, READ, struct.pack('<HH', addr, length))
+
+
+def write(dxl_id, addr, data):
+    return instruction(dxl_id, WRITE, struct.pack('<H', addr) + bytes(data))
+
+
+def reboot(dxl_id):
+    return instruction(dxl_id, REBOOT)
+
+
+def sync_read(addr, length, ids):
+    return instruction(BROADCAST_ID, SYNC_READ, struct.pack('<HH', addr, length) + bytes(ids))
+
+
+def sync_write(addr, length, data):
+    # data: {id: bytes of `length`}
+    params = struct.pack('<HH', addr, length) + b''.join(bytes([i]) + bytes(d) for i, d in data.items())
+    return instruction(BROADCAST_ID, SYNC_WRITE, params)
+
+
+def bulk_read(requests):
+    # requests: [(id, addr, length)]
+    return instruction(BROADCAST_ID, BULK_READ, b''.join(struct.pack('<BHH', *r) for r in requests))
+
+
+def encode(value, length):
+    # int -> little endian bytes of `length`, negative values two's complement
+    return (int(value) & ((1 << (8 * length)) - 1)).to_bytes(length, 'little')
+
+
+def decode(data, signed = False):
+    return int.from_bytes(data, 'little', signed=signed)
+
+
+def error_text(error):
+    text = ERRORS.get(error & 0x7f, 'error %d' % (error & 0x7f)) if error & 0x7f else ''
+    if error & HARDWARE_ALERT:
+        text = (text + ', ' if text else '') + 'hardware error alert'
+    return text
+
+
+class StatusParser:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.bad_crc = 0
+
+    def Reset(self):
+        self.buffer.clear()
+
+    def Feed(self, data):
+        # returns [(id, error, params)] of the complete status packets so far
+        buf = self.buffer
+        buf += data
+        packets = []
+        while True:
+            start = buf.find(HEADER)
+            if start < 0:
+                # keep a possible partial header
+                del buf[:max(len(buf) - 3, 0)]
+                return packets
+            del buf[:start]
+            if len(buf) < 7:
+                return packets
+            length = buf[5] | (buf[6] << 8)
+            if len(buf) < 7 + length:
+                return packets
+            packet = bytes(buf[:7 + length])
+            if length < 4 or crc16(packet[:-2]) != (packet[-2] | (packet[-1] << 8)):
+                # not a packet after all, look for the next header
+                self.bad_crc += 1
+                del buf[:1]
+                continue
+            del buf[:7 + length]
+            if packet[7] != STATUS:
+                # our own instruction echoed (half duplex adapters without echo cancel)
+                continue
+            packets.append((packet[4], packet[8], unstuff(packet[9:-2])))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed rate loop timing.
+
+Ticks are scheduled on absolute deadlines (start + k * period), so the rate
+doesn't drift with how long each iteration's bus calls take. A tick that
+finds its deadline already passed is counted as missed; if the loop falls
+more than one period behind it skips ahead instead of bursting to catch up.
+
+"""
+
+import time
+
+
+class RateLoop:
+    def __init__(self, rate,
+                 # sleep until this close to the deadline, then spin (time.sleep is coarse)
+                 spin = 0.0005):
+        self.period = 1. / rate
+        self.spin = spin
+        self.Start()
+
+    def Start(self):
+        self.t0 = time.perf_counter()
+        self.deadline = self.t0
+        self.ticks = 0
+        self.missed = 0
+        self.worst = 0.
+        self.late = 0.
+
+    def Wait(self):
+        # Blocks until the next tick. Returns the time since Start in seconds;
+        # self.late is how far past its deadline this tick started.
+        self.deadline += self.period
+        self.ticks += 1
+        now = time.perf_counter()
+        late = now - self.deadline
+        self.late = max(late, 0.)
+        if late > 0:
+            self.missed += 1
+            self.worst = max(self.worst, late)
+            if late > self.period:
+                self.deadline = now
+            return now - self.t0
+        if -late > self.spin:
+            time.sleep(-late - self.spin)
+        while time.perf_counter() < self.deadline:
+            pass
+        return self.deadline - self.t0
+
+    def Time(self):
+        return time.perf_counter() - self.t0
+
+    def Report(self):
+        return "%d ticks at %.0f Hz, %d missed (worst %.2f ms late)" % (
+            self.ticks, 1. / self.period, self.missed, 1e3 * self.worst)
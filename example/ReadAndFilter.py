@@ -15,20 +15,10 @@
 
 from CurrentReader import *
 import numpy as np
-from scipy.signal import butter, lfilter, freqz
-
-
-def butter_bandpass(lowcut, highcut, fs, order=5):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
-
-
-def run_filter(data, b, a):
-    y = lfilter(b, a, data)
-    return y
+from Resampler import UniformBandpass
+from WireModel import WireModel
+from NoiseFloor import NoiseFloorTracker
+from ContactDetector import ContactDetector
 
 if __name__ == '__main__':
 
@@ -53,15 +43,20 @@ if __name__ == '__main__':
     LEN_PRO_PRESENT_POSITION = 4
 
     current_position = reader.Read_Value(reader.m4id, ADDR_PRO_PRESENT_POSITION, LEN_PRO_PRESENT_POSITION)
-    x = np.zeros((N_QUERIES,))
-    y = np.zeros((N_QUERIES,))
     timestamp = 0
-    fs = 240.
+    # The loop reads as fast as the bus allows: start from the wire model's
+    # rate for the current read, the measured rate takes over after warm-up.
+    # Samples go onto a uniform grid at that rate, so the cutoffs hold at
+    # whatever rate Read_Sync_Once actually runs.
+    fs = WireModel(reader.baud_rate).Max_Rate([('sync_read', 4, reader.read_len)])
     low = 5.
     hi = 100.
-    b,a = butter_bandpass(low,hi,fs, order=4)
-    M=b.size
-    N=a.size
+    # the four joint currents and their norm, filtered together
+    bandpass = UniformBandpass(n_channels=5, low=low, hi=hi, fs=fs, order=4)
+    # per joint detection, thresholds in units of each joint's running noise floor.
+    detector = ContactDetector.With_Tracker(NoiseFloorTracker(n_channels=4), enter_sigma=6., exit_sigma=3.,
+                                            motor_ids=(reader.m1id, reader.m2id, reader.m3id, reader.m4id))
+    sample = np.zeros(5)
     for j in range(N_QUERIES):
         oldtimestamp = timestamp
 
@@ -69,30 +64,22 @@ if __name__ == '__main__':
         [timestamp, dxl1_current, dxl2_current, dxl3_current, dxl4_current] = reader.Read_Sync_Once()
 
         # compute norm
-        x[j] = np.sqrt(dxl1_current**2 + dxl2_current**2 + dxl3_current**2 + dxl4_current**2)
-        #filter
-        if (j < 20):
-            if (j>= 10):
-                # filter everything using lfilter
-                y[0:j+1]= lfilter(b, a, x[0:j+1])
-            else:
-                # don't filter first ten
-                y[j] = x[j]
-        else:
-            y[j] = 1./a[0] *( b.dot(x[j:j-M:-1]) - a[1:N].dot(y[j-1:j-N:-1]))
-        if (np.abs(y[j]) > 1. and np.abs(y[j-1]) > 1.):
-            print( " EVENT ")
+        sample[:4] = [dxl1_current, dxl2_current, dxl3_current, dxl4_current]
+        sample[4] = np.sqrt(sample[:4].dot(sample[:4]))
+        #filter, 0 or more grid samples per read
+        for yg in bandpass.Update(timestamp, sample):
+            detector.Update(yg[:4])
+            if detector.new_contact:
+                print( " EVENT (motor %d)" % detector.Contact_Motor())
+            print("%09d,%f" % (timestamp, yg[4]))
+            print("%09d,%f" % (timestamp, yg[4]),
+                  file=fout)
         #set goal position example
        # skip = 20
        # if j % skip == 0:
        #     reader.Set_Value(reader.m4id, ADDR_PRO_GOAL_POSITION, LEN_PRO_GOAL_POSITION, current_position - int(j/10))
 
         difft = timestamp - oldtimestamp
-        print(
-            "%09d,%f" % (timestamp, y[j] ))
-        print("%09d,%f" % (timestamp, y[j]),
-              file=fout)
-        print(y[j])
-        print(x[j])
+    print("Measured sample rate: %.1f Hz" % bandpass.estimator.Rate())
     del reader
     fout.close()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Read planner: declarative (motor, field) reads compiled into a fixed set of
+bus transactions.
+
+Say what to read, not how:
+
+    planner = ReadPlanner(WireModel(115200))
+    plan = planner.Plan([(100, 'present_position'), (101, 'present_position'),
+                         (100, 'present_temperature'), ...])
+    plan.Setup(reader)      # only if the plan uses indirect addresses
+    plan.Bind(reader)       # builds the SDK group handles once
+    values = plan.Read()    # every cycle: {(motor, field): value}
+
+The planner looks the fields up in the control table and prices these
+layouts with the wire time model, then keeps the cheapest:
+
+    sync       the fields sorted by address and cut into blocks; each block
+               is one sync read of the motors that want something in it (a
+               plain read if only one motor does). Where to cut is chosen by
+               dynamic programming, so small gaps are read through and large
+               ones split, whichever the model says is faster.
+    bulk       one bulk read, each motor reading its own covering block
+    bulk split the sync blocks, but each motor reads only its part of each
+               block, one bulk read per block
+    indirect   all fields mapped into the indirect data block (at most
+               INDIRECT_SLOTS bytes), one sync read of exactly those bytes.
+               The mapping has to be written once with torque off (Setup)
+
+A compiled plan keeps its transactions, group handles and value unpacking
+fixed, so Read does no planning or allocation; the dict it returns is
+updated in place. A value that didn't come back keeps its previous one;
+plan.fresh is the set of keys the last Read actually refreshed.
+
+Usage:
+    python ReadPlanner.py plan [baud] motor:field ...
+        prints every layout with its predicted time and the one chosen
+    python ReadPlanner.py run [n] motor:field ...
+        runs the chosen plan n times on the arm and prints the values and
+        the measured time per read
+    Without fields, reads position and temperature of all four motors.
+
+"""
+
+import ctypes
+import sys
+import time
+
+import dxl_sdk as dynamixel
+from ControlTable import field, span, ADDR_INDIRECT_ADDRESS, ADDR_INDIRECT_DATA, INDIRECT_SLOTS
+from WireModel import WireModel
+
+
+COMM_SUCCESS = 0
+
+# raw SDK value -> field value, by (length, signed)
+_CONVERT = {(1, False): lambda v: v & 0xff,
+            (2, False): lambda v: v & 0xffff,
+            (4, False): lambda v: v & 0xffffffff,
+            (1, True): lambda v: ctypes.c_int8(v).value,
+            (2, True): lambda v: ctypes.c_int16(v).value,
+            (4, True): lambda v: ctypes.c_int32(v).value}
+
+
+class _Transaction:
+    def __init__(self, kind, entries, extract):
+        # kind: 'read', 'sync_read' or 'bulk_read'
+        # entries: [(motor, address, length)], one per motor addressed
+        # extract: [(key, motor, address, length, signed)], where each value is in the reply
+        self.kind = kind
+        self.entries = entries
+        self.extract = extract
+        self.group = None
+
+    def Time(self, model):
+        return model.Time(self.kind, len(self.entries), [e[2] for e in self.entries])
+
+    def Describe(self):
+        if self.kind == 'bulk_read':
+            where = ', '.join('%d@%d+%d' % e for e in self.entries)
+        else:
+            where = 'ids %s @%d+%d' % (','.join('%d' % e[0] for e in self.entries),
+                                         self.entries[0][1], self.entries[0][2])
+        return "%-9s %s" % (self.kind, where)
+
+
+class ReadPlan:
+    def __init__(self, name, transactions, model, indirect = None):
+        # indirect: (motors, [field address of each indirect data byte]) to map in Setup
+        self.name = name
+        self.transactions = transactions
+        self.cost = sum(t.Time(model) for t in transactions)
+        self.indirect = indirect
+        self.values = {}
+        for t in transactions:
+            for key, motor, addr, length, signed in t.extract:
+                self.values[key] = None
+        # keys refreshed by the last Read
+        self.fresh = set()
+        self.failures = 0
+        self.reader = None
+
+    def Describe(self):
+        lines = ["%s: %.3f ms" % (self.name, 1e3 * self.cost)]
+        lines += ["  " + t.Describe() for t in self.transactions]
+        return "\n".join(lines)
+
+    def Setup(self, reader):
+        # writes the indirect address mapping. Torque has to be off for it,
+        # so this toggles torque on all motors: call it before moving
+        if not self.indirect:
+            return
+        from CurrentReader import ADDR_TORQUE_ENABLE, LEN_TORQUE_ENABLE
+        motors, targets = self.indirect
+        missing = set(motors) - set([reader.m1id, reader.m2id, reader.m3id, reader.m4id])
+        if missing:
+            raise ValueError("motors %s are not on this reader" % sorted(missing))
+        # every motor gets the same layout: one sync write per slot
+        reader.Write_Sync(ADDR_TORQUE_ENABLE, LEN_TORQUE_ENABLE, [0] * 4)
+        for slot, target in enumerate(targets):
+            reader.Write_Sync(ADDR_INDIRECT_ADDRESS + 2 * slot, 2, [target] * 4)
+        reader.Write_Sync(ADDR_TORQUE_ENABLE, LEN_TORQUE_ENABLE, [1] * 4)
+
+    def Bind(self, reader):
+        # SDK group handles for every transaction, built once
+        self.reader = reader
+        port_num, proto_ver = reader.port_num, reader.proto_ver
+        for t in self.transactions:
+            if t.kind == 'sync_read':
+                motor, addr, length = t.entries[0]
+                t.group = dynamixel.groupSyncRead(port_num, proto_ver, addr, length)
+                for motor, addr, length in t.entries:
+                    if ctypes.c_ubyte(dynamixel.groupSyncReadAddParam(t.group, motor)).value != 1:
+                        raise ValueError("[ID:%03d] groupSyncRead addparam failed" % motor)
+                t.txrx = dynamixel.groupSyncReadTxRxPacket
+                t.available = dynamixel.groupSyncReadIsAvailable
+                t.get = dynamixel.groupSyncReadGetData
+            elif t.kind == 'bulk_read':
+                t.group = dynamixel.groupBulkRead(port_num, proto_ver)
+                for motor, addr, length in t.entries:
+                    if ctypes.c_ubyte(dynamixel.groupBulkReadAddParam(t.group, motor, addr, length)).value != 1:
+                        raise ValueError("[ID:%03d] groupBulkRead addparam failed" % motor)
+                t.txrx = dynamixel.groupBulkReadTxRxPacket
+                t.available = dynamixel.groupBulkReadIsAvailable
+                t.get = dynamixel.groupBulkReadGetData
+            else:
+                t.txrx = {1: dynamixel.read1ByteTxRx, 2: dynamixel.read2ByteTxRx,
+                          4: dynamixel.read4ByteTxRx}[t.entries[0][2]]
+            t.convert = [_CONVERT[(length, signed)] for key, motor, addr, length, signed in t.extract]
+
+    def Read(self):
+        # one cycle: every transaction of the plan. Values that didn't come
+        # back keep their last value and count as failures
+        port_num, proto_ver = self.reader.port_num, self.reader.proto_ver
+        values = self.values
+        fresh = self.fresh
+        fresh.clear()
+        for t in self.transactions:
+            if t.group is None:
+                motor, addr, length = t.entries[0]
+                raw = t.txrx(port_num, proto_ver, motor, addr)
+            else:
+                t.txrx(t.group)
+            dxl_comm_result = dynamixel.getLastTxRxResult(port_num, proto_ver)
+            if dxl_comm_result != COMM_SUCCESS:
+                print(dynamixel.getTxRxResult(proto_ver, dxl_comm_result))
+                self.failures += 1
+                continue
+            if t.group is None:
+                values[t.extract[0][0]] = t.convert[0](raw)
+                fresh.add(t.extract[0][0])
+                continue
+            for (key, motor, addr, length, signed), convert in zip(t.extract, t.convert):
+                if ctypes.c_ubyte(t.available(t.group, motor, addr, length)).value != 1:
+                    self.failures += 1
+                    continue
+                values[key] = convert(t.get(t.group, motor, addr, length))
+                fresh.add(key)
+        return values
+
+
+class ReadPlanner:
+    def __init__(self, model = None,
+                 # consider mapping the fields into the indirect data block
+                 indirect = True):
+        self.model = model if model is not None else WireModel()
+        self.indirect = indirect
+
+    def _Wanted(self, requests):
+        # {motor: [Field sorted by address]}
+        wanted = {}
+        for motor, name in requests:
+            f = field(name)
+            if f not in wanted.setdefault(motor, []):
+                wanted[motor].append(f)
+        for fields in wanted.values():
+            fields.sort(key=lambda f: f.addr)
+        return wanted
+
+    def _Block(self, wanted, block):
+        # one transaction reading block (a list of Fields) from the motors that want any of it
+        addr, length = span(block)
+        motors = [m for m in wanted if any(f in block for f in wanted[m])]
+        extract = [((m, f.name), m, f.addr, f.length, f.signed)
+                   for m in motors for f in wanted[m] if f in block]
+        kind = 'read' if len(motors) == 1 and len(extract) == 1 and length in (1, 2, 4) else 'sync_read'
+        return _Transaction(kind, [(m, addr, length) for m in motors], extract)
+
+    def _Blocks(self, wanted):
+        # cut the union of the fields, by address, into the blocks that read fastest
+        union = sorted(set(f for fields in wanted.values() for f in fields), key=lambda f: f.addr)
+        best = [(0., [])]
+        for j in range(1, len(union) + 1):
+            options = []
+            for i in range(j):
+                t = self._Block(wanted, union[i:j])
+                options.append((best[i][0] + t.Time(self.model), best[i][1] + [union[i:j]]))
+            best.append(min(options, key=lambda o: o[0]))
+        return union, best[-1][1]
+
+    def Candidates(self, requests):
+        wanted = self._Wanted(requests)
+        if not wanted:
+            raise ValueError("nothing to read")
+        union, blocks = self._Blocks(wanted)
+        plans = [ReadPlan('sync', [self._Block(wanted, block) for block in blocks], self.model)]
+
+        entries = [(m,) + span(fields) for m, fields in wanted.items()]
+        extract = [((m, f.name), m, f.addr, f.length, f.signed) for m, fields in wanted.items() for f in fields]
+        plans.append(ReadPlan('bulk', [_Transaction('bulk_read', entries, extract)], self.model))
+
+        if len(blocks) > 1:
+            transactions = []
+            for block in blocks:
+                parts = {m: [f for f in fields if f in block] for m, fields in wanted.items()}
+                parts = {m: fields for m, fields in parts.items() if fields}
+                transactions.append(_Transaction(
+                    'bulk_read', [(m,) + span(fields) for m, fields in parts.items()],
+                    [((m, f.name), m, f.addr, f.length, f.signed) for m, fields in parts.items() for f in fields]))
+            plans.append(ReadPlan('bulk split', transactions, self.model))
+
+        length = sum(f.length for f in union)
+        if self.indirect and length <= INDIRECT_SLOTS:
+            # the same layout on every motor, so one sync read covers them all
+            offsets = {}
+            targets = []
+            for f in union:
+                offsets[f] = ADDR_INDIRECT_DATA + len(targets)
+                targets += range(f.addr, f.addr + f.length)
+            extract = [((m, f.name), m, offsets[f], f.length, f.signed) for m, fields in wanted.items() for f in fields]
+            transaction = _Transaction('sync_read', [(m, ADDR_INDIRECT_DATA, length) for m in wanted], extract)
+            plans.append(ReadPlan('indirect', [transaction], self.model, (list(wanted), targets)))
+        return plans
+
+    def Plan(self, requests):
+        # the cheapest plan; ties go to the one listed first (no indirect setup)
+        return min(self.Candidates(requests), key=lambda p: p.cost)
+
+
+def parse_requests(args):
+    # 'motor:field' strings -> [(motor, field)]
+    requests = []
+    for arg in args:
+        motor, name = arg.split(':')
+        requests.append((int(motor), name))
+    return requests
+
+
+DEFAULT_REQUESTS = [(m, name) for name in ('present_position', 'present_temperature') for m in (100, 101, 102, 103)]
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['plan']:
+        baud = int(args[1]) if len(args) > 1 and args[1].isdigit() else 115200
+        rest = args[2:] if len(args) > 1 and args[1].isdigit() else args[1:]
+        requests = parse_requests(rest) if rest else DEFAULT_REQUESTS
+        model = WireModel(baud)
+        planner = ReadPlanner(model)
+        print("%d baud, separate reads: %.3f ms" % (
+            baud, 1e3 * sum(model.Time('read', 1, field(name).length) for motor, name in requests)))
+        for plan in planner.Candidates(requests):
+            print(plan.Describe())
+        print("Chosen: " + planner.Plan(requests).name)
+    elif args[:1] == ['run']:
+        from CurrentReader import DynamixelReader
+        n = int(args[1]) if len(args) > 1 and args[1].isdigit() else 100
+        rest = args[2:] if len(args) > 1 and args[1].isdigit() else args[1:]
+        requests = parse_requests(rest) if rest else DEFAULT_REQUESTS
+        baud = 115200
+        reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                                 baud_rate = baud,
+                                 m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                                 proto_ver = 2,
+                                 read_addr = 126, read_len = 2)
+        plan = ReadPlanner(WireModel(baud)).Plan(requests)
+        print(plan.Describe())
+        plan.Setup(reader)
+        plan.Bind(reader)
+        t = time.perf_counter()
+        for j in range(n):
+            values = plan.Read()
+        dt = (time.perf_counter() - t) / n
+        for key in sorted(values):
+            print("  %d %-22s %s" % (key[0], key[1], values[key]))
+        print("%.3f ms per read (predicted %.3f), %d failures" % (1e3 * dt, 1e3 * plan.cost, plan.failures))
+        del reader
+    else:
+        print(__doc__)
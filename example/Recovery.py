@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recovery from servo hardware errors without restarting.
+
+A hardware error (overload during a push, overheating, voltage) turns the
+servo's torque off and sets bit 7 (the hardware alert) in the error byte of
+every status packet it sends, until it is rebooted. ServoRecovery brings
+back only the servo that tripped:
+
+    1. reads its hardware error status register,
+    2. reboots it and pings until it answers again,
+    3. restores its configuration from the shadow copy: EEPROM fields that
+       came back different, the indirect address mappings of the read plans,
+       goal position = present position (so it doesn't jump), the RAM
+       fields, and torque enable last,
+    4. checks it answers the reader's state sync read again.
+
+The shadow copy is what Capture read from the servos at start, plus every
+write made through ServoRecovery.Write_Sync / Set_Value afterwards.
+
+Detection: Check() after a bus call looks at the error byte of the last
+status packet (one SDK call, no bus traffic) and on an alert reads the error
+registers to find the servo. The SDK keeps only the last packet's error, so
+after a sync read that is the last servo's; HealthMonitor polls every
+servo's error register, and On_Alarm is the on_alarm callback for it.
+
+Each recovery is printed and kept in `log` with the error, the recovery
+time (reboot to torque back on) and the outage (detection to answering the
+state read again).
+
+Usage: python Recovery.py [seconds]
+reads the state in a loop, recovering any servo that trips, and prints the
+recoveries at the end.
+
+"""
+
+import ctypes
+import sys
+import time
+
+import dxl_sdk as dynamixel
+from ControlTable import field, span, ADDR_INDIRECT_ADDRESS
+
+
+COMM_SUCCESS = 0
+HARDWARE_ALERT = 0x80
+
+# hardware error status bits
+HARDWARE_ERRORS = {0: 'input voltage', 2: 'overheating', 3: 'motor encoder',
+                   4: 'electrical shock', 5: 'overload'}
+
+# what Capture reads by default: the configuration the scripts change
+SHADOW_FIELDS = ('operating_mode', 'current_limit', 'velocity_limit', 'max_position_limit', 'min_position_limit',
+                 'velocity_i_gain', 'velocity_p_gain', 'position_d_gain', 'position_i_gain', 'position_p_gain',
+                 'profile_acceleration', 'profile_velocity', 'torque_enable')
+
+ADDR_TORQUE_ENABLE = field('torque_enable').addr
+ADDR_GOAL_POSITION = field('goal_position').addr
+ADDR_PRESENT_POSITION = field('present_position').addr
+ADDR_HARDWARE_ERROR_STATUS = field('hardware_error_status').addr
+# goals are never restored from the shadow, they'd be stale
+GOAL_ADDRESSES = tuple(field(name).addr for name in ('goal_pwm', 'goal_current', 'goal_velocity', 'goal_position'))
+EEPROM_END = ADDR_TORQUE_ENABLE
+# the block Read_Sync_State reads (CurrentReader's ADDR_PRESENT_CURRENT, LEN_PRESENT_STATE)
+ADDR_PRESENT_STATE, LEN_PRESENT_STATE = span([field('present_current'), field('present_velocity'),
+                                              field('present_position')])
+
+
+def error_text(status):
+    names = [name for bit, name in sorted(HARDWARE_ERRORS.items()) if status & (1 << bit)]
+    return ', '.join(names) if names else 'none'
+
+
+class ServoRecovery:
+    def __init__(self, reader,
+                 # ReadPlans whose indirect mappings a rebooted servo needs back
+                 plans = (),
+                 # seconds to wait for the servo to answer a ping after reboot
+                 reboot_timeout = 3.,
+                 # optional callback(entry) after each recovery
+                 on_recovered = None):
+        self.reader = reader
+        self.plans = list(plans)
+        self.reboot_timeout = reboot_timeout
+        self.on_recovered = on_recovered
+        self.motors = [reader.m1id, reader.m2id, reader.m3id, reader.m4id]
+        # {motor: {address: (length, value)}}
+        self.shadow = dict((m, {}) for m in self.motors)
+        self.log = []
+        self.recovering = False
+
+    def Capture(self, fields = SHADOW_FIELDS):
+        # the servos' present configuration becomes the shadow copy
+        for name in fields:
+            f = field(name)
+            for m in self.motors:
+                self.shadow[m][f.addr] = (f.length, self.reader.Read_Value(m, f.addr, f.length))
+
+    def Write_Sync(self, addr, length, values):
+        self.reader.Write_Sync(addr, length, values)
+        for m, value in zip(self.motors, values):
+            self.shadow[m][addr] = (length, int(value))
+
+    def Set_Value(self, motor, addr, length, value):
+        self.reader.Set_Value(motor, addr, length, value)
+        self.shadow[motor][addr] = (length, int(value))
+
+    def Check(self):
+        # after a bus call: recovers whichever servo raised the hardware alert
+        error = dynamixel.getLastRxPacketError(self.reader.port_num, self.reader.proto_ver)
+        if error & HARDWARE_ALERT and not self.recovering:
+            for m in self.motors:
+                status = self.reader.Read_Value(m, ADDR_HARDWARE_ERROR_STATUS, 1)
+                if status > 0:
+                    self.Recover(m, status)
+            return True
+        return False
+
+    def On_Alarm(self, motor, name, value, active):
+        # HealthMonitor on_alarm
+        if name == 'hardware_error_status' and active and not self.recovering:
+            self.Recover(motor, value)
+
+    def _Ping(self, motor):
+        dynamixel.ping(self.reader.port_num, self.reader.proto_ver, motor)
+        return dynamixel.getLastTxRxResult(self.reader.port_num, self.reader.proto_ver) == COMM_SUCCESS
+
+    def _Restore(self, motor):
+        reader = self.reader
+        shadow = self.shadow[motor]
+        # EEPROM: torque is off after the reboot; only rewrite what changed.
+        # Read_Value is unsigned and the shadow may hold a signed value (a
+        # negative homing offset), so both are compared as `length` bytes
+        for addr, (length, value) in sorted(shadow.items()):
+            mask = (1 << 8 * length) - 1
+            if addr < EEPROM_END and reader.Read_Value(motor, addr, length) & mask != value & mask:
+                reader.Set_Value(motor, addr, length, value)
+        for plan in self.plans:
+            if plan.indirect and motor in plan.indirect[0]:
+                for slot, target in enumerate(plan.indirect[1]):
+                    reader.Set_Value(motor, ADDR_INDIRECT_ADDRESS + 2 * slot, 2, target)
+        position = ctypes.c_int32(reader.Read_Value(motor, ADDR_PRESENT_POSITION, 4)).value
+        reader.Set_Value(motor, ADDR_GOAL_POSITION, 4, position)
+        for addr, (length, value) in sorted(shadow.items()):
+            if addr >= EEPROM_END and addr != ADDR_TORQUE_ENABLE and addr not in GOAL_ADDRESSES:
+                reader.Set_Value(motor, addr, length, value)
+        reader.Set_Value(motor, ADDR_TORQUE_ENABLE, 1, shadow.get(ADDR_TORQUE_ENABLE, (1, 1))[1])
+
+    def _Rejoined(self, motor, tries = 5):
+        # the servo's part of the reader's state sync read comes back again
+        group = self.reader.groupstate_num
+        for j in range(tries):
+            dynamixel.groupSyncReadTxRxPacket(group)
+            if ctypes.c_ubyte(dynamixel.groupSyncReadIsAvailable(group, motor, ADDR_PRESENT_STATE, LEN_PRESENT_STATE)).value == 1:
+                return True
+        return False
+
+    def Recover(self, motor, status = None):
+        # blocking; the other servos keep holding their goals meanwhile
+        reader = self.reader
+        self.recovering = True
+        detected = time.perf_counter()
+        try:
+            if status is None:
+                status = reader.Read_Value(motor, ADDR_HARDWARE_ERROR_STATUS, 1)
+            start = time.perf_counter()
+            dynamixel.reboot(reader.port_num, reader.proto_ver, motor)
+            deadline = start + self.reboot_timeout
+            answered = False
+            while time.perf_counter() < deadline:
+                time.sleep(0.05)
+                if self._Ping(motor):
+                    answered = True
+                    break
+            if answered:
+                self._Restore(motor)
+            recovered = time.perf_counter()
+            rejoined = answered and self._Rejoined(motor)
+        finally:
+            self.recovering = False
+        entry = {'motor': motor, 'error': status, 'ok': rejoined,
+                 'recovery': recovered - start, 'outage': time.perf_counter() - detected}
+        self.log.append(entry)
+        if rejoined:
+            print("[ID:%03d] hardware error 0x%02x (%s): recovered in %.0f ms, outage %.0f ms" % (
+                motor, status, error_text(status), 1e3 * entry['recovery'], 1e3 * entry['outage']))
+        else:
+            print("[ID:%03d] hardware error 0x%02x (%s): no answer after reboot" % (motor, status, error_text(status)))
+        if self.on_recovered is not None:
+            self.on_recovered(entry)
+        return rejoined
+
+
+if __name__ == '__main__':
+    from CurrentReader import DynamixelReader
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 60.
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = 115200,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+    recovery = ServoRecovery(reader)
+    recovery.Capture()
+    start = time.perf_counter()
+    try:
+        while time.perf_counter() - start < duration:
+            reader.Read_Sync_State()
+            recovery.Check()
+    except KeyboardInterrupt:
+        pass
+    for entry in recovery.log:
+        print(entry)
+    del reader
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sample rate estimation and resampling onto a uniform time grid.
+
+The time between two Read_Sync_Once calls depends on the baud rate, how much
+gets printed and the OS, so the 240 Hz the filters were designed for is only
+a guess. RateEstimator measures the rate from the timestamps (microseconds,
+as returned by Read_Sync_Once), UniformResampler linearly interpolates the
+irregular samples onto a uniform grid, and UniformBandpass puts both in front
+of a StreamingBandpass and redesigns it when the measured rate drifts away
+from the one the coefficients were made for (lowering the upper cutoff when
+the rate is too low for it).
+
+resample_block does the same for whole recordings, linear or polyphase.
+
+"""
+
+from fractions import Fraction
+
+import numpy as np
+from scipy.signal import resample_poly
+
+from StreamFilter import StreamingBandpass
+
+
+# highest usable cutoff, as a fraction of the sample rate
+NYQUIST_MARGIN = 0.45
+
+class RateEstimator:
+    def __init__(self,
+                 # time constant of the average interval, in samples
+                 span = 240,
+                 # intervals longer than this many times the average are dropped (pauses, prints)
+                 outlier = 5.):
+        self.alpha = 2. / (span + 1.)
+        self.outlier = outlier
+        self.Reset()
+
+    def Reset(self):
+        self.last_t = None
+        self.dt = 0.
+        self.n = 0
+
+    def Update(self, t):
+        # t in microseconds. Returns the current rate estimate in Hz (0 until known)
+        last_t = self.last_t
+        self.last_t = t
+        if last_t is not None:
+            dt = t - last_t
+            # the reader's timestamp wraps every hour
+            if dt > 0 and (self.n < 10 or dt < self.outlier * self.dt):
+                self.n += 1
+                self.dt += max(self.alpha, 1. / self.n) * (dt - self.dt)
+        return self.Rate()
+
+    def Rate(self):
+        if self.n == 0:
+            return 0.
+        return 1e6 / self.dt
+
+
+class UniformResampler:
+    def __init__(self, n_channels=4, fs=240.):
+        self.n_channels = n_channels
+        self.x0 = np.zeros(n_channels)
+        self.slope = np.zeros(n_channels)
+        # enough room for a few lost samples in a row
+        self.out = np.zeros((16, n_channels))
+        self.Set_Rate(fs)
+        self.Reset()
+
+    def Reset(self):
+        self.t0 = None
+        self.next_t = None
+
+    def Set_Rate(self, fs):
+        self.fs = fs
+        self.period = 1e6 / fs
+
+    def Update(self, t, x):
+        # Adds one sample taken at time t (microseconds). Returns the grid
+        # samples that fall between the previous sample and this one as a
+        # (k, channels) view, k is usually 0 or 1. The view is reused.
+        x = np.asarray(x, dtype=float)
+        if t == self.t0:
+            # same timestamp read twice: nothing new to interpolate
+            return self.out[:0]
+        if self.t0 is None or t < self.t0:
+            # first sample, or the clock wrapped: restart the grid here
+            self.t0 = t
+            self.x0[:] = x
+            self.next_t = t + self.period
+            self.out[0] = x
+            return self.out[:1]
+        k = int((t - self.next_t) // self.period) + 1
+        if k <= 0:
+            self.t0 = t
+            self.x0[:] = x
+            return self.out[:0]
+        if k > self.out.shape[0]:
+            self.out = np.zeros((k, self.n_channels))
+        np.subtract(x, self.x0, out=self.slope)
+        self.slope /= (t - self.t0)
+        # grid times relative to the previous sample
+        tg = self.next_t - self.t0 + self.period * np.arange(k)
+        out = self.out[:k]
+        np.multiply(tg[:, None], self.slope, out=out)
+        out += self.x0
+        self.next_t += k * self.period
+        self.t0 = t
+        self.x0[:] = x
+        return out
+
+
+class UniformBandpass:
+    def __init__(self, n_channels=4, low=5., hi=100., fs=240., order=4,
+                 # relative rate change that triggers a filter redesign
+                 tolerance = 0.05,
+                 # samples to measure before trusting the rate estimate
+                 warmup = 50):
+        self.estimator = RateEstimator()
+        self.resampler = UniformResampler(n_channels, fs)
+        # the cutoff asked for; the one in use is clamped below Nyquist
+        self.hi = hi
+        self.bandpass = StreamingBandpass(n_channels, low, min(hi, NYQUIST_MARGIN * fs), fs, order)
+        self.tolerance = tolerance
+        self.warmup = warmup
+        self.warned = False
+        self.out = np.zeros((16, n_channels))
+        self.redesigns = 0
+
+    def Rate(self):
+        return self.bandpass.fs
+
+    def Update(self, t, x):
+        # Returns the filtered grid samples produced by this reading, (k, channels)
+        fs = self.estimator.Update(t)
+        if self.estimator.n >= self.warmup and abs(fs - self.bandpass.fs) > self.tolerance * self.bandpass.fs:
+            self.Set_Rate(fs)
+        grid = self.resampler.Update(t, x)
+        k = grid.shape[0]
+        if k > self.out.shape[0]:
+            self.out = np.zeros((k, grid.shape[1]))
+        for i in range(k):
+            self.out[i] = self.bandpass.Update(grid[i])
+        return self.out[:k]
+
+    def Set_Rate(self, fs):
+        # the bandpass cutoffs must stay below Nyquist: the upper one is
+        # lowered as far as needed, once it would fall below the lower one
+        # the rate is refused. Warns once.
+        hi = min(self.hi, NYQUIST_MARGIN * fs)
+        if hi <= self.bandpass.low:
+            if not self.warned:
+                print("Sample rate %.1f Hz is too low for a %.1f Hz band, keeping %.1f Hz" % (
+                    fs, self.bandpass.low, self.bandpass.fs))
+                self.warned = True
+            return
+        if hi < self.hi and not self.warned:
+            print("Sample rate %.1f Hz is too low for a %.1f Hz cutoff, using %.1f Hz" % (fs, self.hi, hi))
+            self.warned = True
+        self.bandpass.hi = hi
+        self.resampler.Set_Rate(fs)
+        self.bandpass.Design(fs)
+        self.redesigns += 1
+
+
+def estimate_rate(t):
+    # rate in Hz of a whole recording, from its timestamps in microseconds
+    dt = np.diff(np.asarray(t, dtype=float))
+    dt = dt[dt > 0]
+    return 1e6 / np.median(dt)
+
+
+def resample_block(t, x, fs=None, method='linear'):
+    # Resamples a (samples, channels) recording taken at times t (microseconds)
+    # onto a uniform grid at fs Hz (default: the measured rate).
+    # Returns the grid times and the resampled data.
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    if x.ndim == 1:
+        x = x[:, None]
+    fs_in = estimate_rate(t)
+    if fs is None:
+        fs = fs_in
+    if method == 'polyphase':
+        # interpolate onto the measured rate first, then change the rate with an antialiased polyphase filter
+        tu, xu = resample_block(t, x, fs_in, 'linear')
+        ratio = Fraction(fs / fs_in).limit_denominator(100)
+        y = resample_poly(xu, ratio.numerator, ratio.denominator, axis=0)
+        tg = tu[0] + np.arange(y.shape[0]) * (1e6 / fs_in) * ratio.denominator / ratio.numerator
+        return tg, y
+    if method != 'linear':
+        raise ValueError("unknown resampling method '%s'" % method)
+    period = 1e6 / fs
+    tg = t[0] + period * np.arange(int((t[-1] - t[0]) // period) + 1)
+    # linear interpolation of every channel at once
+    i = np.clip(np.searchsorted(t, tg, side='right') - 1, 0, t.size - 2)
+    dt = t[i + 1] - t[i]
+    w = np.where(dt > 0, (tg - t[i]) / np.where(dt > 0, dt, 1.), 0.)
+    y = x[i] + w[:, None] * (x[i + 1] - x[i])
+    return tg, y
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming spectrum of the current channels.
+
+SpectralAnalyzer keeps a ring buffer of the last `window` samples of every
+channel and a rolling spectrogram of the last `history` frames. In 'sdft'
+mode a chosen set of frequency bins is updated recursively every sample
+(sliding DFT), so the cost per sample depends on the number of bins and not
+on the window length. In 'fft' mode a tapered rfft of the whole window is
+taken every `hop` samples instead, vectorized over channels.
+
+Usage: python SpectralAnalyzer.py file.csv [window]
+prints the strongest 5-100 Hz component of every channel over a recording.
+
+"""
+
+import sys
+
+import numpy as np
+
+
+class SlidingDFT:
+    # Selected rfft bins of the last `window` samples of every channel, updated per sample
+    def __init__(self, n_channels, window, bins = None, resync = 1024):
+        self.window = window
+        if bins is None:
+            bins = np.arange(window // 2 + 1)
+        self.bins = np.asarray(bins, dtype=int)
+        self.twiddle = np.exp(2j * np.pi * self.bins / window)[:, None]
+        self.X = np.zeros((self.bins.size, n_channels), dtype=complex)
+        self.delta = np.zeros(n_channels)
+        self.resync = resync
+        self.count = 0
+
+    def Update(self, new, old):
+        X = self.X
+        np.subtract(new, old, out=self.delta)
+        X += self.delta
+        X *= self.twiddle
+        self.count += 1
+
+    def Resync(self, ordered):
+        # exact recompute from the window, oldest sample first (clears rounding drift)
+        self.X[:] = np.fft.rfft(ordered, axis=0)[self.bins]
+        self.count = 0
+
+
+class SpectralAnalyzer:
+    def __init__(self, n_channels=4, window=64, fs=240.,
+                 # frequencies of interest in Hz, None for all rfft bins
+                 freqs = None,
+                 # 'sdft': selected bins every sample, 'fft': whole window every hop
+                 mode = 'sdft',
+                 # samples between spectrogram frames
+                 hop = 1,
+                 # spectrogram frames kept
+                 history = 256):
+        if mode not in ('sdft', 'fft'):
+            raise ValueError("unknown mode '%s'" % mode)
+        self.n_channels = n_channels
+        self.window = window
+        self.fs = fs
+        self.mode = mode
+        self.hop = hop
+        all_freqs = np.fft.rfftfreq(window, 1. / fs)
+        if freqs is None:
+            self.bins = np.arange(all_freqs.size)
+        else:
+            # nearest bin of every requested frequency
+            self.bins = np.unique(np.rint(np.asarray(freqs) * window / fs).astype(int).clip(0, all_freqs.size - 1))
+        self.freqs = all_freqs[self.bins]
+        self.ring = np.zeros((window, n_channels))
+        self.pos = 0
+        self.n = 0
+        if mode == 'sdft':
+            self.dft = SlidingDFT(n_channels, window, self.bins)
+        else:
+            self.taper = np.hanning(window)[:, None]
+        # spectrogram ring: frames x bins x channels, power
+        self.spec = np.zeros((history, self.bins.size, n_channels))
+        self.frame = 0
+        self.frames = 0
+
+    def Update(self, x):
+        # Adds one sample per channel. Returns True when a new frame was added.
+        ring = self.ring
+        pos = self.pos
+        if self.mode == 'sdft':
+            self.dft.Update(x, ring[pos])
+        ring[pos] = x
+        self.pos = (pos + 1) % self.window
+        self.n += 1
+        if self.mode == 'sdft' and self.dft.count >= self.dft.resync:
+            self.dft.Resync(self.Ordered())
+        if self.n % self.hop:
+            return False
+        row = self.spec[self.frame]
+        if self.mode == 'sdft':
+            np.abs(self.dft.X, out=row)
+        else:
+            X = np.fft.rfft(self.Ordered() * self.taper, axis=0)
+            np.abs(X[self.bins], out=row)
+        row *= row
+        self.frame = (self.frame + 1) % self.spec.shape[0]
+        self.frames += 1
+        return True
+
+    def Update_Block(self, x):
+        # Adds a (samples, channels) block, returns the number of new frames
+        before = self.frames
+        for row in np.asarray(x, dtype=float):
+            self.Update(row)
+        return self.frames - before
+
+    def Ordered(self):
+        # the window, oldest sample first
+        return np.roll(self.ring, -self.pos, axis=0)
+
+    def Latest(self):
+        # power of the newest frame, bins x channels
+        return self.spec[self.frame - 1]
+
+    def Spectrogram(self):
+        # frames x bins x channels, oldest frame first (a copy)
+        n = min(self.frames, self.spec.shape[0])
+        return np.roll(self.spec, -self.frame, axis=0)[self.spec.shape[0] - n:]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    from BatchFeatures import load_session, bandpass_block
+    from Resampler import resample_block
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    t, x = load_session(sys.argv[1])
+    tg, xg = resample_block(t, x, 240.)
+    y = bandpass_block(xg, 240., 5., 100., 4)
+    analyzer = SpectralAnalyzer(4, window, 240., freqs=np.arange(5., 100., 240. / window),
+                                hop=window // 4, history=y.shape[0])
+    analyzer.Update_Block(y)
+    S = analyzer.Spectrogram()
+    peak = analyzer.freqs[np.argmax(S.mean(axis=0), axis=0)]
+    print("%d frames, %d bins" % S.shape[:2])
+    print("Strongest component per motor (Hz): %s" % np.array2string(peak, precision=1))
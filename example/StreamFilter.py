@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bandpass filtering of the current stream.
+
+butter_bandpass/run_filter are the helpers the scripts used to copy around.
+StreamingBandpass filters every motor channel separately, one sample at a
+time, keeping only the filter state (no growing history arrays).
+
+"""
+
+import numpy as np
+from scipy.signal import butter, lfilter, lfilter_zi
+
+
+def butter_bandpass(lowcut, highcut, fs, order=5):
+    nyq = 0.5 * fs
+    low = lowcut / nyq
+    high = highcut / nyq
+    b, a = butter(order, [low, high], btype='band')
+    return b, a
+
+
+def run_filter(data, b, a):
+    y = lfilter(b, a, data)
+    return y
+
+
+class StreamingBandpass:
+    def __init__(self, n_channels=4, low=5., hi=100., fs=240., order=4):
+        self.n_channels = n_channels
+        self.low = low
+        self.hi = hi
+        self.order = order
+        self.Design(fs)
+
+    def Design(self, fs):
+        # (Re)compute the coefficients, keeping the channel count
+        self.fs = fs
+        b, a = butter_bandpass(self.low, self.hi, fs, order=self.order)
+        self.b = b / a[0]
+        self.a = a / a[0]
+        self.zi = lfilter_zi(self.b, self.a)
+        # Transposed direct form II state, one column per channel
+        self.z = np.zeros((self.b.size - 1, self.n_channels))
+        self.y = np.zeros(self.n_channels)
+        self.tmp = np.zeros(self.n_channels)
+        self.primed = False
+
+    def Reset(self):
+        self.z[:] = 0.
+        self.primed = False
+
+    def Update(self, x):
+        # Filters one sample of every channel, returns the filtered sample
+        # (the returned array is reused on the next call)
+        x = np.asarray(x, dtype=float)
+        b, a, z, y, tmp = self.b, self.a, self.z, self.y, self.tmp
+        if not self.primed:
+            # start in steady state for the first sample so the DC load
+            # current doesn't ring through the filter as a fake event
+            np.multiply(self.zi[:, None], x, out=z)
+            self.primed = True
+        np.multiply(b[0], x, out=y)
+        y += z[0]
+        n = z.shape[0]
+        for i in range(n - 1):
+            np.multiply(b[i + 1], x, out=z[i])
+            z[i] += z[i + 1]
+            np.multiply(a[i + 1], y, out=tmp)
+            z[i] -= tmp
+        np.multiply(b[n], x, out=z[n - 1])
+        np.multiply(a[n], y, out=tmp)
+        z[n - 1] -= tmp
+        return y
+
+    def Filter_Block(self, x):
+        # Filters a (samples, channels) block, continuing from the current state
+        x = np.asarray(x, dtype=float)
+        if not self.primed:
+            self.z[:] = self.zi[:, None] * x[0]
+            self.primed = True
+        y, self.z = lfilter(self.b, self.a, x, axis=0, zi=self.z)
+        return y
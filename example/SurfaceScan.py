@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Surface scanning with batched guarded probes.
+
+A scan probes a rectangle of the workspace straight down (-z) from above.
+The probe order is planned on the kinematic model: every approach point is
+solved to joint angles in one Solve_Path pass, the travel time between two
+points is the longer of the Cartesian move at travel speed and the largest
+joint swing at the joint speed limit, and the order is the shorter of a
+nearest neighbour tour and the given order, both improved by 2-opt.
+
+Probes don't go back up to a fixed safe height. After a contact the tip
+retracts by `clearance` only, and the next probe approaches from the
+surface height predicted at its point by the probes already made (plus
+clearance), so neighbouring probes reuse the approach pose and the only
+long moves are across gaps. Travel moves are guarded too: hitting
+something on the way counts as a contact and the tip backs off upward.
+
+Results go into a SurfaceMap, a hash grid of contact points. After the
+coarse grid, points whose height departs from the plane of their
+neighbours (high curvature) get extra probes halfway to the neighbours
+they differ from, for a few rounds, down to `min_spacing`.
+
+Usage:
+    python SurfaceScan.py plan X0 X1 Y0 Y1 SPACING
+        travel time of the raster order vs the planned order, no arm needed
+    python SurfaceScan.py scan X0 X1 Y0 Y1 SPACING [out.csv] [rounds]
+        scans from the present tip height down to 10 cm below it, in meters
+
+"""
+
+import math
+import sys
+import time
+
+import numpy as np
+
+from Kinematics import ArmModel, TABLE_POSE
+from InverseKinematics import IKSolver
+
+
+def grid_points(x_range, y_range, spacing):
+    # (N, 2) serpentine grid, so consecutive points are neighbours
+    xs = np.arange(x_range[0], x_range[1] + 1e-9, spacing)
+    ys = np.arange(y_range[0], y_range[1] + 1e-9, spacing)
+    rows = [np.stack([xs if i % 2 == 0 else xs[::-1], np.full(xs.size, y)], axis=1) for i, y in enumerate(ys)]
+    return np.concatenate(rows)
+
+
+def travel_costs(solver, points, z, q0,
+                 # Cartesian travel speed, m/s
+                 speed = 0.05,
+                 # joint speed limit, rad/s
+                 joint_speed = 1.):
+    # (N, N) travel time between the approach poses above points (N, 2) at
+    # height z, and (N,) True where the solver reached the approach pose.
+    # Rows and columns of unreached points are inf: their angles are not a pose
+    targets = np.column_stack([points, np.full(len(points), z)])
+    q, err = solver.Solve_Path(targets, q0)
+    reached = err <= solver.tol
+    d = np.linalg.norm(targets[:, None] - targets[None], axis=2) / speed
+    dq = np.abs(q[:, None] - q[None]).max(axis=2) / joint_speed
+    cost = np.maximum(d, dq)
+    cost[~reached] = np.inf
+    cost[:, ~reached] = np.inf
+    return cost, reached
+
+
+def reachable(reached):
+    # indices of the points the arm can reach, with a warning for the others
+    if not reached.all():
+        print("Skipping %d of %d points out of reach" % (np.count_nonzero(~reached), reached.size))
+    return np.flatnonzero(reached)
+
+
+def tour_cost(cost, order):
+    return cost[order[:-1], order[1:]].sum()
+
+
+def two_opt(cost, order):
+    # Reverse order[i+1..j] while that shortens the open tour. The first
+    # point stays where it is (the closest to the tip).
+    order = order.copy()
+    n = order.size
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n - 2):
+            a, b = order[i], order[i + 1]
+            c = order[i + 2:]
+            d = np.append(order[i + 3:], -1)
+            after = np.where(d >= 0, cost[b, d], 0.)
+            before = np.where(d >= 0, cost[c, d], 0.)
+            delta = cost[a, c] + after - cost[a, b] - before
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                order[i + 1:i + j + 3] = order[i + 1:i + j + 3][::-1].copy()
+                improved = True
+    return order
+
+
+def order_probes(cost, start = None):
+    # Open tour through all points: 2-opt of a nearest neighbour tour and of
+    # the given order (a serpentine grid is often hard to beat), the shorter.
+    # start: (N,) cost of reaching each point from where the tip is now.
+    n = cost.shape[0]
+    first = 0 if start is None else int(np.argmin(start))
+    if n < 3:
+        return np.roll(np.arange(n), -first)
+    visited = np.zeros(n, dtype=bool)
+    nearest = np.zeros(n, dtype=int)
+    nearest[0] = first
+    visited[first] = True
+    for k in range(1, n):
+        c = np.where(visited, np.inf, cost[nearest[k - 1]])
+        nearest[k] = int(np.argmin(c))
+        visited[nearest[k]] = True
+    # the given order, entered at the end closer to the tip
+    given = np.arange(n)
+    if start is not None and start[-1] < start[0]:
+        given = given[::-1]
+    tours = [two_opt(cost, nearest), two_opt(cost, given)]
+    return min(tours, key=lambda o: tour_cost(cost, o))
+
+
+class SurfaceMap:
+    def __init__(self,
+                 # hash grid cell, meters. Neighbour queries look at adjacent cells
+                 cell = 0.01):
+        self.cell = cell
+        self.cells = {}
+        self.points = []
+
+    def _Key(self, x, y):
+        return (int(math.floor(x / self.cell)), int(math.floor(y / self.cell)))
+
+    def Add(self, point, contact = True):
+        # point (3,), z is nan for a probe that found nothing
+        p = np.array(point, dtype=float)
+        if not contact:
+            p[2] = np.nan
+        self.cells.setdefault(self._Key(p[0], p[1]), []).append(len(self.points))
+        self.points.append(p)
+
+    def Neighbours(self, xy, radius):
+        # indices of the points within radius of xy (horizontally)
+        r = int(math.ceil(radius / self.cell))
+        kx, ky = self._Key(xy[0], xy[1])
+        found = []
+        for i in range(kx - r, kx + r + 1):
+            for j in range(ky - r, ky + r + 1):
+                for k in self.cells.get((i, j), ()):
+                    p = self.points[k]
+                    if (p[0] - xy[0]) ** 2 + (p[1] - xy[1]) ** 2 <= radius * radius:
+                        found.append(k)
+        return found
+
+    def Height(self, xy, radius):
+        # surface height at xy from the contacts nearby, None if there are none
+        z = [self.points[k][2] for k in self.Neighbours(xy, radius)]
+        z = [v for v in z if not np.isnan(v)]
+        return max(z) if z else None
+
+    def Curvature(self, k, radius):
+        # distance of point k from the plane fitted through its neighbours
+        p = self.points[k]
+        if np.isnan(p[2]):
+            return 0.
+        nb = np.array([self.points[j] for j in self.Neighbours(p, radius) if j != k])
+        if len(nb) < 3:
+            return 0.
+        nb = nb[~np.isnan(nb[:, 2])]
+        if len(nb) < 3:
+            return 0.
+        A = np.column_stack([np.ones(len(nb)), nb[:, 0], nb[:, 1]])
+        coef = np.linalg.lstsq(A, nb[:, 2], rcond=None)[0]
+        return abs(p[2] - (coef[0] + coef[1] * p[0] + coef[2] * p[1]))
+
+    def Refinement(self, radius, threshold, min_spacing):
+        # (M, 2) new probe points halfway between high curvature points and their neighbours
+        new = []
+        for k, p in enumerate(self.points):
+            if self.Curvature(k, radius) < threshold:
+                continue
+            for j in self.Neighbours(p, radius):
+                q = self.points[j]
+                # only across a step: the edge lies between p and q
+                if j == k or not abs(p[2] - q[2]) >= threshold:
+                    continue
+                if math.hypot(p[0] - q[0], p[1] - q[1]) < 2 * min_spacing:
+                    continue
+                m = 0.5 * (p[:2] + q[:2])
+                if self.Neighbours(m, 0.5 * min_spacing):
+                    continue
+                if any(math.hypot(m[0] - n[0], m[1] - n[1]) < 0.5 * min_spacing for n in new):
+                    continue
+                new.append(m)
+        return np.array(new).reshape(-1, 2)
+
+    def Array(self):
+        return np.array(self.points).reshape(-1, 3)
+
+
+class SurfaceScanner:
+    def __init__(self, mover,
+                 # lowest height a probe goes down to, meters
+                 z_floor,
+                 # height the first probe starts from, and travel height over unknown area
+                 z_top,
+                 # retract after a contact, and margin over the predicted surface
+                 clearance = 0.01,
+                 probe_speed = 0.01,
+                 travel_speed = 0.05,
+                 # joint speed limit used in planning, rad/s
+                 joint_speed = 1.,
+                 # neighbours within this distance predict the height of a new point
+                 reuse_radius = 0.03):
+        self.mover = mover
+        self.solver = IKSolver(mover.model)
+        self.z_floor = z_floor
+        self.z_top = z_top
+        self.clearance = clearance
+        self.probe_speed = probe_speed
+        self.travel_speed = travel_speed
+        self.joint_speed = joint_speed
+        self.reuse_radius = reuse_radius
+        self.map = SurfaceMap(cell=reuse_radius)
+        self.tip = None
+        self.probes = 0
+        self.collisions = 0
+        self.elapsed = 0.
+
+    def _Move_To(self, target, guarded = True):
+        # straight Cartesian move of the tip
+        d = np.asarray(target, dtype=float) - self.tip
+        dist = float(np.linalg.norm(d))
+        if dist < 1e-4:
+            return None
+        result = self.mover.Move(d, self.travel_speed, 'cartesian', max_distance=dist, guarded=guarded)
+        self.tip = result['tip']
+        return result
+
+    def Probe(self, xy):
+        # approach over xy, probe down, retract. Returns the contact point or None
+        predicted = self.map.Height(xy, self.reuse_radius)
+        z = self.z_top if predicted is None else min(self.z_top, predicted + self.clearance)
+        z = max(z, self.tip[2])
+        if z > self.tip[2] + 1e-4:
+            self._Move_To([self.tip[0], self.tip[1], z], guarded=False)
+        result = self._Move_To([xy[0], xy[1], z])
+        if result is not None and result['contact']:
+            # something in the way: back off and take that as the surface here
+            self.collisions += 1
+            self._Move_To(self.tip + [0., 0., self.clearance], guarded=False)
+            z = self.tip[2]
+        result = self.mover.Move([0., 0., -1.], self.probe_speed, 'cartesian',
+                                 max_distance=max(z - self.z_floor, 0.))
+        self.tip = result['tip']
+        self.probes += 1
+        contact = result['contact']
+        self.map.Add([xy[0], xy[1], self.tip[2]], contact)
+        if contact:
+            self._Move_To(self.tip + [0., 0., self.clearance], guarded=False)
+        return result['tip'] if contact else None
+
+    def Plan(self, points):
+        # order points (N, 2) from the present tip
+        q0 = self.mover.model.Ticks_To_Angles(np.asarray(self.mover.reader.Read_Sync_Positions(), dtype=float))
+        cost, reached = travel_costs(self.solver, points, self.z_top, q0, self.travel_speed, self.joint_speed)
+        keep = reachable(reached)
+        if keep.size == 0:
+            return keep
+        start = np.linalg.norm(points[keep] - self.tip[:2], axis=1) / self.travel_speed
+        return keep[order_probes(cost[np.ix_(keep, keep)], start)]
+
+    def Scan(self, points,
+             # curvature refinement passes after the coarse points
+             rounds = 2,
+             # plane fit residual, meters, above which a point gets refined
+             threshold = 0.002,
+             min_spacing = 0.005,
+             out = None):
+        self.tip = self.mover.model.Forward_Ticks(np.asarray(self.mover.reader.Read_Sync_Positions(), dtype=float))[0]
+        self.probes = 0
+        self.collisions = 0
+        start = time.perf_counter()
+        points = np.asarray(points, dtype=float).reshape(-1, 2)
+        spacing = np.linalg.norm(np.diff(points, axis=0), axis=1)
+        spacing = spacing[spacing > 0]
+        if spacing.size == 0:
+            # a single point: no spacing to refine at
+            rounds = 0
+            radius = 0.
+        else:
+            radius = 1.5 * float(np.min(spacing))
+        for r in range(rounds + 1):
+            if len(points) == 0:
+                break
+            for k in self.Plan(points):
+                p = self.Probe(points[k])
+                if out is not None:
+                    if p is None:
+                        print("%d,%f,%f,nan" % (r, points[k][0], points[k][1]), file=out)
+                    else:
+                        print("%d,%f,%f,%f" % (r, p[0], p[1], p[2]), file=out)
+            points = self.map.Refinement(radius, threshold, min_spacing)
+            radius *= 0.5
+        self.elapsed = time.perf_counter() - start
+        return self.map.Array()
+
+    def Probes_Per_Minute(self):
+        return 60. * self.probes / self.elapsed if self.elapsed > 0 else 0.
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['plan'] and len(args) == 6:
+        x0, x1, y0, y1, spacing = [float(a) for a in args[1:]]
+        model = ArmModel()
+        solver = IKSolver(model)
+        q0 = model.Ticks_To_Angles(TABLE_POSE)
+        z = model.Forward(q0)[0][2] + 0.02
+        points = grid_points((x0, x1), (y0, y1), spacing)
+        t = time.perf_counter()
+        cost, reached = travel_costs(solver, points, z, q0)
+        keep = reachable(reached)
+        cost = cost[np.ix_(keep, keep)]
+        order = order_probes(cost)
+        t = time.perf_counter() - t
+        print("%d points, planned in %.1f ms" % (len(keep), 1e3 * t))
+        print("Travel, raster order: %.1f s" % tour_cost(cost, np.arange(len(keep))))
+        print("Travel, planned order: %.1f s" % tour_cost(cost, order))
+    elif args[:1] == ['scan'] and len(args) >= 6:
+        from CurrentReader import DynamixelReader
+        from GuardedMove import GuardedMover
+        x0, x1, y0, y1, spacing = [float(a) for a in args[1:6]]
+        fname = args[6] if len(args) > 6 else "scan.csv"
+        rounds = int(args[7]) if len(args) > 7 else 2
+        reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                                 baud_rate = 115200,
+                                 m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                                 proto_ver = 2,
+                                 read_addr = 126, read_len = 2)
+        mover = GuardedMover(reader)
+        mover.Calibrate()
+        top = mover.model.Forward_Ticks(np.asarray(reader.Read_Sync_Positions(), dtype=float))[0][2]
+        scanner = SurfaceScanner(mover, top - 0.1, top)
+        fout = open(fname, "w")
+        print("Round, X, Y, Z", file=fout)
+        scanner.Scan(grid_points((x0, x1), (y0, y1), spacing), rounds, out=fout)
+        fout.close()
+        print("%d probes in %.1f s: %.1f probes/min, %d collisions on the way" % (
+            scanner.probes, scanner.elapsed, scanner.Probes_Per_Minute(), scanner.collisions))
+        del reader
+    else:
+        print(__doc__)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shared memory telemetry bus.
+
+The process that owns the serial port publishes every Read_Sync_State row
+into a ring buffer in multiprocessing.shared_memory; any number of other
+processes (plotter, recorder, classifier) attach by name and read it as
+NumPy views, with no pipes and no copies.
+
+Layout of the block: a header of int64 [magic, version, capacity, columns,
+seq], then capacity x columns float64 samples. Sample k lives in row
+k % capacity. There is one writer: it fills the row, then bumps seq. A
+reader keeps its own cursor (the next sample it wants). The row after the
+newest one is the next to be overwritten, so only the last capacity - 1
+samples are safe to read; if the writer got further ahead than that, the
+oldest ones are skipped and counted as overruns. Rows handed out are views
+into the ring, so a reader that holds on to them can call Intact to check
+they weren't overwritten meanwhile (or copy them).
+
+Usage:
+    python TelemetryBus.py publish [rate]     acquisition: sync reads into the bus,
+                                              by default as fast as the baud rate allows
+    python TelemetryBus.py monitor            prints rate, latest sample and overruns
+
+"""
+
+import sys
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+
+
+BUS_NAME = 'dxl_telemetry'
+MAGIC = 0x44584c54
+VERSION = 1
+HEADER_LEN = 5
+SEQ = 4
+
+# a Read_Sync_State row
+STATE_COLUMNS = ['time', 'current1', 'current2', 'current3', 'current4',
+                 'velocity1', 'velocity2', 'velocity3', 'velocity4',
+                 'position1', 'position2', 'position3', 'position4']
+
+
+def _attach(name):
+    # Attach without registering the block with this process's resource
+    # tracker, which would otherwise unlink it when a reader exits. A
+    # multiprocessing child shares its parent's tracker and must leave it be.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        import multiprocessing
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class TelemetryPublisher:
+    def __init__(self, name = BUS_NAME,
+                 # samples kept, 20 s at 200 Hz
+                 capacity = 4096,
+                 columns = len(STATE_COLUMNS)):
+        size = 8 * (HEADER_LEN + capacity * columns)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # left over from a publisher that didn't close
+            old = _attach(name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+        self.ring = np.ndarray((capacity, columns), dtype=np.float64, buffer=self.shm.buf, offset=8 * HEADER_LEN)
+        self.header[:] = [MAGIC, VERSION, capacity, columns, 0]
+        self.capacity = capacity
+        self.seq = 0
+
+    def Publish(self, row):
+        self.ring[self.seq % self.capacity] = row
+        self.seq += 1
+        self.header[SEQ] = self.seq
+
+    def Close(self):
+        del self.header, self.ring
+        self.shm.close()
+        self.shm.unlink()
+
+
+class TelemetrySubscriber:
+    def __init__(self, name = BUS_NAME,
+                 # start from the newest sample instead of the oldest kept
+                 latest = True):
+        self.shm = _attach(name)
+        self.header = np.ndarray((HEADER_LEN,), dtype=np.int64, buffer=self.shm.buf)
+        if self.header[0] != MAGIC or self.header[1] != VERSION:
+            raise ValueError("'%s' is not a version %d telemetry bus" % (name, VERSION))
+        self.capacity = int(self.header[2])
+        self.columns = int(self.header[3])
+        self.ring = np.ndarray((self.capacity, self.columns), dtype=np.float64,
+                               buffer=self.shm.buf, offset=8 * HEADER_LEN)
+        seq = int(self.header[SEQ])
+        self.cursor = seq if latest else max(seq - self.capacity + 1, 0)
+        self.overruns = 0
+
+    def Seq(self):
+        return int(self.header[SEQ])
+
+    def Read(self, max_rows = None):
+        # New samples since the last call, oldest first, as a view into the
+        # ring (only up to the wrap point: call again for the rest).
+        # Returns (rows, seq of the first row).
+        seq = int(self.header[SEQ])
+        if seq - self.cursor >= self.capacity:
+            # the slot of sample seq - capacity is the one being written next
+            self.overruns += seq - self.cursor - self.capacity + 1
+            self.cursor = seq - self.capacity + 1
+        start = self.cursor % self.capacity
+        n = min(seq - self.cursor, self.capacity - start)
+        if max_rows is not None:
+            n = min(n, max_rows)
+        first = self.cursor
+        self.cursor += n
+        return self.ring[start:start + n], first
+
+    def Intact(self, first):
+        # True if the rows read from seq `first` on haven't been overwritten yet
+        return int(self.header[SEQ]) - first < self.capacity
+
+    def Latest(self, n = 1):
+        # the newest n samples, a copy (they may straddle the wrap)
+        seq = int(self.header[SEQ])
+        n = min(n, seq, self.capacity - 1)
+        idx = np.arange(seq - n, seq) % self.capacity
+        return self.ring[idx]
+
+    def Wait(self, timeout = 1., poll = 0.0005):
+        # blocks until there is a sample past the cursor. False on timeout
+        end = time.perf_counter() + timeout
+        while int(self.header[SEQ]) <= self.cursor:
+            if time.perf_counter() > end:
+                return False
+            time.sleep(poll)
+        return True
+
+    def Close(self):
+        # views handed out by Read must be dropped before this
+        del self.header, self.ring
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['publish']:
+        from CurrentReader import DynamixelReader
+        from RateLoop import RateLoop
+        from WireModel import control_rate
+        rate = float(args[1]) if len(args) > 1 else None
+        reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                                 baud_rate = 115200,
+                                 m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                                 proto_ver = 2,
+                                 read_addr = 126, read_len = 2)
+        # one state read per tick: the default is what the bus keeps up with,
+        # a rate above what it can do is refused
+        rate = control_rate(reader.baud_rate, rate, [('sync_read', 4, 10)])
+        bus = TelemetryPublisher()
+        loop = RateLoop(rate)
+        print("Publishing on '%s', Ctrl-C stops" % BUS_NAME)
+        try:
+            while True:
+                bus.Publish(reader.Read_Sync_State())
+                loop.Wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            bus.Close()
+        print(loop.Report())
+        del reader
+    elif args[:1] == ['monitor']:
+        bus = TelemetrySubscriber()
+        try:
+            while True:
+                t = time.perf_counter()
+                n = 0
+                while time.perf_counter() - t < 1.:
+                    if bus.Wait(1.):
+                        n += len(bus.Read()[0])
+                latest = bus.Latest()[0].astype(int) if bus.Seq() else None
+                print("%.0f samples/s, overruns %d, latest %s" % (
+                    n / (time.perf_counter() - t), bus.overruns, latest))
+        except KeyboardInterrupt:
+            pass
+        bus.Close()
+    else:
+        print(__doc__)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Smooth keyboard teleop in velocity control.
+
+Same keys as move_buttons2.py (q/a, w/s, e/d, r/f move motors 1-4 up/down,
+z quits), but instead of 20-tick position jumps the servos run in velocity
+control (operating mode 1) and get a goal velocity stream. Every tick:
+
+    target = max_velocity * (KEY_MATRIX @ held keys)      held keys -> (4,)
+    velocity += clip(target - velocity, +-acceleration * dt)
+
+and one sync write of the four goal velocities, whether no key or all of
+them are held, so bus traffic is constant. Releasing a key ramps that joint
+down to 0 at the same acceleration, with dt the time measured since the
+previous tick. The rate defaults to what the bus can keep up with for one
+tick's traffic (the goal velocity write, plus a state read when recording).
+If the loop misses ticks (the host stalled) the velocities are zeroed at
+once instead, and the servos' bus watchdog stops them on its own if the
+host stops talking altogether.
+
+A tripped watchdog (it reads -1) makes the servos refuse goal velocities
+until it is cleared, so it is re-armed (0, then the watchdog time) after
+any gap between writes as long as the watchdog time, and, when the state is
+read every tick (recording), after joints commanded to move read a present
+velocity of 0 for a while and the register says it tripped. The profile
+acceleration zeroed at Start is put back at Stop.
+
+Usage: sudo python VelocityTeleop.py [max_velocity] [acceleration]
+velocity in units of 0.229 rpm, acceleration in those units per second.
+
+"""
+
+import sys
+
+import numpy as np
+
+from RateLoop import RateLoop
+from WireModel import ARM_CYCLE, control_rate
+
+
+ADDR_BUS_WATCHDOG = 98
+LEN_BUS_WATCHDOG = 1
+# what the bus watchdog reads after it stopped the servo (-1)
+WATCHDOG_TRIPPED = 255
+# watchdog unit, s
+WATCHDOG_UNIT = 0.02
+ADDR_GOAL_VELOCITY = 104
+LEN_GOAL_VELOCITY = 4
+ADDR_PROFILE_ACCELERATION = 108
+LEN_PROFILE_ACCELERATION = 4
+ADDR_GOAL_POSITION = 116
+LEN_GOAL_POSITION = 4
+
+VELOCITY_CONTROL_MODE = 1
+POSITION_CONTROL_MODE = 3
+
+KEYS = ['q', 'a', 'w', 's', 'e', 'd', 'r', 'f']
+# held key -> joint direction, one row per key
+KEY_MATRIX = np.array([[1, 0, 0, 0], [-1, 0, 0, 0],
+                       [0, 1, 0, 0], [0, -1, 0, 0],
+                       [0, 0, 1, 0], [0, 0, -1, 0],
+                       [0, 0, 0, 1], [0, 0, 0, -1]], dtype=float)
+QUIT_KEY = 'z'
+
+
+class VelocityTeleop:
+    def __init__(self, reader,
+                 # key name -> bool, e.g. keyboard.is_pressed
+                 is_pressed,
+                 # goal velocity of a held key, 0.229 rpm units
+                 max_velocity = 50.,
+                 # ramp, 0.229 rpm units per second
+                 acceleration = 200.,
+                 # loop rate, Hz. None: what the bus can keep up with for the cycle Run does
+                 rate = None,
+                 # ticks the loop may fall behind before the velocities are zeroed
+                 max_missed = 2,
+                 # servo side stop if no packet arrives for this long, units of 20 ms
+                 watchdog = 5,
+                 # ticks a commanded joint may read 0 velocity before the watchdog is checked
+                 stale_ticks = 10):
+        self.reader = reader
+        self.is_pressed = is_pressed
+        self.max_velocity = max_velocity
+        self.acceleration = acceleration
+        self.rate = rate
+        self.loop = RateLoop(self.Rate())
+        self.last = 0.
+        self.max_missed = max_missed
+        self.watchdog = watchdog
+        self.stale_ticks = stale_ticks
+        self.motors = [reader.m1id, reader.m2id, reader.m3id, reader.m4id]
+        self.profile_acceleration = None
+        self.stale = 0
+        self.rearmed = 0
+        self.held = np.zeros(len(KEYS))
+        self.target = np.zeros(4)
+        self.velocity = np.zeros(4)
+        self.command = np.zeros(4)
+        self.zeroed = 0
+
+    def Start(self):
+        reader = self.reader
+        reader.Write_Sync(ADDR_GOAL_VELOCITY, LEN_GOAL_VELOCITY, [0] * 4)
+        reader.Set_Operating_Mode(VELOCITY_CONTROL_MODE)
+        # the ramp happens here, not in the servo's profile; Stop puts it back
+        self.profile_acceleration = [reader.Read_Value(m, ADDR_PROFILE_ACCELERATION, LEN_PROFILE_ACCELERATION)
+                                     for m in self.motors]
+        reader.Write_Sync(ADDR_PROFILE_ACCELERATION, LEN_PROFILE_ACCELERATION, [0] * 4)
+        reader.Write_Sync(ADDR_BUS_WATCHDOG, LEN_BUS_WATCHDOG, [self.watchdog] * 4)
+        self.velocity[:] = 0.
+        self.command[:] = 0.
+        self.stale = 0
+        self.loop.Start()
+        self.last = 0.
+
+    def Rate(self, recording = False):
+        # one goal velocity write per tick, after a state read when recording.
+        # ValueError if the requested rate is more than the bus can do
+        cycle = ARM_CYCLE if recording else [('sync_write', 4, LEN_GOAL_VELOCITY)]
+        return control_rate(self.reader.baud_rate, self.rate, cycle)
+
+    def Rearm(self):
+        # clears a tripped watchdog, which also lets goal velocities through again
+        self.reader.Write_Sync(ADDR_BUS_WATCHDOG, LEN_BUS_WATCHDOG, [0] * 4)
+        self.reader.Write_Sync(ADDR_BUS_WATCHDOG, LEN_BUS_WATCHDOG, [self.watchdog] * 4)
+        self.rearmed += 1
+
+    def Tripped(self):
+        return any(self.reader.Read_Value(m, ADDR_BUS_WATCHDOG, LEN_BUS_WATCHDOG) == WATCHDOG_TRIPPED
+                   for m in self.motors)
+
+    def _Watchdog(self, late, present):
+        if self.watchdog <= 0:
+            return
+        if self.loop.period + late >= self.watchdog * WATCHDOG_UNIT:
+            # the servos went the watchdog time without a packet
+            self.Rearm()
+            self.stale = 0
+            return
+        if present is None:
+            return
+        # joints told to move that don't: stopped by the watchdog, or blocked
+        if np.any((np.abs(self.command) >= 1) & (np.asarray(present) == 0)):
+            self.stale += 1
+        else:
+            self.stale = 0
+        if self.stale >= self.stale_ticks:
+            self.stale = 0
+            if self.Tripped():
+                self.Rearm()
+
+    def Update(self, held, late = 0., present = None):
+        # held: (8,) 0/1 per KEYS entry. late: how far behind the loop is, s.
+        # present: optional present velocities (4,), if the caller reads them
+        self._Watchdog(late, present)
+        np.dot(held, KEY_MATRIX, out=self.target)
+        np.clip(self.target, -1., 1., out=self.target)
+        self.target *= self.max_velocity
+        # ramp by the time that really passed, a late tick still accelerates as asked
+        t = self.loop.Time()
+        step = self.acceleration * (t - self.last)
+        self.last = t
+        if late > self.max_missed * self.loop.period:
+            self.velocity[:] = 0.
+            self.zeroed += 1
+        else:
+            self.velocity += np.clip(self.target - self.velocity, -step, step)
+        np.rint(self.velocity, out=self.command)
+        self.reader.Write_Sync(ADDR_GOAL_VELOCITY, LEN_GOAL_VELOCITY, self.command)
+        return self.command
+
+    def Stop(self):
+        # stop, then hold the present position in position control
+        reader = self.reader
+        reader.Write_Sync(ADDR_GOAL_VELOCITY, LEN_GOAL_VELOCITY, [0] * 4)
+        # the watchdog must be off to leave velocity control
+        reader.Write_Sync(ADDR_BUS_WATCHDOG, LEN_BUS_WATCHDOG, [0] * 4)
+        reader.Write_Sync(ADDR_GOAL_POSITION, LEN_GOAL_POSITION, reader.Read_Sync_Positions())
+        reader.Set_Operating_Mode(POSITION_CONTROL_MODE)
+        if self.profile_acceleration is not None:
+            reader.Write_Sync(ADDR_PROFILE_ACCELERATION, LEN_PROFILE_ACCELERATION, self.profile_acceleration)
+
+    def Run(self, recorder = None):
+        # recorder: optional MacroRecorder, gets a sync read of the state every tick
+        self.loop = RateLoop(self.Rate(recorder is not None))
+        self.Start()
+        try:
+            while not self.is_pressed(QUIT_KEY):
+                present = None
+                if recorder is not None:
+                    state = self.reader.Read_Sync_State()
+                    recorder.Add(self.loop.Time(), state)
+                    present = state[5:9]
+                for k, key in enumerate(KEYS):
+                    self.held[k] = self.is_pressed(key)
+                self.Update(self.held, self.loop.late, present)
+                self.loop.Wait()
+        finally:
+            self.Stop()
+
+
+if __name__ == '__main__':
+    import keyboard
+    from CurrentReader import DynamixelReader
+    args = sys.argv[1:]
+    max_velocity = float(args[0]) if len(args) > 0 else 50.
+    acceleration = float(args[1]) if len(args) > 1 else 200.
+    reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                             baud_rate = 115200,
+                             m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                             proto_ver = 2,
+                             read_addr = 126, read_len = 2)
+    teleop = VelocityTeleop(reader, keyboard.is_pressed, max_velocity, acceleration)
+    print("q/a w/s e/d r/f move motors 1-4, z quits")
+    teleop.Run()
+    print(teleop.loop.Report())
+    print("Velocities zeroed on late ticks %d times, watchdog re-armed %d times" % (teleop.zeroed, teleop.rearmed))
+    del reader
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Wire time model of Dynamixel transactions.
+
+A transaction is the instruction packet going out, then (for reads, and
+writes at status return level 2) the status packets coming back one after
+the other, each after the servo's return delay time. On a USB adapter the
+host only sees the replies when the FTDI latency timer flushes them, and
+every transaction costs some host time on top. So
+
+    time = host + tx_bytes * 10 / baud
+           [+ sum over replies (return_delay + rx_bytes * 10 / baud) + latency_timer]
+
+Packet sizes follow the protocol: 2.0 instruction packets are 10 bytes +
+parameters, status packets 11 bytes + data; 1.0 ones 6 + parameters and
+6 + data. Fast sync read (2.0) returns one combined status packet.
+
+Cycle_Time adds up the transactions of one control cycle and Max_Rate is
+its inverse, which is what the scheduler and read planner budget with, and
+control_rate picks (or checks) the loop rate of a control script from it.
+
+Usage:
+    python WireModel.py predict [baud] [return_delay_us] [latency_ms]
+        time per transaction type for the four motors, and the max rate of
+        the state read + goal write cycle
+    python WireModel.py measure [n]
+        runs the same transactions n times on the arm and prints measured
+        against predicted
+
+"""
+
+import sys
+import time
+
+
+KINDS = ('read', 'write', 'sync_read', 'fast_sync_read', 'sync_write', 'bulk_read', 'bulk_write')
+
+
+class WireModel:
+    def __init__(self,
+                 baud = 1000000,
+                 protocol = 2,
+                 # servo return delay time, s (register 9 in 2 us units, default 250)
+                 return_delay = 500e-6,
+                 # USB adapter latency timer, s (FTDI default 16 ms, 1 ms when tuned)
+                 latency_timer = 1e-3,
+                 # host side cost per transaction, s (driver, SDK, Python)
+                 host = 0.2e-3,
+                 # 2: writes get a status packet too, 1: only reads do
+                 status_return_level = 2,
+                 bits_per_byte = 10):
+        if protocol not in (1, 2):
+            raise ValueError("unknown protocol version %s" % protocol)
+        self.baud = baud
+        self.protocol = protocol
+        self.return_delay = return_delay
+        self.latency_timer = latency_timer
+        self.host = host
+        self.status_return_level = status_return_level
+        self.byte_time = bits_per_byte / float(baud)
+
+    def Packet_Bytes(self, kind, lengths):
+        # (tx bytes, [rx bytes of each status packet]) of one transaction.
+        # lengths: data bytes per motor (one entry per motor addressed)
+        n = len(lengths)
+        if self.protocol == 2:
+            inst, status = 10, 11
+            tx = {'read': inst + 4,
+                  'write': inst + 2 + sum(lengths),
+                  'sync_read': inst + 4 + n,
+                  'fast_sync_read': inst + 4 + n,
+                  'sync_write': inst + 4 + sum(1 + l for l in lengths),
+                  'bulk_read': inst + 5 * n,
+                  'bulk_write': inst + sum(5 + l for l in lengths)}
+        else:
+            inst, status = 6, 6
+            tx = {'read': inst + 2,
+                  'write': inst + 1 + sum(lengths),
+                  'sync_write': inst + 2 + sum(1 + l for l in lengths),
+                  'bulk_read': inst + 1 + 3 * n}
+        if kind not in tx:
+            raise ValueError("'%s' is not a protocol %d instruction" % (kind, self.protocol))
+        if kind in ('read', 'sync_read', 'bulk_read'):
+            rx = [status + l for l in lengths]
+        elif kind == 'fast_sync_read':
+            # one status packet: header, then error, id, data, crc per motor
+            rx = [8 + sum(4 + l for l in lengths)]
+        elif kind == 'write' and self.status_return_level >= 2:
+            rx = [status]
+        else:
+            rx = []
+        return tx[kind], rx
+
+    def Time(self, kind, n = 1, length = 4):
+        # seconds for one transaction addressing n motors, `length` data
+        # bytes each (or a list of per motor lengths). read and write
+        # address one motor, n of them are n transactions
+        lengths = list(length) if hasattr(length, '__len__') else [length] * n
+        if kind in ('read', 'write') and len(lengths) > 1:
+            # one transaction per motor
+            return sum(self.Time(kind, 1, l) for l in lengths)
+        tx, rx = self.Packet_Bytes(kind, lengths)
+        t = self.host + tx * self.byte_time
+        if rx:
+            t += sum(self.return_delay + r * self.byte_time for r in rx) + self.latency_timer
+        return t
+
+    def Cycle_Time(self, transactions):
+        # transactions: [(kind, n, length)]
+        return sum(self.Time(*t) for t in transactions)
+
+    def Max_Rate(self, transactions):
+        return 1. / self.Cycle_Time(transactions)
+
+
+# the arm's control cycle: state sync read (current, velocity, position) + goal sync write
+ARM_CYCLE = [('sync_read', 4, 10), ('sync_write', 4, 4)]
+
+
+def control_rate(baud, rate = None, transactions = ARM_CYCLE,
+                 # share of the predicted max rate a default rate uses
+                 budget = 0.8,
+                 # highest default rate, Hz
+                 cap = 200.):
+    # Control loop rate for one cycle of `transactions` per tick at `baud`:
+    # `rate` if the wire can keep up with it, ValueError if it can't. None
+    # picks budget * Max_Rate, at most cap.
+    max_rate = WireModel(baud).Max_Rate(transactions)
+    if rate is None:
+        return min(cap, float(int(budget * max_rate)))
+    if rate > max_rate:
+        raise ValueError("%.0f Hz is above the %.0f Hz a %d baud bus can do" % (rate, max_rate, baud))
+    return float(rate)
+
+
+def measure(reader, n = 200):
+    # mean seconds of each transaction type the reader does, on the port
+    ADDR_PRO_GOAL_POSITION = 116
+    ADDR_PRO_PRESENT_POSITION = 132
+    goals = reader.Read_Sync_Positions()
+    calls = [('read', lambda: reader.Read_Value(reader.m1id, ADDR_PRO_PRESENT_POSITION, 4)),
+             ('write', lambda: reader.Set_Value(reader.m1id, ADDR_PRO_GOAL_POSITION, 4, goals[0])),
+             ('sync_read 4 x 4', reader.Read_Sync_Positions),
+             ('sync_read 4 x 10', reader.Read_Sync_State),
+             ('sync_write 4 x 4', lambda: reader.Write_Sync(ADDR_PRO_GOAL_POSITION, 4, goals))]
+    results = {}
+    for name, fn in calls:
+        t = time.perf_counter()
+        for j in range(n):
+            fn()
+        results[name] = (time.perf_counter() - t) / n
+    return results
+
+
+def predictions(model):
+    return {'read': model.Time('read', 1, 4),
+            'write': model.Time('write', 1, 4),
+            'sync_read 4 x 4': model.Time('sync_read', 4, 4),
+            'sync_read 4 x 10': model.Time('sync_read', 4, 10),
+            'sync_write 4 x 4': model.Time('sync_write', 4, 4)}
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args[:1] == ['predict']:
+        baud = int(args[1]) if len(args) > 1 else 115200
+        model = WireModel(baud,
+                          return_delay = float(args[2]) * 1e-6 if len(args) > 2 else 500e-6,
+                          latency_timer = float(args[3]) * 1e-3 if len(args) > 3 else 1e-3)
+        print("%d baud, 4 motors, 4 data bytes each (read/write: one per motor):" % baud)
+        for kind in KINDS:
+            print("  %-15s %7.3f ms" % (kind, 1e3 * model.Time(kind, 4, 4)))
+        print("State read + goal write cycle: %.3f ms, max %.0f Hz" % (
+            1e3 * model.Cycle_Time(ARM_CYCLE), model.Max_Rate(ARM_CYCLE)))
+    elif args[:1] == ['measure']:
+        from CurrentReader import DynamixelReader
+        n = int(args[1]) if len(args) > 1 else 200
+        baud = 115200
+        reader = DynamixelReader(device_name = "/dev/tty.usbserial-FT2N0DM5".encode('utf-8'),
+                                 baud_rate = baud,
+                                 m1id = 100, m2id = 101, m3id = 102, m4id = 103,
+                                 proto_ver = 2,
+                                 read_addr = 126, read_len = 2)
+        measured = measure(reader, n)
+        predicted = predictions(WireModel(baud))
+        print("%-18s %12s %12s" % ("", "predicted ms", "measured ms"))
+        for name in predicted:
+            print("%-18s %12.3f %12.3f" % (name, 1e3 * predicted[name], 1e3 * measured[name]))
+        del reader
+    else:
+        print(__doc__)
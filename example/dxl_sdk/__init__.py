@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Dynamixel SDK binding.
+
+    import dxl_sdk as dynamixel
+    port_num = dynamixel.portHandler(b'/dev/ttyUSB0')
+
+The same functions as DynamixelSDK-master/python/dynamixel_functions_py,
+without its import time costs and the chdir around the import:
+
+    - the C library is looked up relative to this package, for the platform
+      it runs on (DXL_SDK_LIB overrides the path), not relative to the
+      working directory;
+    - nothing is loaded at import. A function is resolved the first time it
+      is used, gets its argtypes/restype from SIGNATURES, and is then kept
+      as a module attribute, so later calls don't come back here;
+    - if the library isn't there (it isn't built for every platform) or
+      DXL_SDK_PURE is set, the functions come from dxl_sdk.pure, a pure
+      Python implementation on the Protocol2 codec (protocol 2.0, POSIX).
+
+Functions returning a C string return str.
+
+Usage: python -m dxl_sdk [device] [baud]
+prints the import time, and with a device the time to open the port and
+ping the four motors, against IMPORT_BUDGET and CONNECT_BUDGET.
+
+"""
+
+import os
+import sys
+
+
+# result type, argument types: i int, B uint8, H uint16, I uint32, d double,
+# s char *, p uint8 *, v void
+SIGNATURES = {
+    'portHandler':               ('i', 's'),
+    'openPort':                  ('B', 'i'),
+    'closePort':                 ('v', 'i'),
+    'clearPort':                 ('v', 'i'),
+    'setPortName':               ('v', 'is'),
+    'getPortName':               ('s', 'i'),
+    'setBaudRate':               ('B', 'ii'),
+    'getBaudRate':               ('i', 'i'),
+    'readPort':                  ('i', 'ipi'),
+    'writePort':                 ('i', 'ipi'),
+    'setPacketTimeout':          ('v', 'iH'),
+    'setPacketTimeoutMSec':      ('v', 'id'),
+    'isPacketTimeout':           ('B', 'i'),
+    'packetHandler':             ('v', ''),
+    'printTxRxResult':           ('v', 'ii'),
+    'getTxRxResult':             ('s', 'ii'),
+    'printRxPacketError':        ('v', 'iB'),
+    'getRxPacketError':          ('s', 'iB'),
+    'getLastTxRxResult':         ('i', 'ii'),
+    'getLastRxPacketError':      ('B', 'ii'),
+    'setDataWrite':              ('v', 'iiHHI'),
+    'getDataRead':               ('I', 'iiHH'),
+    'txPacket':                  ('v', 'ii'),
+    'rxPacket':                  ('v', 'ii'),
+    'txRxPacket':                ('v', 'ii'),
+    'ping':                      ('v', 'iiB'),
+    'pingGetModelNum':           ('H', 'iiB'),
+    'broadcastPing':             ('v', 'ii'),
+    'getBroadcastPingResult':    ('B', 'iii'),
+    'reboot':                    ('v', 'iiB'),
+    'factoryReset':              ('v', 'iiBB'),
+    'readTx':                    ('v', 'iiBHH'),
+    'readRx':                    ('v', 'iiH'),
+    'readTxRx':                  ('v', 'iiBHH'),
+    'read1ByteTx':               ('v', 'iiBH'),
+    'read1ByteRx':               ('B', 'ii'),
+    'read1ByteTxRx':             ('B', 'iiBH'),
+    'read2ByteTx':               ('v', 'iiBH'),
+    'read2ByteRx':               ('H', 'ii'),
+    'read2ByteTxRx':             ('H', 'iiBH'),
+    'read4ByteTx':               ('v', 'iiBH'),
+    'read4ByteRx':               ('I', 'ii'),
+    'read4ByteTxRx':             ('I', 'iiBH'),
+    'writeTxOnly':               ('v', 'iiBHH'),
+    'writeTxRx':                 ('v', 'iiBHH'),
+    'write1ByteTxOnly':          ('v', 'iiBHB'),
+    'write1ByteTxRx':            ('v', 'iiBHB'),
+    'write2ByteTxOnly':          ('v', 'iiBHH'),
+    'write2ByteTxRx':            ('v', 'iiBHH'),
+    'write4ByteTxOnly':          ('v', 'iiBHI'),
+    'write4ByteTxRx':            ('v', 'iiBHI'),
+    'regWriteTxOnly':            ('v', 'iiBHH'),
+    'regWriteTxRx':              ('v', 'iiBHH'),
+    'syncReadTx':                ('v', 'iiHHH'),
+    'syncWriteTxOnly':           ('v', 'iiHHH'),
+    'bulkReadTx':                ('v', 'iiH'),
+    'bulkWriteTxOnly':           ('v', 'iiH'),
+    'groupBulkRead':             ('i', 'ii'),
+    'groupBulkReadAddParam':     ('B', 'iBHH'),
+    'groupBulkReadRemoveParam':  ('v', 'iB'),
+    'groupBulkReadClearParam':   ('v', 'i'),
+    'groupBulkReadTxPacket':     ('v', 'i'),
+    'groupBulkReadRxPacket':     ('v', 'i'),
+    'groupBulkReadTxRxPacket':   ('v', 'i'),
+    'groupBulkReadIsAvailable':  ('B', 'iBHH'),
+    'groupBulkReadGetData':      ('I', 'iBHH'),
+    'groupBulkWrite':            ('i', 'ii'),
+    'groupBulkWriteAddParam':    ('B', 'iBHHIH'),
+    'groupBulkWriteRemoveParam': ('v', 'iB'),
+    'groupBulkWriteChangeParam': ('B', 'iBHHIHH'),
+    'groupBulkWriteClearParam':  ('v', 'i'),
+    'groupBulkWriteTxPacket':    ('v', 'i'),
+    'groupSyncRead':             ('i', 'iiHH'),
+    'groupSyncReadAddParam':     ('B', 'iB'),
+    'groupSyncReadRemoveParam':  ('v', 'iB'),
+    'groupSyncReadClearParam':   ('v', 'i'),
+    'groupSyncReadTxPacket':     ('v', 'i'),
+    'groupSyncReadRxPacket':     ('v', 'i'),
+    'groupSyncReadTxRxPacket':   ('v', 'i'),
+    'groupSyncReadIsAvailable':  ('B', 'iBHH'),
+    'groupSyncReadGetData':      ('I', 'iBHH'),
+    'groupSyncWrite':            ('i', 'iiHH'),
+    'groupSyncWriteAddParam':    ('B', 'iBIH'),
+    'groupSyncWriteRemoveParam': ('v', 'iB'),
+    'groupSyncWriteChangeParam': ('B', 'iBIHH'),
+    'groupSyncWriteClearParam':  ('v', 'i'),
+    'groupSyncWriteTxPacket':    ('v', 'i'),
+}
+
+# seconds, checked by python -m dxl_sdk
+IMPORT_BUDGET = 0.05
+CONNECT_BUDGET = 0.25
+
+_SDK_BUILD = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'DynamixelSDK-master', 'c', 'build')
+
+_library = None
+_loaded = False
+
+
+def library_path():
+    # the SDK build for this platform, relative to the package
+    if os.environ.get('DXL_SDK_LIB'):
+        return os.environ['DXL_SDK_LIB']
+    if sys.platform == 'darwin':
+        return os.path.join(_SDK_BUILD, 'mac', 'libdxl_mac_c.dylib')
+    if sys.platform == 'win32':
+        if sys.maxsize > 2 ** 32:
+            return os.path.join(_SDK_BUILD, 'win64', 'output', 'dxl_x64_c.dll')
+        return os.path.join(_SDK_BUILD, 'win32', 'output', 'dxl_x86_c.dll')
+    machine = os.uname().machine
+    if machine.startswith('arm') or machine == 'aarch64':
+        return os.path.join(_SDK_BUILD, 'linux_sbc', 'libdxl_sbc_c.so')
+    if sys.maxsize > 2 ** 32:
+        return os.path.join(_SDK_BUILD, 'linux64', 'libdxl_x64_c.so')
+    return os.path.join(_SDK_BUILD, 'linux32', 'libdxl_x86_c.so')
+
+
+def _load():
+    # the C library, or None for the pure Python fallback. Loaded once
+    global _library, _loaded
+    if not _loaded:
+        _loaded = True
+        path = library_path()
+        if not os.environ.get('DXL_SDK_PURE') and os.path.exists(path):
+            import ctypes
+            try:
+                _library = ctypes.CDLL(path)
+            except OSError as e:
+                print("Couldn't load %s (%s), using the pure Python SDK" % (path, e))
+    return _library
+
+
+def backend():
+    # 'c' or 'python'
+    return 'c' if _load() is not None else 'python'
+
+
+def _bind(name):
+    library = _load()
+    if library is None:
+        from . import pure
+        fn = getattr(pure, name, None)
+        if fn is None:
+            raise AttributeError("%s is not in the pure Python SDK" % name)
+        return fn
+    import ctypes
+    types = {'i': ctypes.c_int, 'B': ctypes.c_uint8, 'H': ctypes.c_uint16, 'I': ctypes.c_uint32,
+             'd': ctypes.c_double, 's': ctypes.c_char_p, 'p': ctypes.POINTER(ctypes.c_uint8), 'v': None}
+    restype, argtypes = SIGNATURES[name]
+    fn = getattr(library, name)
+    fn.restype = types[restype]
+    fn.argtypes = [types[a] for a in argtypes]
+    if restype == 's':
+        raw = fn
+        fn = lambda *args: (raw(*args) or b'').decode()
+    return fn
+
+
+def __getattr__(name):
+    # first use of a function: resolve it and keep it as a module attribute
+    if name not in SIGNATURES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    fn = _bind(name)
+    globals()[name] = fn
+    return fn
+
+
+def __dir__():
+    return sorted(set(globals()) | set(SIGNATURES))
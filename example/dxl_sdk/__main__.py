@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# python -m dxl_sdk [device] [baud]: import and connect time against the budgets
+
+import os
+import subprocess
+import sys
+import time
+
+import dxl_sdk
+
+
+def import_time():
+    # in a fresh interpreter: (import, first function resolved) in seconds
+    code = ("import time; t = time.perf_counter(); import dxl_sdk; t1 = time.perf_counter(); "
+            "dxl_sdk.groupSyncRead; print(t1 - t, time.perf_counter() - t1)")
+    here = os.path.dirname(os.path.dirname(os.path.abspath(dxl_sdk.__file__)))
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=here)
+    return tuple(float(x) for x in out.split())
+
+
+def connect_time(device, baud, ids = (100, 101, 102, 103)):
+    # seconds to open the port and get a ping back from every motor
+    t = time.perf_counter()
+    port_num = dxl_sdk.portHandler(device.encode('utf-8'))
+    dxl_sdk.packetHandler()
+    if not dxl_sdk.openPort(port_num) or not dxl_sdk.setBaudRate(port_num, baud):
+        return None
+    answered = 0
+    for dxl_id in ids:
+        dxl_sdk.ping(port_num, 2, dxl_id)
+        answered += dxl_sdk.getLastTxRxResult(port_num, 2) == 0
+    dt = time.perf_counter() - t
+    dxl_sdk.closePort(port_num)
+    print("%d of %d motors answered" % (answered, len(ids)))
+    return dt
+
+
+if __name__ == '__main__':
+    imported, resolved = import_time()
+    print("Backend: %s (%s)" % (dxl_sdk.backend(), dxl_sdk.library_path()))
+    print("Import %.1f ms, first function %.1f ms, budget %.0f ms" % (
+        1e3 * imported, 1e3 * resolved, 1e3 * dxl_sdk.IMPORT_BUDGET))
+    ok = imported + resolved <= dxl_sdk.IMPORT_BUDGET
+    if len(sys.argv) > 1:
+        dt = connect_time(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 115200)
+        if dt is None:
+            print("Failed to open " + sys.argv[1])
+            ok = False
+        else:
+            print("Connect %.1f ms, budget %.0f ms" % (1e3 * dt, 1e3 * dxl_sdk.CONNECT_BUDGET))
+            ok = ok and dt <= dxl_sdk.CONNECT_BUDGET
+    print("Within budget" if ok else "OVER BUDGET")
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+"""
+Pure Python stand-in for the SDK's C library.
+
+The same function names and handle numbers as the C API (port and group
+handles are indices, results and errors are read back with
+getLastTxRxResult / getLastRxPacketError), for protocol 2.0 on a POSIX
+serial port, with the packets from Protocol2. It covers what the examples
+use: port setup, ping, reboot, 1/2/4 byte and block reads and writes, and
+sync read, sync write and bulk read groups.
+
+Like the C library, each transaction sets its own reply timeout from its
+packet lengths plus the USB latency timer.
+
+"""
+
+import os
+import select
+import time
+
+import Protocol2
+
+
+COMM_SUCCESS = 0
+COMM_PORT_BUSY = -1000
+COMM_TX_FAIL = -1001
+COMM_RX_FAIL = -1002
+COMM_TX_ERROR = -2000
+COMM_RX_WAITING = -3000
+COMM_RX_TIMEOUT = -3001
+COMM_RX_CORRUPT = -3002
+COMM_NOT_AVAILABLE = -9000
+
+RESULTS = {COMM_SUCCESS: "[TxRxResult] Communication success!",
+           COMM_PORT_BUSY: "[TxRxResult] Port is in use!",
+           COMM_TX_FAIL: "[TxRxResult] Failed transmit instruction packet!",
+           COMM_RX_FAIL: "[TxRxResult] Failed get status packet from device!",
+           COMM_TX_ERROR: "[TxRxResult] Incorrect instruction packet!",
+           COMM_RX_WAITING: "[TxRxResult] Now recieving status packet!",
+           COMM_RX_TIMEOUT: "[TxRxResult] There is no status packet!",
+           COMM_RX_CORRUPT: "[TxRxResult] Incorrect status packet!",
+           COMM_NOT_AVAILABLE: "[TxRxResult] Protocol does not support This Function!"}
+
+# USB serial adapter latency timer, s (the C library's LATENCY_TIMER)
+LATENCY_TIMER = 0.016
+
+
+class _Port:
+    def __init__(self, name):
+        self.name = name
+        self.fd = None
+        self.baud = 57600
+        self.parser = Protocol2.StatusParser()
+        self.result = COMM_SUCCESS
+        self.error = 0
+        self.data = b''
+
+
+class _Group:
+    def __init__(self, kind, port_num, addr, length):
+        self.kind = kind
+        self.port_num = port_num
+        self.addr = addr
+        self.length = length
+        # sync_read, bulk_read: {id: (address, length)}, sync_write: {id: bytes}
+        self.params = {}
+        self.data = {}
+        self.free = False
+
+
+_ports = []
+_groups = []
+
+
+def _name(name):
+    return name.decode() if isinstance(name, bytes) else name
+
+
+def portHandler(port_name):
+    name = _name(port_name)
+    for port_num, port in enumerate(_ports):
+        if port.name == name:
+            return port_num
+    _ports.append(_Port(name))
+    return len(_ports) - 1
+
+
+def _configure(port):
+    # False for a baud rate termios has no constant for, or a file that isn't a tty
+    import termios
+    speed = getattr(termios, 'B%d' % port.baud, None)
+    if speed is None:
+        return False
+    try:
+        attrs = termios.tcgetattr(port.fd)
+    except (OSError, termios.error):
+        return False
+    # raw 8N1
+    attrs[0] = 0
+    attrs[1] = 0
+    attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL
+    attrs[3] = 0
+    attrs[4] = speed
+    attrs[5] = speed
+    attrs[6][termios.VMIN] = 0
+    attrs[6][termios.VTIME] = 0
+    try:
+        termios.tcsetattr(port.fd, termios.TCSANOW, attrs)
+        termios.tcflush(port.fd, termios.TCIOFLUSH)
+    except (OSError, termios.error):
+        return False
+    return True
+
+
+def openPort(port_num):
+    port = _ports[port_num]
+    if port.fd is not None:
+        return 1
+    try:
+        port.fd = os.open(port.name, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return 0
+    if not _configure(port):
+        # not a serial port, or a baud rate it can't do: don't keep the fd
+        closePort(port_num)
+        return 0
+    return 1
+
+
+def closePort(port_num):
+    port = _ports[port_num]
+    if port.fd is not None:
+        os.close(port.fd)
+        port.fd = None
+
+
+def clearPort(port_num):
+    port = _ports[port_num]
+    if port.fd is not None:
+        import termios
+        termios.tcflush(port.fd, termios.TCIOFLUSH)
+
+
+def setPortName(port_num, port_name):
+    _ports[port_num].name = _name(port_name)
+
+
+def getPortName(port_num):
+    return _ports[port_num].name
+
+
+def setBaudRate(port_num, baudrate):
+    port = _ports[port_num]
+    port.baud = baudrate
+    if port.fd is None:
+        return 1
+    return 1 if _configure(port) else 0
+
+
+def getBaudRate(port_num):
+    return _ports[port_num].baud
+
+
+def setPacketTimeout(port_num, packet_length):
+    pass
+
+
+def setPacketTimeoutMSec(port_num, msec):
+    pass
+
+
+def packetHandler():
+    pass
+
+
+def getLastTxRxResult(port_num, protocol_version):
+    return _ports[port_num].result
+
+
+def getLastRxPacketError(port_num, protocol_version):
+    return _ports[port_num].error
+
+
+def getTxRxResult(protocol_version, result):
+    return RESULTS.get(result, "[TxRxResult] Unknown result %d" % result)
+
+
+def getRxPacketError(protocol_version, error):
+    return "[RxPacketError] " + Protocol2.error_text(error) if error else ""
+
+
+def printTxRxResult(protocol_version, result):
+    print(getTxRxResult(protocol_version, result))
+
+
+def printRxPacketError(protocol_version, error):
+    print(getRxPacketError(protocol_version, error))
+
+
+def _transact(port_num, packet, ids = (), reply_len = 0):
+    # sends packet, collects one status packet from each of ids: {id: params}
+    port = _ports[port_num]
+    port.error = 0
+    if port.fd is None:
+        port.result = COMM_PORT_BUSY
+        return {}
+    import termios
+    termios.tcflush(port.fd, termios.TCIFLUSH)
+    port.parser.Reset()
+    view = memoryview(packet)
+    try:
+        while view:
+            select.select([], [port.fd], [], 0.1)
+            view = view[os.write(port.fd, view):]
+    except OSError:
+        port.result = COMM_TX_FAIL
+        return {}
+    replies = {}
+    if ids:
+        bad_crc = port.parser.bad_crc
+        wire = (len(packet) + len(ids) * (11 + reply_len)) * 10. / port.baud
+        deadline = time.perf_counter() + wire + LATENCY_TIMER + 0.002
+        while len(replies) < len(ids):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not select.select([port.fd], [], [], remaining)[0]:
+                break
+            try:
+                data = os.read(port.fd, 4096)
+            except BlockingIOError:
+                continue
+            for dxl_id, error, params in port.parser.Feed(data):
+                if dxl_id in ids and dxl_id not in replies:
+                    replies[dxl_id] = params
+                    port.error = error
+        if len(replies) < len(ids):
+            port.result = COMM_RX_CORRUPT if port.parser.bad_crc > bad_crc else COMM_RX_TIMEOUT
+            return replies
+    port.result = COMM_SUCCESS
+    return replies
+
+
+def ping(port_num, protocol_version, dxl_id):
+    _transact(port_num, Protocol2.ping(dxl_id), [dxl_id], 3)
+
+
+def pingGetModelNum(port_num, protocol_version, dxl_id):
+    params = _transact(port_num, Protocol2.ping(dxl_id), [dxl_id], 3).get(dxl_id, b'')
+    return Protocol2.decode(params[0:2]) if len(params) >= 2 else 0
+
+
+def reboot(port_num, protocol_version, dxl_id):
+    _transact(port_num, Protocol2.reboot(dxl_id), [dxl_id])
+
+
+def readTxRx(port_num, protocol_version, dxl_id, address, length):
+    port = _ports[port_num]
+    port.data = _transact(port_num, Protocol2.read(dxl_id, address, length), [dxl_id], length).get(dxl_id, b'')
+
+
+def getDataRead(port_num, protocol_version, data_length, data_pos):
+    return Protocol2.decode(_ports[port_num].data[data_pos:data_pos + data_length])
+
+
+def _read(port_num, dxl_id, address, length):
+    readTxRx(port_num, 2, dxl_id, address, length)
+    data = _ports[port_num].data
+    return Protocol2.decode(data) if len(data) == length else 0
+
+
+def read1ByteTxRx(port_num, protocol_version, dxl_id, address):
+    return _read(port_num, dxl_id, address, 1)
+
+
+def read2ByteTxRx(port_num, protocol_version, dxl_id, address):
+    return _read(port_num, dxl_id, address, 2)
+
+
+def read4ByteTxRx(port_num, protocol_version, dxl_id, address):
+    return _read(port_num, dxl_id, address, 4)
+
+
+def _write(port_num, dxl_id, address, length, value, wait):
+    packet = Protocol2.write(dxl_id, address, Protocol2.encode(value, length))
+    _transact(port_num, packet, [dxl_id] if wait else [])
+
+
+def write1ByteTxOnly(port_num, protocol_version, dxl_id, address, data):
+    _write(port_num, dxl_id, address, 1, data, False)
+
+
+def write1ByteTxRx(port_num, protocol_version, dxl_id, address, data):
+    _write(port_num, dxl_id, address, 1, data, True)
+
+
+def write2ByteTxOnly(port_num, protocol_version, dxl_id, address, data):
+    _write(port_num, dxl_id, address, 2, data, False)
+
+
+def write2ByteTxRx(port_num, protocol_version, dxl_id, address, data):
+    _write(port_num, dxl_id, address, 2, data, True)
+
+
+def write4ByteTxOnly(port_num, protocol_version, dxl_id, address, data):
+    _write(port_num, dxl_id, address, 4, data, False)
+
+
+def write4ByteTxRx(port_num, protocol_version, dxl_id, address, data):
+    _write(port_num, dxl_id, address, 4, data, True)
+
+
+def _new_group(kind, port_num, addr = 0, length = 0):
+    # a cleared group of the same kind is reused, as in the C library
+    for group_num, group in enumerate(_groups):
+        if group.free and (group.kind, group.port_num, group.addr, group.length) == (kind, port_num, addr, length):
+            group.free = False
+            return group_num
+    _groups.append(_Group(kind, port_num, addr, length))
+    return len(_groups) - 1
+
+
+def _clear(group_num):
+    group = _groups[group_num]
+    group.params.clear()
+    group.data.clear()
+    group.free = True
+
+
+def _available(group_num, dxl_id, address, data_length):
+    group = _groups[group_num]
+    data = group.data.get(dxl_id)
+    if data is None:
+        return 0
+    start = group.params[dxl_id][0]
+    return 1 if start <= address and address + data_length <= start + len(data) else 0
+
+
+def _get(group_num, dxl_id, address, data_length):
+    if not _available(group_num, dxl_id, address, data_length):
+        return 0
+    group = _groups[group_num]
+    offset = address - group.params[dxl_id][0]
+    return Protocol2.decode(group.data[dxl_id][offset:offset + data_length])
+
+
+def groupSyncRead(port_num, protocol_version, start_address, data_length):
+    return _new_group('sync_read', port_num, start_address, data_length)
+
+
+def groupSyncReadAddParam(group_num, dxl_id):
+    group = _groups[group_num]
+    group.params[dxl_id] = (group.addr, group.length)
+    group.free = False
+    return 1
+
+
+def groupSyncReadRemoveParam(group_num, dxl_id):
+    _groups[group_num].params.pop(dxl_id, None)
+    _groups[group_num].data.pop(dxl_id, None)
+
+
+def groupSyncReadClearParam(group_num):
+    _clear(group_num)
+
+
+def groupSyncReadTxRxPacket(group_num):
+    group = _groups[group_num]
+    ids = list(group.params)
+    if not ids:
+        _ports[group.port_num].result = COMM_NOT_AVAILABLE
+        return
+    group.data = _transact(group.port_num, Protocol2.sync_read(group.addr, group.length, ids), ids, group.length)
+
+
+def groupSyncReadIsAvailable(group_num, dxl_id, address, data_length):
+    return _available(group_num, dxl_id, address, data_length)
+
+
+def groupSyncReadGetData(group_num, dxl_id, address, data_length):
+    return _get(group_num, dxl_id, address, data_length)
+
+
+def groupBulkRead(port_num, protocol_version):
+    return _new_group('bulk_read', port_num)
+
+
+def groupBulkReadAddParam(group_num, dxl_id, start_address, data_length):
+    group = _groups[group_num]
+    group.params[dxl_id] = (start_address, data_length)
+    group.free = False
+    return 1
+
+
+def groupBulkReadRemoveParam(group_num, dxl_id):
+    groupSyncReadRemoveParam(group_num, dxl_id)
+
+
+def groupBulkReadClearParam(group_num):
+    _clear(group_num)
+
+
+def groupBulkReadTxRxPacket(group_num):
+    group = _groups[group_num]
+    requests = [(dxl_id, addr, length) for dxl_id, (addr, length) in group.params.items()]
+    if not requests:
+        _ports[group.port_num].result = COMM_NOT_AVAILABLE
+        return
+    group.data = _transact(group.port_num, Protocol2.bulk_read(requests), [r[0] for r in requests],
+                           max(r[2] for r in requests))
+
+
+def groupBulkReadIsAvailable(group_num, dxl_id, address, data_length):
+    return _available(group_num, dxl_id, address, data_length)
+
+
+def groupBulkReadGetData(group_num, dxl_id, address, data_length):
+    return _get(group_num, dxl_id, address, data_length)
+
+
+def groupSyncWrite(port_num, protocol_version, start_address, data_length):
+    return _new_group('sync_write', port_num, start_address, data_length)
+
+
+def groupSyncWriteAddParam(group_num, dxl_id, data, data_length):
+    group = _groups[group_num]
+    group.params[dxl_id] = Protocol2.encode(data, group.length)
+    group.free = False
+    return 1
+
+
+def groupSyncWriteChangeParam(group_num, dxl_id, data, data_length, data_pos):
+    group = _groups[group_num]
+    if dxl_id not in group.params:
+        return 0
+    value = bytearray(group.params[dxl_id])
+    value[data_pos:data_pos + data_length] = Protocol2.encode(data, data_length)
+    group.params[dxl_id] = bytes(value)
+    return 1
+
+
+def groupSyncWriteRemoveParam(group_num, dxl_id):
+    _groups[group_num].params.pop(dxl_id, None)
+
+
+def groupSyncWriteClearParam(group_num):
+    _clear(group_num)
+
+
+def groupSyncWriteTxPacket(group_num):
+    group = _groups[group_num]
+    if not group.params:
+        _ports[group.port_num].result = COMM_NOT_AVAILABLE
+        return
+    _transact(group.port_num, Protocol2.sync_write(group.addr, group.length, group.params))
@@ -19,256 +19,13 @@
 
 # Jason's update: Implemented extra controls: "h" for hello, "w" for the whip dance, "t" to go to the surface and tap it twice
 # Also fixed the problem of jerky motions by using a rectangular velocity profile.
+# For smooth jogging with the same keys in velocity control, see VelocityTeleop.py.
 
-import os, ctypes, struct
 import keyboard
 import time
 
-if os.name == 'nt':
-    import msvcrt
-    def getch():
-        return msvcrt.getch().decode()
-else:
-    import sys, tty, termios
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-    def getch():
-        try:
-            tty.setraw(sys.stdin.fileno())
-            ch = sys.stdin.read(1)
-        finally:
-            termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
-        return ch
+from CurrentReader import DynamixelReader                   # closes (torque off) at exit and on SIGTERM
 
-os.sys.path.append('../DynamixelSDK-master/python/dynamixel_functions_py')             # Path setting
-os.sys.path.append('.')             # Path setting
-cwd=os.getcwd()
-os.chdir('../DynamixelSDK-master/python/dynamixel_functions_py')
-import dynamixel_functions as dynamixel                     # Uses Dynamixel SDK library
-os.chdir(cwd)
-import datetime
-
-
-COMM_SUCCESS                = 0                             # Communication Success result value
-COMM_TX_FAIL                = -1001                         # Communication Tx Failed
-
-
-
-class DynamixelReader:
-    def __init__(self,
-                 # Check which port is being used on your controller
-                 device_name = "COM5".encode('utf-8'),
-                 # baud rate
-                 baud_rate = 1000000,
-                 # motor ids
-                 m1id = 100,
-                 m2id = 101,
-                 m3id = 102,
-                 m4id = 103,
-                 #protocol ver
-                 proto_ver = 2,
-                 #SyncRead Addr
-                 read_addr = 126,
-                 #SyncRead Len
-                 read_len = 2):
-        self.baud_rate = baud_rate
-        self.device_name = device_name
-        self.m1id = m1id
-        self.m2id = m2id
-        self.m3id = m3id
-        self.m4id = m4id
-        self.proto_ver = proto_ver
-        self.read_addr = read_addr
-        self.read_len = read_len
-
-        # Initialize PortHandler Structs
-        # Set the port path
-        # Get methods and members of PortHandlerLinux or PortHandlerWindows
-        self.port_num = dynamixel.portHandler(device_name)
-        dynamixel.setPacketTimeoutMSec(1)
-        # Initialize PacketHandler Structs
-        dynamixel.packetHandler()
-        # Initialize Groupsyncread Structs for Current
-        self.groupread_num = dynamixel.groupSyncRead(self.port_num, proto_ver, read_addr,read_len) #0, 148
-        dt = datetime.datetime.now()
-        self.timestamp0 = dt.minute * 60000000 + dt.second * 1000000 + dt.microsecond
-        self.Init_Port_And_Motors()
-        self.Init_Param_Storage()
-
-    def __del__(self):
-        self.Disable_Torque_Close_Port()
-
-    def Init_Port_And_Motors(self):
-        # Open port
-        if dynamixel.openPort(self.port_num):
-            print("Successfully opened the port!")
-        else:
-            print("Failed to open the port!")
-            print("Press any key to terminate...")
-            getch()
-            quit()
-        # Set port baudrate
-        if dynamixel.setBaudRate(self.port_num, self.baud_rate):
-            print("Successfully set the baudrate!")
-        else:
-            print("Failed to change the baudrate!")
-            print("Press any key to terminate...")
-            getch()
-            quit()
-        ADDR_PRO_TORQUE_ENABLE = 64
-        TORQUE_ENABLE = 1
-        dxl_comm_result = COMM_TX_FAIL
-        # Enable Dynamixel#1 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m1id, ADDR_PRO_TORQUE_ENABLE, TORQUE_ENABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#1 has been successfully connected")
-        # Enable Dynamixel#2 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m2id, ADDR_PRO_TORQUE_ENABLE, TORQUE_ENABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#2 has been successfully connected")
-        # Enable Dynamixel#3 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m3id, ADDR_PRO_TORQUE_ENABLE, TORQUE_ENABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#3 has been successfully connected")
-        # Enable Dynamixel#4 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m4id, ADDR_PRO_TORQUE_ENABLE, TORQUE_ENABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#4 has been successfully connected")
-
-    def Init_Param_Storage(self):
-        groupread_num = self.groupread_num
-        # Add parameter storage for Dynamixel#1 current
-        dxl_addparam_result = ctypes.c_ubyte(dynamixel.groupSyncReadAddParam(groupread_num, self.m1id)).value
-        if dxl_addparam_result != 1:
-            print("[ID:%03d] groupSyncRead addparam failed" % (self.m1id))
-            quit()
-
-        # Add parameter storage for Dynamixel#2 current
-        dxl_addparam_result = ctypes.c_ubyte(dynamixel.groupSyncReadAddParam(groupread_num, self.m2id)).value
-        if dxl_addparam_result != 1:
-            print("[ID:%03d] groupSyncRead addparam failed" % (self.m2id))
-            quit()
-
-        # Add parameter storage for Dynamixel#2 current
-        dxl_addparam_result = ctypes.c_ubyte(dynamixel.groupSyncReadAddParam(groupread_num, self.m3id)).value
-        if dxl_addparam_result != 1:
-            print("[ID:%03d] groupSyncRead addparam failed" % (self.m3id))
-            quit()
-
-        # Add parameter storage for Dynamixel#4 current
-        dxl_addparam_result = ctypes.c_ubyte(dynamixel.groupSyncReadAddParam(groupread_num, self.m4id)).value
-        if dxl_addparam_result != 1:
-            print("[ID:%03d] groupSyncRead addparam failed" % (self.m4id))
-            quit()
-
-    def Set_Value(self, motorId, set_addr, set_len, value):
-        if(set_len == 4):
-            dynamixel.write4ByteTxRx(self.port_num, self.proto_ver, motorId, set_addr, value)
-        elif(set_len == 2):
-            dynamixel.write2ByteTxRx(self.port_num, self.proto_ver, motorId, set_addr, value)
-        elif(set_len == 1):
-            dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, motorId, set_addr, value)
-        else:
-            print('[ID:%03d]: invalid set length %d' %(motorId, set_len))
-            return
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-
-    def Disable_Torque_Close_Port(self):
-        ADDR_PRO_TORQUE_ENABLE = 64
-        TORQUE_DISABLE = 0
-        dxl_comm_result = COMM_TX_FAIL
-        # Enable Dynamixel#1 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m1id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#1 has been successfully freed")
-        # Enable Dynamixel#2 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m2id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#2 has been successfully freed")
-        # Enable Dynamixel#3 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m3id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#3 has been successfully freed")
-        # Enable Dynamixel#4 Torque
-        dynamixel.write1ByteTxRx(self.port_num, self.proto_ver, self.m4id, ADDR_PRO_TORQUE_ENABLE, TORQUE_DISABLE)
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        else:
-            print("Dynamixel#4 has been successfully freed")
-
-        #close port
-        dynamixel.closePort(self.port_num)
-        
-    def Read_Value(self, motorId, read_addr, read_len):
-        # Read value
-        dxl_result = -1
-        if(read_len == 4):
-            dxl_result = dynamixel.read4ByteTxRx(self.port_num, self.proto_ver, motorId, read_addr)
-        elif(read_len == 2):
-            dxl_result = dynamixel.read2ByteTxRx(self.port_num, self.proto_ver, motorId, read_addr)
-        elif(read_len == 1):
-            dxl_result = dynamixel.read1ByteTxRx(self.port_num, self.proto_ver, motorId, read_addr)
-        else:
-            print('[ID:%03d]: invalid read length %d' %(motorId, read_len))
-            return dxl_result
-        dxl_comm_result = dynamixel.getLastTxRxResult(self.port_num, self.proto_ver)
-        dxl_error = dynamixel.getLastRxPacketError(self.port_num, self.proto_ver)
-        if dxl_comm_result != COMM_SUCCESS:
-            print(dynamixel.getTxRxResult(self.proto_ver, dxl_comm_result))
-        elif dxl_error != 0:
-            print(dynamixel.getRxPacketError(self.proto_ver, dxl_error))
-        return dxl_result
 
 if __name__ == '__main__':
 